@@ -0,0 +1,66 @@
+"""
+Authentication backend of the accounts app.
+
+The users log in with an identifier, either their email or their
+`username#tag`. The backend resolves both with a single query, the
+username is joined and loaded with the user so the response needs no
+further queries:
+
+```
+authenticate(request, identifier='player#1234', password='...')
+```
+"""
+
+# Django imports
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import Q
+
+
+def get_identifier_filter(identifier):
+    """
+    Returns the filter of the user of an identifier, None if the identifier
+    is malformed.
+    """
+    if '@' in identifier:
+        return Q(email=identifier)
+
+    username, separator, tag = identifier.partition('#')
+    if not (username and separator and tag):
+        return None
+
+    # Matches the unique index on (username, tag)
+    return Q(username__username=username, username__tag=tag)
+
+
+class IdentifierBackend(ModelBackend):
+    """
+    Authenticates with an email or a `username#tag` identifier.
+
+    The admin login passes the email as `username`, it is accepted as well.
+    """
+
+    def authenticate(self, request, username=None, password=None, identifier=None, **kwargs):
+        User = get_user_model()
+
+        if identifier is None:
+            identifier = username or kwargs.get(User.USERNAME_FIELD)
+        if identifier is None or password is None:
+            return None
+
+        query = get_identifier_filter(identifier)
+
+        try:
+            if query is None:
+                raise User.DoesNotExist
+            user = User._default_manager.select_related('username').get(query)
+        except User.DoesNotExist:
+            # Run the hasher anyway, so the response time does not tell
+            # whether the user exists
+            User().set_password(password)
+            return None
+
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+
+        return None
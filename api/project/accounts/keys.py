@@ -0,0 +1,348 @@
+"""
+Signing keys of the JSON web tokens.
+
+The tokens are signed with asymmetric keys (RS256 or EdDSA) kept in the
+JWT_KEYS_DIR directory, one PEM file per key named after its `kid`. The
+`kid` is set in the header of every token, and the public keys are
+published at /.well-known/jwks.json so other services can verify the
+tokens locally instead of calling this API.
+
+Keys are rotated with the rotate_signing_keys command:
+
+- The new key is published right away, but it only starts signing after
+  JWT_KEY_ACTIVATION_DELAY, once the verifiers had the time to refresh
+  their cached JWKS.
+- A retired key stays published until the last token it signed expires,
+  it is deleted by the next rotation after that.
+
+Without keys the tokens are signed with HS256 and SIGNING_KEY as before.
+The HS256 tokens, which have no `kid`, are accepted while JWT_ACCEPT_HS256
+is on so the tokens issued before the migration keep working.
+"""
+
+# Native imports
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+
+# Django imports
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+# Module imports
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+import jwt
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+from jwt.exceptions import InvalidAlgorithmError, InvalidTokenError
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+
+
+# The algorithms of the key ring and their JWK serializers
+KEY_ALGORITHMS = {
+    'RS256': RSAAlgorithm,
+    'EdDSA': OKPAlgorithm,
+}
+
+KID_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+class SigningKey:
+    """
+    A private key of the key ring and its public JWK.
+    """
+
+    def __init__(self, kid, private_key):
+        self.kid = kid
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+
+        if isinstance(private_key, rsa.RSAPrivateKey):
+            self.algorithm = 'RS256'
+        elif isinstance(private_key, ed25519.Ed25519PrivateKey):
+            self.algorithm = 'EdDSA'
+        else:
+            raise ValueError(f'Unsupported key type for {kid}')
+
+        created = datetime.strptime(kid.split('-')[0], KID_TIME_FORMAT)
+        self.created = created.replace(tzinfo=timezone.utc).timestamp()
+
+    @classmethod
+    def generate(cls, algorithm):
+        if algorithm == 'RS256':
+            private_key = rsa.generate_private_key(
+                public_exponent=65537, key_size=2048)
+        elif algorithm == 'EdDSA':
+            private_key = ed25519.Ed25519PrivateKey.generate()
+        else:
+            raise ValueError(f'Unsupported algorithm {algorithm}')
+
+        # Sorts by creation time, the suffix keeps the kids unique
+        kid = '{}-{}'.format(
+            datetime.now(timezone.utc).strftime(KID_TIME_FORMAT),
+            secrets.token_hex(4),
+        )
+        return cls(kid, private_key)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            private_key = serialization.load_pem_private_key(
+                file.read(), password=None)
+
+        kid = os.path.splitext(os.path.basename(path))[0]
+        return cls(kid, private_key)
+
+    def save(self, directory):
+        pem = self.private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+
+        # Written aside and moved, the readers never see a partial file
+        path = os.path.join(directory, f'{self.kid}.pem')
+        descriptor = os.open(
+            f'{path}.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(pem)
+        os.replace(f'{path}.tmp', path)
+
+    def to_jwk(self):
+        jwk = json.loads(KEY_ALGORITHMS[self.algorithm].to_jwk(self.public_key))
+        jwk.update(kid=self.kid, alg=self.algorithm, use='sig')
+        return jwk
+
+
+class KeyRing:
+    """
+    The signing keys of a directory, reloaded every reload interval so the
+    rotations are picked up by the running processes.
+    """
+
+    def __init__(self, directory, activation_delay=0, reload_interval=60):
+        self.directory = directory
+        self.activation_delay = activation_delay
+        self.reload_interval = reload_interval
+        self.keys = {}
+        self.jwks = b'{"keys": []}'
+        self.etag = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        keys = {}
+        if self.directory and os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pem'):
+                    key = SigningKey.load(entry.path)
+                    keys[key.kid] = key
+
+        # The JWKS document is served as is, it is only built on reload
+        jwks = json.dumps({
+            'keys': [key.to_jwk() for key in self.sorted_keys(keys)],
+        }).encode()
+
+        self.keys, self.jwks = keys, jwks
+        self.etag = hashlib.sha256(jwks).hexdigest()[:32]
+        self.loaded_at = time.monotonic()
+
+    def refresh(self):
+        if self.loaded_at is not None \
+                and time.monotonic() - self.loaded_at < self.reload_interval:
+            return
+
+        with self.lock:
+            if self.loaded_at is None \
+                    or time.monotonic() - self.loaded_at >= self.reload_interval:
+                self.load()
+
+    @staticmethod
+    def sorted_keys(keys):
+        return sorted(keys.values(), key=lambda key: key.kid)
+
+    def get_signing_key(self):
+        """
+        Returns the newest active key, None without keys.
+
+        Until a key is activated the oldest key signs, so the first key of
+        a ring signs right away.
+        """
+        self.refresh()
+
+        keys = self.sorted_keys(self.keys)
+        now = time.time()
+        active = [key for key in keys if key.created + self.activation_delay <= now]
+
+        if active:
+            return active[-1]
+        return keys[0] if keys else None
+
+    def get_verifying_key(self, kid):
+        self.refresh()
+        key = self.keys.get(kid)
+
+        # The key may have been added since the last reload, unknown kids
+        # reload the directory at most once a second
+        if key is None and time.monotonic() - self.loaded_at >= 1:
+            with self.lock:
+                self.load()
+            key = self.keys.get(kid)
+
+        return key
+
+    def get_jwks(self):
+        self.refresh()
+        return self.jwks
+
+    def get_etag(self):
+        self.refresh()
+        return self.etag
+
+    def rotate(self, algorithm, max_token_lifetime):
+        """
+        Adds a new key and deletes the retired keys whose tokens expired.
+
+        Returns:
+            tuple: The new key and the kids of the deleted keys.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.load()
+
+        key = SigningKey.generate(algorithm)
+        key.save(self.directory)
+
+        now = time.time()
+        keys = self.sorted_keys(self.keys) + [key]
+        deleted = []
+
+        # A key signs until the next key is activated
+        for retired, successor in zip(keys, keys[1:]):
+            retired_at = successor.created + self.activation_delay
+            if retired_at + max_token_lifetime < now:
+                os.remove(os.path.join(self.directory, f'{retired.kid}.pem'))
+                deleted.append(retired.kid)
+
+        self.load()
+        return key, deleted
+
+
+class KeyRingTokenBackend(TokenBackend):
+    """
+    Token backend which signs with the active key of the key ring and
+    verifies with the key named by the `kid` of the token.
+
+    Each key only verifies its own algorithm, the algorithm of the token
+    header is never trusted.
+    """
+
+    def __init__(self, key_ring, accept_hs256=True):
+        super().__init__(
+            api_settings.ALGORITHM,
+            api_settings.SIGNING_KEY,
+            api_settings.VERIFYING_KEY,
+            api_settings.AUDIENCE,
+            api_settings.ISSUER,
+            None,
+            api_settings.LEEWAY,
+            api_settings.JSON_ENCODER,
+        )
+        self.key_ring = key_ring
+        self.accept_hs256 = accept_hs256
+
+    def encode(self, payload):
+        key = self.key_ring.get_signing_key()
+        if key is None:
+            return super().encode(payload)
+
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload['aud'] = self.audience
+        if self.issuer is not None:
+            jwt_payload['iss'] = self.issuer
+
+        return jwt.encode(
+            jwt_payload,
+            key.private_key,
+            algorithm=key.algorithm,
+            headers={'kid': key.kid},
+            json_encoder=self.json_encoder,
+        )
+
+    def decode(self, token, verify=True):
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid or expired')) from ex
+
+        if kid is None:
+            if not self.accept_hs256:
+                raise TokenBackendError(_('Token is invalid or expired'))
+            return super().decode(token, verify=verify)
+
+        key = self.key_ring.get_verifying_key(kid)
+        if key is None:
+            raise TokenBackendError(_('Token is invalid or expired'))
+
+        try:
+            return jwt.decode(
+                token,
+                key.public_key,
+                algorithms=[key.algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    'verify_aud': self.audience is not None,
+                    'verify_signature': verify,
+                },
+            )
+        except InvalidAlgorithmError as ex:
+            raise TokenBackendError(_('Invalid algorithm specified')) from ex
+        except InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid or expired')) from ex
+
+
+# One key ring and backend per configuration, the settings are read on
+# every call so they can be overridden in the tests
+_key_rings = {}
+_token_backends = {}
+
+
+def get_key_ring():
+    config = (
+        getattr(settings, 'JWT_KEYS_DIR', None),
+        getattr(settings, 'JWT_KEY_ACTIVATION_DELAY', 1800),
+        getattr(settings, 'JWT_KEYS_RELOAD_INTERVAL', 60),
+    )
+
+    key_ring = _key_rings.get(config)
+    if key_ring is None:
+        key_ring = _key_rings.setdefault(config, KeyRing(*config))
+
+    return key_ring
+
+
+def get_token_backend():
+    key_ring = get_key_ring()
+    accept_hs256 = getattr(settings, 'JWT_ACCEPT_HS256', True)
+
+    backend = _token_backends.get((key_ring, accept_hs256))
+    if backend is None:
+        backend = _token_backends.setdefault(
+            (key_ring, accept_hs256), KeyRingTokenBackend(key_ring, accept_hs256))
+
+    return backend
+
+
+def get_max_token_lifetime():
+    return max(
+        api_settings.ACCESS_TOKEN_LIFETIME,
+        api_settings.REFRESH_TOKEN_LIFETIME,
+    ).total_seconds()
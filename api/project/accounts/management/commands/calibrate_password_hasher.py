@@ -0,0 +1,53 @@
+"""
+Measures the password hasher on this machine and recommends the
+PASSWORD_HASHER_ITERATIONS setting, see utils/hashers.py.
+"""
+
+import hashlib
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+
+# Iterations of the measured hashes
+PROBE_ITERATIONS = 100000
+
+
+class Command(BaseCommand):
+    help = 'Benchmark PBKDF2 and recommend the hasher iterations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target-ms', type=float, default=250,
+            help='Time a single hash should take, in milliseconds')
+        parser.add_argument('--samples', type=int, default=10)
+
+    def handle(self, *args, **options):
+        durations = []
+        for _ in range(options['samples']):
+            start = time.perf_counter()
+            hashlib.pbkdf2_hmac('sha256', b'password', b'salt', PROBE_ITERATIONS)
+            durations.append(time.perf_counter() - start)
+
+        per_iteration = statistics.median(durations) / PROBE_ITERATIONS
+        iterations = int(options['target_ms'] / 1000 / per_iteration)
+
+        iterations = max(round(iterations, -4), 10000)
+
+        # The hashes release the GIL, the request threads hash on every core
+        cores = os.cpu_count() or 1
+        throughput = cores / (iterations * per_iteration)
+
+        self.stdout.write(
+            f'PBKDF2-SHA256: {per_iteration * 1e6:.3f} us per iteration')
+        self.stdout.write(
+            f'PASSWORD_HASHER_ITERATIONS={iterations} takes about '
+            f'{options["target_ms"]:.0f} ms per hash, {throughput:.0f} hashes '
+            f'per second with {cores} cores')
+        # OWASP recommends at least 600000 iterations for PBKDF2-SHA256
+        if iterations < 600000:
+            self.stdout.write(self.style.WARNING(
+                'Below the 600000 iterations recommended by OWASP, raise '
+                '--target-ms or use faster hardware'))
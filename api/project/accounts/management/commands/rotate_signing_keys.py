@@ -0,0 +1,33 @@
+"""
+Rotates the signing keys of the JSON web tokens, see accounts/keys.py.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Local imports
+from accounts.keys import KEY_ALGORITHMS, get_key_ring, get_max_token_lifetime
+
+
+class Command(BaseCommand):
+    help = 'Add a new JWT signing key and delete the retired keys whose tokens expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--algorithm',
+            choices=sorted(KEY_ALGORITHMS),
+            default=getattr(settings, 'JWT_KEY_ALGORITHM', 'RS256'),
+        )
+
+    def handle(self, *args, **options):
+        key_ring = get_key_ring()
+        if not key_ring.directory:
+            raise CommandError('JWT_KEYS_DIR is not configured.')
+
+        key, deleted = key_ring.rotate(options['algorithm'], get_max_token_lifetime())
+
+        self.stdout.write(
+            f'Added {key.algorithm} key {key.kid}, it signs the tokens after '
+            f'{key_ring.activation_delay} seconds.')
+        for kid in deleted:
+            self.stdout.write(f'Deleted retired key {kid}.')
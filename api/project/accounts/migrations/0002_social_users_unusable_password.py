@@ -0,0 +1,19 @@
+from django.contrib.auth.hashers import make_password
+from django.db import migrations
+
+
+def set_unusable_passwords(apps, schema_editor):
+    # The social users were created with the OAuth client key as password
+    User = apps.get_model('accounts', 'User')
+    User.objects.filter(provider='GOOGLE').update(password=make_password(None))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_unusable_passwords, migrations.RunPython.noop),
+    ]
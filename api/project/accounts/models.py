@@ -15,7 +15,6 @@ from django.contrib.auth.models import (
 from django.contrib.auth.base_user import BaseUserManager
 import random
 from utils.errors import BadRequestError
-from django.conf import settings
 
 
 USER_PROVIDERS = (
@@ -45,7 +44,14 @@ class UserManager(BaseUserManager):
 
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
-        user.set_password(password)
+
+        # Users without a password, the social users, can not log in with
+        # one and skip the hashing
+        if password is None:
+            user.set_unusable_password()
+        else:
+            user.set_password(password)
+
         user.save(using=self._db)
         return user
 
@@ -67,9 +73,8 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault('is_dob_verified', False)
         extra_fields.setdefault('provider', provider)
 
-        password = settings.SOCIAL_AUTH_GOOGLE_OAUTH2_KEY
-
-        return self._create_user(email, password, **extra_fields)
+        # Social users authenticate with their provider only
+        return self._create_user(email, None, **extra_fields)
 
     def create_superuser(self, email=None, password=None, **extra_fields):
         """ Method to create a super user """
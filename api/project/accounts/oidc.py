@@ -0,0 +1,180 @@
+"""
+Verification of the Google ID tokens of the social logins.
+
+The signing keys of the issuer are fetched from GOOGLE_OIDC_JWKS_URL once
+per process and kept for the max-age of the response, every login after
+that is verified locally:
+
+- The keys are refreshed in the background shortly before they expire, so
+  the logins never wait on Google once the keys are loaded.
+- The requests go through the shared Google session of utils.clients,
+  pooled and wrapped by CacheControl. The refreshes are conditional
+  requests answered with 304 when the keys did not change.
+- A token signed by an unknown key reloads the keys, at most once per
+  JWKS_MIN_RELOAD_INTERVAL, Google may have rotated them early.
+
+GOOGLE_OIDC_ISSUER and GOOGLE_OIDC_JWKS_URL point at Google by default,
+tests and load tests can point them at a local OIDC issuer.
+"""
+
+# Native imports
+import re
+import threading
+import time
+
+# Django imports
+from django.conf import settings
+
+# Module imports
+import jwt
+import requests
+
+# Local imports
+from utils.clients import get_google_session, get_timeouts
+
+# Used when the response of the issuer has no max-age
+DEFAULT_MAX_AGE = 3600
+
+# Seconds before the expiry of the keys when they are refreshed
+REFRESH_MARGIN = 300
+
+JWKS_MIN_RELOAD_INTERVAL = 10
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+def get_max_age(response):
+    match = MAX_AGE_PATTERN.search(response.headers.get('Cache-Control', ''))
+    return int(match.group(1)) if match else DEFAULT_MAX_AGE
+
+
+class JWKSCache:
+    """
+    The signing keys of an issuer, shared by the threads of the process.
+    """
+
+    def __init__(self, url, session=None):
+        self.url = url
+        self.session = session
+        self.keys = None
+        self.expires_at = 0
+        self.fetched_at = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def fetch(self, revalidate=False):
+        headers = {'Cache-Control': 'no-cache'} if revalidate else {}
+        # The shared session by default, it is closed and created again
+        # with the other clients
+        session = self.session or get_google_session()
+        response = session.get(self.url, headers=headers, timeout=get_timeouts())
+        response.raise_for_status()
+
+        keys = {}
+        for jwk in response.json()['keys']:
+            keys[jwk['kid']] = jwt.PyJWK(jwk)
+
+        now = time.monotonic()
+        self.keys = keys
+        self.fetched_at = now
+        self.expires_at = now + get_max_age(response)
+
+    def get_keys(self):
+        now = time.monotonic()
+
+        if self.keys is None or now >= self.expires_at:
+            with self.lock:
+                if self.keys is None or time.monotonic() >= self.expires_at:
+                    self.fetch()
+        elif now >= self.expires_at - REFRESH_MARGIN:
+            self.refresh_in_background()
+
+        return self.keys
+
+    def get_key(self, kid):
+        key = self.get_keys().get(kid)
+
+        if key is None and time.monotonic() - self.fetched_at >= JWKS_MIN_RELOAD_INTERVAL:
+            with self.lock:
+                if time.monotonic() - self.fetched_at >= JWKS_MIN_RELOAD_INTERVAL:
+                    self.fetch(revalidate=True)
+            key = self.keys.get(kid)
+
+        return key
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def refresh(self):
+        try:
+            self.fetch(revalidate=True)
+        except requests.RequestException:
+            # The current keys are used until they expire
+            pass
+        finally:
+            self.refreshing = False
+
+
+_jwks_caches = {}
+_jwks_lock = threading.Lock()
+
+
+def get_google_jwks():
+    url = getattr(
+        settings, 'GOOGLE_OIDC_JWKS_URL', 'https://www.googleapis.com/oauth2/v3/certs')
+
+    jwks = _jwks_caches.get(url)
+    if jwks is None:
+        with _jwks_lock:
+            jwks = _jwks_caches.get(url)
+            if jwks is None:
+                jwks = _jwks_caches[url] = JWKSCache(url)
+
+    return jwks
+
+
+def get_google_issuers():
+    issuer = getattr(settings, 'GOOGLE_OIDC_ISSUER', 'https://accounts.google.com')
+
+    # Google sets the issuer with or without the scheme
+    return (issuer, issuer.split('://', 1)[-1])
+
+
+def verify_google_id_token(token):
+    """
+    Verifies a Google ID token.
+
+    Args:
+        token (str): The ID token sent by the client.
+
+    Returns:
+        dict: The claims of the token.
+
+    Raises:
+        ValueError: If the token is invalid, expired or was not issued for
+            this client.
+    """
+    try:
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = get_google_jwks().get_key(kid)
+        if key is None:
+            raise ValueError('Unknown signing key.')
+
+        claims = jwt.decode(
+            token,
+            key.key,
+            algorithms=['RS256'],
+            audience=settings.SOCIAL_AUTH_GOOGLE_OAUTH2_KEY,
+        )
+    except jwt.PyJWTError as e:
+        raise ValueError(str(e))
+
+    if claims.get('iss') not in get_google_issuers():
+        raise ValueError('Wrong issuer.')
+
+    return claims
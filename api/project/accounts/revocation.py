@@ -0,0 +1,84 @@
+"""
+Revocation of the refresh tokens.
+
+The revoked tokens are kept in the JWT_REVOCATION_CACHE cache, Redis in
+production, as one key per `jti` which expires with the token. Nothing is
+written to Postgres and the list never outgrows the live tokens:
+
+```
+jwt:revoked:<jti>              - The token was rotated or revoked
+jwt:revoked-before:<user_id>   - Every token of the user issued until then
+```
+
+A refresh token is checked with a single round trip when it is decoded,
+and rotating it claims its `jti` atomically (SET NX), so a token can only
+be rotated once even by concurrent requests.
+"""
+
+# Native imports
+import time
+
+# Django imports
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+
+# Module imports
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+# Local imports
+from accounts.keys import get_max_token_lifetime
+
+
+def get_cache():
+    return caches[getattr(settings, 'JWT_REVOCATION_CACHE', 'default')]
+
+
+def get_token_key(jti):
+    return f'jwt:revoked:{jti}'
+
+
+def get_user_key(user_id):
+    return f'jwt:revoked-before:{user_id}'
+
+
+def check_revoked(token):
+    """
+    Raises TokenError if the token or every token of its user was revoked.
+    """
+    token_key = get_token_key(token[api_settings.JTI_CLAIM])
+    user_key = get_user_key(token[api_settings.USER_ID_CLAIM])
+
+    revoked = get_cache().get_many([token_key, user_key])
+
+    if token_key in revoked:
+        raise TokenError(_('Token is blacklisted'))
+
+    revoked_before = revoked.get(user_key)
+    if revoked_before is not None and token.get('iat', 0) <= revoked_before:
+        raise TokenError(_('Token is blacklisted'))
+
+
+def revoke(token):
+    """
+    Revokes the token until it expires.
+
+    Returns:
+        bool: False if the token was already revoked.
+    """
+    ttl = token['exp'] - int(time.time())
+    if ttl <= 0:
+        # Expired tokens are rejected anyway
+        return False
+
+    return get_cache().add(
+        get_token_key(token[api_settings.JTI_CLAIM]), True, timeout=ttl)
+
+
+def revoke_user(user_id):
+    """
+    Revokes every token issued to the user so far.
+    """
+    get_cache().set(
+        get_user_key(user_id), int(time.time()), timeout=get_max_token_lifetime())
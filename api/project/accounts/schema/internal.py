@@ -0,0 +1,108 @@
+"""
+Internal schema of the accounts app, for the other services.
+
+The queries are served at /internal/accounts/ and need a service token in
+the INTERNAL_SERVICE_HEADER header instead of a user token. Each call takes
+up to INTERNAL_BATCH_MAX_SIZE tokens or user ids:
+
+```graphql
+query {
+    verifyTokens(tokens: ["<access_token>", "<access_token>"]) {
+        valid
+        error
+        user { id email }
+    }
+    users(ids: [1, 2, 3]) { id email }
+}
+```
+
+The tokens are verified from the token cache of utils.auth, the users of the
+tokens missing from it are loaded with a single query.
+"""
+
+# Django imports
+from django.conf import settings
+
+# Graphene imports
+import graphene
+
+# Local imports
+from accounts.models import User
+from accounts.schema.types import UserType
+from utils.auth import get_cached_jwt_authentication, is_internal_service
+from utils.errors import AuthenticationError, ValidationError
+
+
+def check_batch(info, items):
+    """
+    Raises if the caller is not an internal service or the batch is too big.
+    """
+    if not is_internal_service(info.context):
+        raise AuthenticationError('A valid service token is required.')
+
+    max_size = getattr(settings, 'INTERNAL_BATCH_MAX_SIZE', 100)
+    if len(items) > max_size:
+        raise ValidationError(f'At most {max_size} items per call.')
+
+
+def get_error_message(error):
+    detail = error.detail
+    if isinstance(detail, dict):
+        detail = detail.get('detail')
+
+    return str(detail)
+
+
+class TokenVerificationType(graphene.ObjectType):
+    """
+    The result of the verification of a token.
+    """
+    valid = graphene.Boolean(required=True)
+    error = graphene.String()
+    user = graphene.Field(UserType)
+
+
+class Query(graphene.ObjectType):
+    """
+    # Internal accounts queries
+    - `verifyTokens` - Verify a batch of access tokens
+    - `users` - Fetch a batch of users by id, null for the missing ones
+    """
+    verify_tokens = graphene.List(
+        graphene.NonNull(TokenVerificationType),
+        tokens=graphene.List(graphene.NonNull(graphene.String), required=True),
+    )
+    users = graphene.List(
+        UserType,
+        ids=graphene.List(graphene.NonNull(graphene.ID), required=True),
+    )
+
+    def resolve_verify_tokens(self, info, tokens):
+        check_batch(info, tokens)
+
+        results = []
+        for result in get_cached_jwt_authentication().authenticate_tokens(tokens):
+            if isinstance(result, Exception):
+                results.append(TokenVerificationType(
+                    valid=False, error=get_error_message(result)))
+            else:
+                results.append(TokenVerificationType(valid=True, user=result[0]))
+
+        return results
+
+    def resolve_users(self, info, ids):
+        check_batch(info, ids)
+
+        try:
+            ids = [int(user_id) for user_id in ids]
+        except ValueError:
+            raise ValidationError('The ids must be integers.')
+
+        # Only the selected columns and relations are fetched
+        queryset = UserType.get_queryset(User.objects.filter(pk__in=ids), info)
+        users = {user.pk: user for user in queryset}
+
+        return [users.get(user_id) for user_id in ids]
+
+
+schema = graphene.Schema(query=Query)
@@ -9,13 +9,12 @@ import random
 # Graphene imports
 import graphene
 
-# Django imports
-from rest_framework_simplejwt.tokens import RefreshToken
-
 # Local imports
+from accounts.tokens import get_tokens_for_user
 from accounts.schema.types import UserType
 from accounts.models import User, Referral, Referred
 from utils.mutations.public import PublicMutation
+from utils.throttling import throttle, get_client_ip
 from utils.errors import BadRequestError, ServerError
 
 
@@ -67,6 +66,8 @@ class CreateUser(PublicMutation):
         referral = graphene.String(required=False)
 
     def mutate(self, info, email, password, dob, is_policies_accepted, referral=None):
+        throttle('signup_ip', get_client_ip(info.context))
+
         try:                                                                            
             if is_policies_accepted is False:
                 raise BadRequestError("You must accept the user policies to proceed")
@@ -83,29 +84,31 @@ class CreateUser(PublicMutation):
                 raise BadRequestError(
                     'Password must be at least 8 characters long')
 
+            referral_obj = None
             if referral:
                 if len(referral) >= 35:
                     raise BadRequestError('Referral code too long.')
 
-                if not Referral.objects.filter(code=referral).exists():
+                # Fetched once, it is reused for the Referred object
+                referral_obj = Referral.objects.filter(code=referral).first()
+                if referral_obj is None:
                     raise BadRequestError('Invalid referral code.')
 
+            # The manager saves the user, there is no need to save it again
             user = User.objects.create_email_user(
                 email=email,
                 dob=dob,
                 password=password
             )
-            user.save()
 
-            if referral is not None:
+            if referral_obj is not None:
                 Referred.objects.create(
                     user=user,
-                    referral=Referral.objects.get(code=referral)
+                    referral=referral_obj
                 )
 
             # Generate access and refresh tokens
-            access_token, refresh_token = RefreshToken.for_user(
-                user).access_token, RefreshToken.for_user(user)
+            access_token, refresh_token = get_tokens_for_user(user)
 
             return CreateUser(user=user,  message='User created successfully', accessToken=str(access_token), refreshToken=str(refresh_token))
         except Exception as e:
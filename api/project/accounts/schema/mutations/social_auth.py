@@ -10,18 +10,15 @@ import random
 # Graphene imports
 import graphene
 
-# Django imports
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.conf import settings
-from google.oauth2 import id_token
-from google.auth.transport import requests
-
 # Local imports
+from accounts import oidc
+from accounts.tokens import get_tokens_for_user
 from accounts.schema.types import UserType
 from accounts.models import User, Referral, Referred, USER_PROVIDERS
 from utils.mutations.public import PublicMutation
 from utils.mutations.private import PrivateMutation
 from utils.errors import BadRequestError, ServerError
+from utils.tracing import trace_external
 
 
 class CreateOauthUser(PublicMutation):
@@ -68,12 +65,8 @@ class CreateOauthUser(PublicMutation):
         """ Get user data from google resource with the oauth token. """
         try:
             # Get user info from google.
-            client_id = settings.SOCIAL_AUTH_GOOGLE_OAUTH2_KEY
-            id_info = id_token.verify_oauth2_token(
-                token, requests.Request(), client_id)
-            if id_info['iss'] not in ['accounts.google.com',
-                                      'https://accounts.google.com']:
-                raise ValueError('Wrong issuer.')
+            with trace_external('google'):
+                id_info = oidc.verify_google_id_token(token)
             user_info = id_info
         except ValueError as e:
             print(e)
@@ -115,19 +108,19 @@ class CreateOauthUser(PublicMutation):
 
         try:
 
-            if User.objects.filter(email=user_email).exists():
+            user = User.objects.filter(email=user_email).first()
+
+            if user is not None:
                 message = 'User already exists'
-                user = User.objects.get(email=user_email)
 
             else:
                 message = 'User created successfully'
+                # The manager saves the user, there is no need to save it again
                 user = User.objects.create_social_user(
                     email=user_email,
                     provider=provider
                 )
 
-                user.save()
-
                 if referral is not None and len(referral) != 0:
                     Referred.objects.create(
                         user=user,
@@ -135,8 +128,7 @@ class CreateOauthUser(PublicMutation):
                     )
 
             # Generate access and refresh tokens
-            access_token, refresh_token = RefreshToken.for_user(
-                user).access_token, RefreshToken.for_user(user)
+            access_token, refresh_token = get_tokens_for_user(user)
 
             return CreateOauthUser(user=user,  message=message, access_token=str(access_token), refresh_token=str(refresh_token))
         except Exception as e:
@@ -160,16 +152,21 @@ class UpdateUserDOB(PrivateMutation):
                 id
                 dob
             }
+            accessToken
+            refreshToken
         }
     }
     ```
 
-    This mutation updates the user's dob with the provided date.
+    This mutation updates the user's dob with the provided date. New tokens are
+    returned since the dob verification is one of the claims of the tokens.
     """
 
     EXEMPT_CHECKS = True
 
     user = graphene.Field(UserType)
+    access_token = graphene.String()
+    refresh_token = graphene.String()
 
     class Arguments:
         dob = graphene.Date(required=True)
@@ -201,7 +198,11 @@ class UpdateUserDOB(PrivateMutation):
             else:
                 raise e
 
+        access_token, refresh_token = get_tokens_for_user(user)
+
         return UpdateUserDOB(
             user=user,
             message='DOB updated sucessfully',
+            access_token=access_token,
+            refresh_token=refresh_token,
         )
@@ -3,11 +3,7 @@ Mutation to obtain and refresh access and refresh tokens, this is used in the ac
 """
 
 # Django imports
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
-from django.conf import settings
-from google.oauth2 import id_token
-from google.auth.transport import requests
 
 # Graphene imports
 import graphene
@@ -15,11 +11,14 @@ from graphene_django import DjangoObjectType
 from graphql import GraphQLError
 
 # Local imports
+from accounts import oidc
+from accounts.tokens import get_tokens_for_user
 from accounts.schema.types import UserType
 from accounts.models import User, Username, USER_PROVIDERS
 from utils.mutations.public import PublicMutation
 from utils.mutations.private import PrivateMutation
 from utils.errors import BadRequestError, ServerError
+from utils.tracing import trace_external
 
 class ObtainSocialJSONWebToken(PublicMutation):
     """
@@ -65,12 +64,8 @@ class ObtainSocialJSONWebToken(PublicMutation):
 
         try:
             # Get user info from google.
-            client_id = settings.SOCIAL_AUTH_GOOGLE_OAUTH2_KEY
-            id_info = id_token.verify_oauth2_token(
-                token, requests.Request(), client_id)
-            if id_info['iss'] not in ['accounts.google.com',
-                                    'https://accounts.google.com']:
-                raise ValueError('Wrong issuer.')
+            with trace_external('google'):
+                id_info = oidc.verify_google_id_token(token)
             email = id_info
         except ValueError:
             raise BadRequestError(
@@ -105,8 +100,7 @@ class ObtainSocialJSONWebToken(PublicMutation):
             user = User.objects.get(email = user_email)
 
             # Generate access and refresh tokens
-            access_token, refresh_token = RefreshToken.for_user(
-                user).access_token, RefreshToken.for_user(user)
+            access_token, refresh_token = get_tokens_for_user(user)
             
             return ObtainSocialJSONWebToken(user=user,  message='logged in successfully', access_token=str(access_token), refresh_token=str(refresh_token))
         
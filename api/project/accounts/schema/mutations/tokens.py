@@ -3,7 +3,6 @@ Mutation to obtain and refresh access and refresh tokens, this is used in the ac
 """
 
 # Django imports
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 
 # Graphene imports
@@ -12,10 +11,11 @@ from graphene_django import DjangoObjectType
 from graphql import GraphQLError
 
 # Local imports
+from accounts.tokens import AccountRefreshToken
 from accounts.schema.types import UserType
-from accounts.models import User, Username
 from utils.mutations.public import PublicMutation
 from utils.mutations.private import PrivateMutation
+from utils.throttling import throttle, get_client_ip
 from utils.errors import BadRequestError, ServerError
 
 
@@ -73,28 +73,18 @@ class ObtainJSONWebToken(PublicMutation):
 
     def mutate(self, info, identifier, password):
 
-        email = None
-        username = None
+        # Every attempt costs a password hash, the attempts are limited per
+        # client and per account
+        throttle('login_ip', get_client_ip(info.context))
+        throttle('login_identifier', identifier.lower())
 
-        # Check if the identifier is an email or username
-        if '@' in identifier:
-            email = identifier
-        else:
-            username = identifier
-
-        if username is not None:
-            try:
-                username, tag = username.split('#')
-                email = Username.objects.get(
-                    username=username, tag=tag).user.email
-            except Exception:
-                raise BadRequestError('Invalid Credentials')
-
-        user = authenticate(info.context, email=email, password=password)
+        # The identifier is an email or a username with its tag, the user
+        # is loaded with its username by accounts.backends
+        user = authenticate(info.context, identifier=identifier, password=password)
         if user is None:
             raise BadRequestError('Invalid credentials')
 
-        refresh = RefreshToken.for_user(user)
+        refresh = AccountRefreshToken.for_user(user)
         return ObtainJSONWebToken(
             user=user,
             access_token=str(refresh.access_token),
@@ -125,6 +115,8 @@ class RefreshJSONWebToken(PublicMutation):
 
     If the refresh argument is true, then the refresh token is also refreshed, else it is not only the access token that is refreshed.
     This is used when the user logs out and logs in again.
+
+    A refreshed refresh token is revoked and can not be used again.
     """
     access_token = graphene.Field(graphene.String)
     refresh_token = graphene.Field(graphene.String)
@@ -141,10 +133,8 @@ class RefreshJSONWebToken(PublicMutation):
 
         if refresh:
             try:
-                # Get user from refresh token
-                refresh = RefreshToken(refresh_token)
-                user = User.objects.get(id=refresh['user_id'])
-                refresh = RefreshToken.for_user(user)
+                # The old refresh token is revoked, the new one carries its claims
+                refresh = AccountRefreshToken(refresh_token).rotate()
             except Exception as e:
                 raise BadRequestError(str(e))
 
@@ -157,7 +147,7 @@ class RefreshJSONWebToken(PublicMutation):
         else:
 
             try:
-                refresh = RefreshToken(refresh_token)
+                refresh = AccountRefreshToken(refresh_token)
             except Exception as e:
                 raise BadRequestError(str(e))
 
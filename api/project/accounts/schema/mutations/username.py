@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 import graphene
 
 # Local imports
+from accounts.tokens import get_tokens_for_user
 from accounts.schema.types import UserType, UsernameType
 from accounts.models import User, Username
 from utils.mutations.private import PrivateMutation
@@ -37,6 +38,8 @@ class CreateUsername(PrivateMutation):
                 username
                 tag
             }
+            accessToken
+            refreshToken
         }
     }
     ```
@@ -48,9 +51,13 @@ class CreateUsername(PrivateMutation):
     The username is the name that the user chooses, and the tag is a random 4 digit number
     that is generated when the username is created. The tag is used to differentiate between
     users with the same username. A user can only have 1 username, and a username can only be used by 1 user.
+
+    New tokens are returned since having a username is one of the claims of the tokens.
     """
     user = graphene.Field(UserType)
     username = graphene.Field(UsernameType)
+    access_token = graphene.String()
+    refresh_token = graphene.String()
 
     EXEMPT_CHECKS = True
 
@@ -64,11 +71,14 @@ class CreateUsername(PrivateMutation):
             username_obj = Username.objects.filter(
                 username=username, user=user).first()
             if username_obj:
+                access_token, refresh_token = get_tokens_for_user(user)
 
                 return CreateUsername(
                     user=user,
                     message='Username created sucessfully',
-                    username=username_obj
+                    username=username_obj,
+                    access_token=access_token,
+                    refresh_token=refresh_token
                 )
 
             else:
@@ -77,7 +87,8 @@ class CreateUsername(PrivateMutation):
                     user=user,
                     username=username,
                 )
-                username.save()
+
+            access_token, refresh_token = get_tokens_for_user(user)
 
         except Exception as e:
             if not isinstance(e, (BadRequestError)):
@@ -88,7 +99,9 @@ class CreateUsername(PrivateMutation):
         return CreateUsername(
             user=user,
             message='Username created sucessfully',
-            username=username
+            username=username,
+            access_token=access_token,
+            refresh_token=refresh_token
         )
 
 
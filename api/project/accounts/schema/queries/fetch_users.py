@@ -15,4 +15,5 @@ class fetchUsers(graphene.ObjectType):
     users = graphene.List(UserType)
 
     def resolve_users(self, info):
-        return User.objects.all()
+        # Only the selected columns and relations are fetched
+        return UserType.get_queryset(User.objects.all(), info)
@@ -2,6 +2,9 @@
 Schema for the accounts app
 """
 
+# Django imports
+from django.utils import timezone
+
 # Graphene imports
 import graphene
 
@@ -26,7 +29,8 @@ class Query(graphene.ObjectType):
     serverTime = graphene.DateTime()
 
     async def resolve_serverTime(self, info):
-        return asyncio.get_event_loop().time()
+        # Resolved on the event loop by the async view at /graphql/
+        return timezone.now()
 
 
 class Mutation(graphene.ObjectType):
@@ -4,13 +4,13 @@ Types for the accounts schema
 
 # Graphene imports
 import graphene
-from graphene_django import DjangoObjectType
 
 # Local imports
 from accounts.models import User, Username, Referral, Referred
+from utils.optimizer import OptimizedDjangoObjectType
 
 # Graphql representation of the User model
-class BaseUserType(DjangoObjectType):
+class BaseUserType(OptimizedDjangoObjectType):
     class Meta:
         model = User
 
@@ -18,22 +18,27 @@ class UserType(BaseUserType):
     class Meta:
         model = User
         exclude_fields = ('password', 'referred')
-    
+
     is_applied_username = graphene.Boolean()
 
+    optimizer_hints = {
+        'is_applied_username': ('username',),
+    }
+
     def resolve_is_applied_username(self,info):
-        return Username.objects.filter(user = self).exists()
+        # The username is loaded with the user when the query is optimized
+        return hasattr(self, 'username')
 
-class UsernameType(DjangoObjectType):
+class UsernameType(OptimizedDjangoObjectType):
     class Meta:
         model = Username
 
 
-class ReferralType(DjangoObjectType):
+class ReferralType(OptimizedDjangoObjectType):
     class Meta:
         model = Referral
 
 
-class ReferredType(DjangoObjectType):
+class ReferredType(OptimizedDjangoObjectType):
     class Meta:
         model = Referred
@@ -13,6 +13,8 @@ import boto3
 from .models import User, Username, Referral
 from otp.models import OneTimePassword
 from aws.models import SESEmailTemplate
+from accounts.revocation import revoke_user
+from utils.auth import invalidate_user
 
 
 @receiver(post_save, sender=Username)
@@ -27,6 +29,33 @@ def createReferral(sender, instance, created, **kwargs):
         )
 
 
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidateCachedUser(sender, instance, **kwargs):
+    """
+    Drop the cached tokens of the user, so the next request loads the
+    updated user.
+    """
+    invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revokeUserTokens(sender, instance, **kwargs):
+    """
+    The refresh tokens of a deleted user can not be used anymore.
+    """
+    revoke_user(instance.pk)
+
+
+@receiver(post_save, sender=Username)
+@receiver(post_delete, sender=Username)
+def invalidateCachedUsername(sender, instance, **kwargs):
+    """
+    The username is cached along with the user.
+    """
+    invalidate_user(instance.user_id)
+
+
 # @receiver(post_save, sender=User)
 # def sendAWSIdentityVerification(sender, instance, created, **kwargs):
 #     """ 
@@ -1,14 +1,42 @@
 """ Tests for accounts API's """
 
 # Native imports
+import asyncio
+import contextvars
 import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
 # Module imports
-from django.test import TestCase
+import graphene
+import jwt
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, get_hasher
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 from rest_framework.test import APIRequestFactory, APIClient
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
 # Application imports
-from accounts.models import User
+from accounts.models import User, Username, Referral
+from accounts import oidc
+from accounts.keys import get_key_ring, SigningKey
+from accounts.revocation import get_cache
+from accounts.schema.types import UserType
+from accounts.tokens import AccountAccessToken, get_tokens_for_user
+from utils.auth import CachedJWTAuthentication, token_cache
+from utils import executors, throttling, tracing
+from utils.idempotency import IdempotentRequest
+from utils.queries import capture_operations
+from utils.testing import GraphQLTestCase
+from utils.views import AsyncGraphQLRespondView
 
 
 class AccountsTests(TestCase):
@@ -79,3 +107,1083 @@ class AccountsTests(TestCase):
                 content_type='application/json'
             )
             assert request.status_code == x['assert']
+
+
+class AccountsQueryBudgetTests(GraphQLTestCase):
+    """
+    Query budgets of the accounts mutations.
+
+    A failing budget means a mutation executes more statements than it used
+    to, fix the mutation before raising the budget.
+    """
+
+    endpoint = '/accounts/'
+
+    USER_FIELDS = 'user { id email isEmailVerified isAppliedUsername }'
+
+    def setUp(self):
+        self.user = User.objects.create_email_user(
+            email='budget@gmail.com', password='password123', dob='1990-01-01')
+        self.user.is_email_verified = True
+        self.user.save()
+        self.username = Username.objects.create(
+            user=self.user, username='budget')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def google_token(self, email):
+        return mock.patch(
+            'accounts.oidc.verify_google_id_token',
+            return_value={'iss': 'accounts.google.com', 'email': email},
+        )
+
+    def test_create_user(self):
+        self.assertQueryBudget(3, """
+            mutation {
+                createUser(email: "new@gmail.com", password: "password123",
+                           dob: "1990-01-01", isPoliciesAccepted: true) {
+                    message %s accessToken refreshToken
+                }
+            }
+        """ % self.USER_FIELDS)
+
+    def test_create_user_with_referral(self):
+        Referral.objects.create(user=self.user, code='BUDGET')
+
+        self.assertQueryBudget(6, """
+            mutation {
+                createUser(email: "new@gmail.com", password: "password123",
+                           dob: "1990-01-01", isPoliciesAccepted: true,
+                           referral: "BUDGET") {
+                    message %s accessToken refreshToken
+                }
+            }
+        """ % self.USER_FIELDS)
+
+    def test_create_oauth_user(self):
+        with self.google_token('social@gmail.com'):
+            self.assertQueryBudget(3, """
+                mutation {
+                    createOauthUser(oauthToken: "token", provider: "GOOGLE") {
+                        message %s accessToken refreshToken
+                    }
+                }
+            """ % self.USER_FIELDS)
+
+    def test_update_user_dob(self):
+        self.assertQueryBudget(2, """
+            mutation {
+                updateUserDob(dob: "1990-01-01") { message %s }
+            }
+        """ % self.USER_FIELDS, token=self.token)
+
+    def test_create_username(self):
+        self.username.delete()
+
+        self.assertQueryBudget(5, """
+            mutation {
+                createUsername(username: "budget") {
+                    message %s username { id username tag }
+                }
+            }
+        """ % self.USER_FIELDS, token=self.token)
+
+    def test_edit_username(self):
+        self.assertQueryBudget(5, """
+            mutation {
+                editUsername(username: "edited") {
+                    message %s username { id username tag }
+                }
+            }
+        """ % self.USER_FIELDS, token=self.token)
+
+    def test_update_password(self):
+        self.assertQueryBudget(2, """
+            mutation {
+                updatePassword(password: "password123", newPassword: "password456") {
+                    message %s
+                }
+            }
+        """ % self.USER_FIELDS, token=self.token)
+
+    def test_obtain_token_with_email(self):
+        self.assertQueryBudget(1, """
+            mutation {
+                obtainToken(identifier: "budget@gmail.com", password: "password123") {
+                    message %s accessToken refreshToken
+                }
+            }
+        """ % self.USER_FIELDS)
+
+    def test_obtain_token_with_username(self):
+        self.assertQueryBudget(1, """
+            mutation {
+                obtainToken(identifier: "budget#%s", password: "password123") {
+                    message %s accessToken refreshToken
+                }
+            }
+        """ % (self.username.tag, self.USER_FIELDS))
+
+    def test_obtain_social_token(self):
+        with self.google_token(self.user.email):
+            self.assertQueryBudget(2, """
+                mutation {
+                    obtainSocialToken(oauthToken: "token", provider: "GOOGLE") {
+                        message %s accessToken refreshToken
+                    }
+                }
+            """ % self.USER_FIELDS)
+
+    def test_refresh_token(self):
+        refresh = str(RefreshToken.for_user(self.user))
+
+        self.assertQueryBudget(0, """
+            mutation {
+                refreshToken(refreshToken: "%s", refresh: false) {
+                    message accessToken refreshToken
+                }
+            }
+        """ % refresh)
+
+    def test_refresh_token_with_rotation(self):
+        refresh = str(RefreshToken.for_user(self.user))
+
+        self.assertQueryBudget(0, """
+            mutation {
+                refreshToken(refreshToken: "%s", refresh: true) {
+                    message accessToken refreshToken
+                }
+            }
+        """ % refresh)
+
+    def test_verify_token(self):
+        self.assertQueryBudget(1, """
+            mutation {
+                verifyToken { message %s }
+            }
+        """ % self.USER_FIELDS, token=self.token)
+
+    def test_verify_cached_token(self):
+        query = """
+            mutation {
+                verifyToken { message %s }
+            }
+        """ % self.USER_FIELDS
+        self.execute(query, token=self.token)
+
+        # The token and its user are served from the cache
+        self.assertQueryBudget(0, query, token=self.token)
+
+        # Saving the user drops the cached token
+        self.user.save()
+        self.assertQueryBudget(1, query, token=self.token)
+
+
+class OptimizedUsersQuery(graphene.ObjectType):
+    users = graphene.List(UserType)
+
+    def resolve_users(self, info):
+        return UserType.get_queryset(User.objects.all(), info)
+
+
+class QueryOptimizerTests(TestCase):
+    """
+    The querysets of the accounts types only fetch the selected columns and
+    relations, in a number of statements which does not grow with the rows.
+    """
+
+    schema = graphene.Schema(query=OptimizedUsersQuery)
+
+    def setUp(self):
+        for index in range(3):
+            user = User.objects.create_email_user(
+                email=f'optimized{index}@gmail.com', password='password123')
+            Username.objects.create(user=user, username=f'optimized{index}')
+            Referral.objects.create(user=user, code=f'OPTIMIZED{index}')
+
+    def execute(self, query, queries):
+        with self.assertNumQueries(queries) as context:
+            result = self.schema.execute(query)
+
+        self.assertIsNone(result.errors)
+        return result.data, [query['sql'] for query in context.captured_queries]
+
+    def test_only_selected_columns(self):
+        data, queries = self.execute('{ users { email } }', 1)
+
+        self.assertEqual(len(data['users']), 3)
+        self.assertNotIn('password', queries[0])
+
+    def test_select_related(self):
+        data, queries = self.execute("""
+            { users { email isAppliedUsername username { username tag } } }
+        """, 1)
+
+        self.assertTrue(all(user['isAppliedUsername'] for user in data['users']))
+        self.assertEqual(data['users'][0]['username']['username'], 'optimized0')
+
+    def test_prefetch_related(self):
+        data, queries = self.execute("""
+            { users { id referral { code user { email } } } }
+        """, 2)
+
+        self.assertEqual(data['users'][0]['referral'][0]['code'], 'OPTIMIZED0')
+        self.assertNotIn('password', queries[0])
+
+
+class StatelessAuthTests(GraphQLTestCase):
+    """
+    The tokens carry the account state, with stateless authentication the
+    private mutations are authorized from the claims alone.
+    """
+
+    endpoint = '/accounts/'
+
+    def setUp(self):
+        self.user = User.objects.create_email_user(
+            email='stateless@gmail.com', password='password123', dob='1990-01-01')
+
+    def test_tokens_carry_account_claims(self):
+        data = self.assertQueryBudget(3, """
+            mutation {
+                obtainToken(identifier: "stateless@gmail.com", password: "password123") {
+                    accessToken
+                }
+            }
+        """)
+
+        token = AccessToken(data['obtainToken']['accessToken'])
+        self.assertEqual(token['email'], 'stateless@gmail.com')
+        self.assertFalse(token['email_verified'])
+        self.assertTrue(token['dob_verified'])
+        self.assertFalse(token['has_username'])
+
+    def test_create_username_refreshes_tokens(self):
+        access_token, _ = get_tokens_for_user(self.user)
+
+        data = self.assertQueryBudget(5, """
+            mutation {
+                createUsername(username: "stateless") { accessToken refreshToken }
+            }
+        """, token=access_token)
+
+        token = AccessToken(data['createUsername']['accessToken'])
+        self.assertTrue(token['has_username'])
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_stateless_checks(self):
+        access_token, _ = get_tokens_for_user(self.user)
+
+        # The account setup is checked from the claims of the token
+        result, operation = self.execute("""
+            mutation { verifyToken { message } }
+        """, token=access_token)
+
+        self.assertEqual(operation.count, 0)
+        self.assertEqual(
+            result['errors'][0]['message'], 'User account setup is not complete.')
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_stateless_user_loaded_on_use(self):
+        self.user.is_email_verified = True
+        self.user.save()
+        Username.objects.create(user=self.user, username='stateless')
+        access_token, _ = get_tokens_for_user(self.user)
+
+        # The user is only loaded by the mutation itself
+        self.assertQueryBudget(1, """
+            mutation { verifyToken { message user { email isAppliedUsername } } }
+        """, token=access_token)
+
+
+class SigningKeyTests(TestCase):
+    """
+    Tokens signed by the key ring and verified with the published JWKS.
+    """
+
+    def setUp(self):
+        self.keys_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.keys_dir.cleanup)
+
+        settings = override_settings(
+            JWT_KEYS_DIR=self.keys_dir.name, JWT_KEY_ACTIVATION_DELAY=3600)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create_email_user(
+            email='keys@gmail.com', password='password123', dob='1990-01-01')
+
+    def rotate(self, algorithm='RS256'):
+        """
+        Rotates the keys and returns the new key.
+        """
+        call_command('rotate_signing_keys', algorithm=algorithm, stdout=open(os.devnull, 'w'))
+
+        key_ring = get_key_ring()
+        return key_ring.sorted_keys(key_ring.keys)[-1]
+
+    def get_jwks(self):
+        response = self.client.get('/.well-known/jwks.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=', response['Cache-Control'])
+        return json.loads(response.content)['keys']
+
+    def verify_with_jwks(self, token):
+        kid = jwt.get_unverified_header(token)['kid']
+        jwk = next(jwk for jwk in self.get_jwks() if jwk['kid'] == kid)
+        return jwt.decode(token, jwt.PyJWK(jwk).key, algorithms=[jwk['alg']])
+
+    @override_settings(JWT_KEY_ACTIVATION_DELAY=0)
+    def test_tokens_verified_with_jwks(self):
+        for algorithm in ('RS256', 'EdDSA'):
+            key = self.rotate(algorithm)
+            access_token, _ = get_tokens_for_user(self.user)
+
+            header = jwt.get_unverified_header(access_token)
+            self.assertEqual(header['alg'], algorithm)
+            self.assertEqual(header['kid'], key.kid)
+
+            self.assertEqual(
+                self.verify_with_jwks(access_token)['user_id'], self.user.id)
+            self.assertEqual(AccountAccessToken(access_token)['user_id'], self.user.id)
+
+    def test_rotation_activates_after_delay(self):
+        first = self.rotate()
+        second = self.rotate()
+
+        # The new key is published but does not sign yet
+        kids = [jwk['kid'] for jwk in self.get_jwks()]
+        self.assertEqual(kids, [first.kid, second.kid])
+        self.assertEqual(first.kid, get_key_ring().get_signing_key().kid)
+
+        with mock.patch('time.time', return_value=time.time() + 3601):
+            self.assertEqual(second.kid, get_key_ring().get_signing_key().kid)
+
+    def test_retired_keys_deleted(self):
+        first = self.rotate()
+        self.rotate()
+
+        # The tokens signed by the first key expired
+        lifetime = 366 * 24 * 3600
+        with mock.patch('time.time', return_value=time.time() + 3600 + lifetime):
+            self.rotate()
+
+        self.assertNotIn(first.kid, [jwk['kid'] for jwk in self.get_jwks()])
+
+    def test_hs256_tokens(self):
+        legacy_token = str(RefreshToken.for_user(self.user).access_token)
+        self.rotate()
+
+        self.assertEqual(AccountAccessToken(legacy_token)['user_id'], self.user.id)
+
+        with override_settings(JWT_ACCEPT_HS256=False):
+            with self.assertRaises(TokenError):
+                AccountAccessToken(legacy_token)
+
+    def test_unknown_kid_rejected(self):
+        self.rotate()
+        access_token, _ = get_tokens_for_user(self.user)
+
+        forged = jwt.encode(
+            jwt.decode(access_token, options={'verify_signature': False}),
+            'secret', algorithm='HS256', headers={'kid': 'unknown'})
+
+        with self.assertRaises(TokenError):
+            AccountAccessToken(forged)
+
+    def test_jwks_not_modified(self):
+        self.rotate()
+        response = self.client.get('/.well-known/jwks.json')
+
+        response = self.client.get(
+            '/.well-known/jwks.json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class RefreshRotationTests(GraphQLTestCase):
+    """
+    Rotated refresh tokens are revoked in the cache, not in the database.
+    """
+
+    endpoint = '/accounts/'
+
+    REFRESH = """
+        mutation {
+            refreshToken(refreshToken: "%s", refresh: %s) { accessToken refreshToken }
+        }
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_email_user(
+            email='rotation@gmail.com', password='password123', dob='1990-01-01')
+        _, self.refresh_token = get_tokens_for_user(self.user)
+
+    def test_rotated_token_revoked(self):
+        data = self.assertQueryBudget(0, self.REFRESH % (self.refresh_token, 'true'))
+
+        # The new token keeps the claims of the old one
+        rotated = RefreshToken(data['refreshToken']['refreshToken'])
+        self.assertEqual(rotated['email'], 'rotation@gmail.com')
+        self.assertEqual(rotated['user_id'], self.user.id)
+
+        for refresh in ('true', 'false'):
+            result, operation = self.execute(self.REFRESH % (self.refresh_token, refresh))
+            self.assertEqual(result['errors'][0]['message'], 'Token is blacklisted')
+            self.assertEqual(operation.count, 0)
+
+        self.assertQueryBudget(0, self.REFRESH % (rotated, 'false'))
+
+    def test_deleted_user_tokens_revoked(self):
+        self.user.delete()
+
+        result, _ = self.execute(self.REFRESH % (self.refresh_token, 'true'))
+        self.assertEqual(result['errors'][0]['message'], 'Token is blacklisted')
+
+
+class GoogleIdTokenTests(TestCase):
+    """
+    Google ID tokens verified against a local issuer, the keys are fetched
+    once and reused.
+    """
+
+    ISSUER = 'http://localhost:9000'
+
+    def setUp(self):
+        self.key = SigningKey.generate('RS256')
+
+        response = mock.Mock(headers={'Cache-Control': 'public, max-age=3600'})
+        response.json.return_value = {'keys': [self.key.to_jwk()]}
+        self.session = mock.Mock()
+        self.session.get.return_value = response
+
+        patcher = mock.patch.dict(oidc._jwks_caches, {
+            'http://localhost:9000/certs': oidc.JWKSCache(
+                'http://localhost:9000/certs', self.session),
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        settings = override_settings(
+            GOOGLE_OIDC_ISSUER=self.ISSUER,
+            GOOGLE_OIDC_JWKS_URL='http://localhost:9000/certs',
+            SOCIAL_AUTH_GOOGLE_OAUTH2_KEY='client-id',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def id_token(self, **claims):
+        claims = {
+            'iss': self.ISSUER,
+            'aud': 'client-id',
+            'email': 'google@gmail.com',
+            'exp': int(time.time()) + 3600,
+            **claims,
+        }
+        return jwt.encode(
+            claims, self.key.private_key, algorithm='RS256',
+            headers={'kid': self.key.kid})
+
+    def test_keys_fetched_once(self):
+        for _ in range(3):
+            claims = oidc.verify_google_id_token(self.id_token())
+            self.assertEqual(claims['email'], 'google@gmail.com')
+
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_invalid_tokens(self):
+        for token in (
+            self.id_token(iss='https://attacker.example.com'),
+            self.id_token(aud='other-client-id'),
+            self.id_token(exp=int(time.time()) - 60),
+        ):
+            with self.assertRaises(ValueError):
+                oidc.verify_google_id_token(token)
+
+
+class PasswordHashingTests(TestCase):
+    """
+    The passwords hashed with the calibrated iterations match the Django
+    hasher.
+    """
+
+    def test_hashes_compatible(self):
+        hasher = get_hasher('default')
+        encoded = hasher.encode('password123', 'salt', 1000)
+
+        self.assertEqual(encoded, PBKDF2PasswordHasher().encode('password123', 'salt', 1000))
+        self.assertTrue(hasher.verify('password123', encoded))
+        self.assertFalse(hasher.verify('password456', encoded))
+
+    def test_calibrated_iterations_rehash(self):
+        encoded = get_hasher('default').encode('password123', 'salt' * 6, 1000)
+
+        with override_settings(PASSWORD_HASHER_ITERATIONS=1000):
+            self.assertFalse(get_hasher('default').must_update(encoded))
+        with override_settings(PASSWORD_HASHER_ITERATIONS=2000):
+            self.assertTrue(get_hasher('default').must_update(encoded))
+
+    def test_social_user_unusable_password(self):
+        user = User.objects.create_social_user(email='social@gmail.com', provider='GOOGLE')
+
+        self.assertFalse(user.has_usable_password())
+
+
+@override_settings(THROTTLE_RATES={'login_identifier': '2/m'})
+class ThrottlingTests(GraphQLTestCase):
+    """
+    Login attempts are limited per identifier, by the local token bucket
+    and by the shared sliding window.
+    """
+
+    endpoint = '/accounts/'
+
+    LOGIN = """
+        mutation {
+            obtainToken(identifier: "%s", password: "wrong-password") { message }
+        }
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        throttling._throttles.clear()
+
+    def login(self, identifier='throttled@gmail.com'):
+        return self.client.post(
+            self.endpoint,
+            json.dumps({'query': self.LOGIN % identifier}),
+            content_type='application/json',
+        )
+
+    def assertThrottled(self, response):
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        error = json.loads(response.content)['errors'][0]
+        self.assertEqual(error['extensions']['status'], 429)
+
+    def test_local_bucket(self):
+        for _ in range(2):
+            self.assertEqual(self.login().status_code, 400)
+
+        self.assertThrottled(self.login())
+
+        # The other identifiers have their own limit
+        self.assertEqual(self.login('other@gmail.com').status_code, 400)
+
+    def test_shared_window(self):
+        for _ in range(2):
+            self.login()
+
+        # A new process has a full bucket, the shared window still applies
+        throttling._throttles.clear()
+        self.assertThrottled(self.login())
+
+
+class IdentifierBackendTests(TestCase):
+    """
+    The identifiers are resolved by the authentication backend.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_email_user(
+            email='backend@gmail.com', password='password123')
+        self.username = Username.objects.create(user=self.user, username='backend')
+
+    def test_identifiers(self):
+        identifier = f'backend#{self.username.tag}'
+
+        with self.assertNumQueries(1):
+            user = authenticate(identifier=identifier, password='password123')
+        self.assertEqual(user, self.user)
+
+        # The admin login passes the email as the username
+        self.assertEqual(authenticate(username='backend@gmail.com', password='password123'), self.user)
+
+    def test_invalid_identifiers(self):
+        with self.assertNumQueries(0):
+            self.assertIsNone(authenticate(identifier='backend', password='password123'))
+
+        self.assertIsNone(authenticate(identifier='backend@gmail.com', password='password456'))
+        self.assertIsNone(authenticate(identifier='nobody#0000', password='password123'))
+
+
+@override_settings(INTERNAL_SERVICE_TOKENS=['service-token'], INTERNAL_BATCH_MAX_SIZE=3)
+class InternalBatchTests(GraphQLTestCase):
+    """
+    The internal endpoint verifies tokens and fetches users in batches.
+    """
+
+    endpoint = '/internal/accounts/'
+
+    def setUp(self):
+        token_cache.clear()
+        self.client.defaults['HTTP_X_SERVICE_TOKEN'] = 'service-token'
+
+        self.users = [
+            User.objects.create_email_user(email=f'internal{index}@gmail.com', password='password123')
+            for index in range(2)
+        ]
+        self.tokens = [get_tokens_for_user(user)[0] for user in self.users]
+
+    def test_verify_tokens(self):
+        query = """
+            query($tokens: [String!]!) {
+                verifyTokens(tokens: $tokens) { valid error user { email } }
+            }
+        """
+        variables = {'tokens': self.tokens + ['invalid']}
+
+        # The users of the uncached tokens are loaded together
+        data = self.assertQueryBudget(1, query, variables)
+        results = data['verifyTokens']
+
+        self.assertEqual([result['valid'] for result in results], [True, True, False])
+        self.assertEqual(results[1]['user']['email'], 'internal1@gmail.com')
+        self.assertIsNotNone(results[2]['error'])
+
+        # Then they are answered from the token cache
+        self.assertQueryBudget(0, query, variables)
+
+    def test_users(self):
+        data = self.assertQueryBudget(1, """
+            query($ids: [ID!]!) { users(ids: $ids) { email } }
+        """, {'ids': [self.users[1].pk, 0, self.users[0].pk]})
+
+        self.assertEqual(data['users'], [
+            {'email': 'internal1@gmail.com'}, None, {'email': 'internal0@gmail.com'}])
+
+    def test_service_token_and_batch_size(self):
+        query = 'query($ids: [ID!]!) { users(ids: $ids) { email } }'
+
+        result, _ = self.execute(query, {'ids': [1, 2, 3, 4]})
+        self.assertEqual(result['errors'][0]['extensions']['status'], 400)
+
+        self.client.defaults['HTTP_X_SERVICE_TOKEN'] = 'wrong-token'
+        result, _ = self.execute(query, {'ids': [1]})
+        self.assertEqual(result['errors'][0]['extensions']['status'], 401)
+
+
+class IdempotencyTests(GraphQLTestCase):
+    """
+    Requests sent with an Idempotency-Key header are executed once.
+    """
+
+    query = """
+        mutation {
+            createUser(email: "idempotent@gmail.com", password: "password123",
+                       dob: "1990-01-01", isPoliciesAccepted: true) {
+                message accessToken
+            }
+        }
+    """
+
+    def post(self, query, key):
+        return self.client.post(
+            self.endpoint,
+            json.dumps({'query': query}),
+            content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_replayed_response(self):
+        first = self.post(self.query, 'signup-1')
+        with self.assertNumQueries(0):
+            second = self.post(self.query, 'signup-1')
+
+        self.assertEqual(second.status_code, first.status_code)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(User.objects.filter(email='idempotent@gmail.com').count(), 1)
+
+    def test_key_reused_for_another_request(self):
+        self.post(self.query, 'signup-2')
+        response = self.post(self.query.replace('idempotent@', 'other@'), 'signup-2')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(User.objects.filter(email='other@gmail.com').exists())
+
+    @override_settings(IDEMPOTENCY_WAIT=0)
+    def test_request_in_flight(self):
+        idempotent = IdempotentRequest(
+            RequestFactory().post(self.endpoint, json.dumps({'query': self.query}),
+                                  content_type='application/json'),
+            'signup-3')
+        idempotent.attempt()
+
+        response = self.post(self.query, 'signup-3')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(User.objects.filter(email='idempotent@gmail.com').exists())
+
+    def idempotent_request(self, key):
+        return IdempotentRequest(
+            RequestFactory().post(self.endpoint, json.dumps({'query': self.query}),
+                                  content_type='application/json'),
+            key)
+
+    def test_stored_between_lookup_and_lock(self):
+        first = self.idempotent_request('signup-4')
+        retry = self.idempotent_request('signup-4')
+        self.assertEqual(first.attempt(), (True, None))
+
+        # The first request completes right after the lookup of the retry
+        lookup = retry.cache.get
+
+        def get(key, *args, **kwargs):
+            stored = lookup(key, *args, **kwargs)
+            if key == retry.response_key and first.token is not None:
+                first.store(HttpResponse('{"data": {}}', content_type='application/json'))
+                first.token = None
+            return stored
+
+        with mock.patch.object(retry.cache, 'get', side_effect=get):
+            settled, response = retry.attempt()
+
+        self.assertTrue(settled)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertIsNone(retry.cache.get(retry.lock_key))
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=1)
+    def test_release_expired_lock(self):
+        slow = self.idempotent_request('signup-5')
+        retry = self.idempotent_request('signup-5')
+        self.assertEqual(slow.attempt(), (True, None))
+
+        # The lock of the slow request expires, the retry takes it
+        slow.cache.delete(slow.lock_key)
+        self.assertEqual(retry.attempt(), (True, None))
+
+        slow.release()
+        self.assertEqual(retry.cache.get(retry.lock_key), retry.token)
+        self.assertEqual(self.idempotent_request('signup-5').attempt(), (False, None))
+
+
+class CombinedEndpointTests(TransactionTestCase):
+    """
+    The /graphql/ endpoint executes a batch of operations of the accounts
+    and otp schemas, and authenticates the request once.
+
+    The async view runs the resolvers in its executor threads, they do not
+    see the transaction of a TestCase.
+    """
+
+    endpoint = '/graphql/'
+
+    def setUp(self):
+        self.user = User.objects.create_email_user(
+            email='combined@gmail.com', password='password123', dob='1990-01-01')
+        self.user.is_email_verified = True
+        self.user.save()
+        Username.objects.create(user=self.user, username='combined')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        token_cache.clear()
+
+    def batch(self, *queries, token=None):
+        headers = {}
+        if token is not None:
+            headers['HTTP_AUTHORIZATION'] = f'JWT {token}'
+
+        response = self.client.post(
+            self.endpoint,
+            json.dumps([{'id': index, 'query': query} for index, query in enumerate(queries)]),
+            content_type='application/json',
+            **headers
+        )
+        return response, json.loads(response.content)
+
+    def test_results_per_operation(self):
+        response, results = self.batch(
+            'query { serverTime }',
+            'mutation { verifyToken { message user { email } } }',
+            token=self.token,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['id'] for result in results], [0, 1])
+        self.assertIsNotNone(results[0]['data']['serverTime'])
+        self.assertEqual(
+            results[1]['data']['verifyToken']['user']['email'], 'combined@gmail.com')
+
+    def test_mixed_batch(self):
+        response, results = self.batch(
+            'mutation { verifyToken { message } }',
+            'mutation { forgotPassword(email: "missing@gmail.com", initiate: true) { message } }',
+            'query { serverTime }',
+            token=self.token,
+        )
+
+        # The highest status of the errors is the status of the response,
+        # the operations after the failed one are executed
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('errors', results[0])
+        self.assertEqual(results[1]['errors'][0]['extensions']['status'], 400)
+        self.assertIsNone(results[1]['data']['forgotPassword'])
+        self.assertIsNotNone(results[2]['data']['serverTime'])
+
+    def test_unauthenticated(self):
+        response, results = self.batch(
+            'query { serverTime }',
+            'mutation { verifyToken { message } }',
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.assertIsNotNone(results[0]['data']['serverTime'])
+        self.assertEqual(results[1]['errors'][0]['extensions']['status'], 401)
+
+        response, results = self.batch(
+            'mutation { verifyToken { message } }', token='invalid')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(results[0]['errors'][0]['message'], 'Invalid token')
+
+    def test_authenticated_once(self):
+        authenticate = CachedJWTAuthentication.authenticate
+
+        with mock.patch.object(
+                CachedJWTAuthentication, 'authenticate',
+                autospec=True, side_effect=authenticate) as authenticated:
+            response, results = self.batch(
+                'mutation { verifyToken { message } }',
+                'mutation { verifyToken { message } }',
+                'mutation { updateUserDob(dob: "1990-01-01") { message } }',
+                token=self.token,
+            )
+
+        self.assertEqual(response.status_code, 200, results)
+        self.assertEqual(authenticated.call_count, 1)
+
+
+class AsyncGraphQLViewTests(TransactionTestCase):
+    """
+    The async view resolves the coroutine resolvers on the event loop and
+    sends the blocking ones to the bounded executor.
+    """
+
+    endpoint = '/graphql/'
+
+    def setUp(self):
+        self.user = User.objects.create_email_user(
+            email='async@gmail.com', password='password123', dob='1990-01-01')
+        self.user.is_email_verified = True
+        self.user.save()
+        Username.objects.create(user=self.user, username='async')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        token_cache.clear()
+
+    async def execute(self, query, token=None):
+        headers = {}
+        if token is not None:
+            headers['AUTHORIZATION'] = f'JWT {token}'
+
+        response = await self.async_client.post(
+            self.endpoint,
+            json.dumps([{'query': query}]),
+            content_type='application/json',
+            **headers
+        )
+        return response, json.loads(response.content)[0]
+
+    async def test_query(self):
+        with mock.patch('utils.executors.run_sync', wraps=executors.run_sync) as run_sync:
+            response, result = await self.execute('query { serverTime }')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(result['data']['serverTime'])
+        # A coroutine resolver, run on the loop
+        run_sync.assert_not_called()
+
+    async def test_mutation(self):
+        with mock.patch('utils.executors.close_old_connections') as close_old_connections:
+            response, result = await self.execute("""
+                mutation {
+                    createUser(email: "created@gmail.com", password: "password123",
+                               dob: "1990-01-01", isPoliciesAccepted: true) {
+                        message user { email }
+                    }
+                }
+            """)
+
+        self.assertEqual(response.status_code, 200, result)
+        self.assertEqual(result['data']['createUser']['user']['email'], 'created@gmail.com')
+        # The resolver ran in an executor thread, its connection checked
+        close_old_connections.assert_called()
+        self.assertTrue(await User.objects.filter(email='created@gmail.com').aexists())
+
+    async def test_authentication(self):
+        query = 'mutation { updateUserDob(dob: "1990-01-01") { message } }'
+
+        response, result = await self.execute(query)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(result['errors'][0]['message'], 'Authorization header is required')
+
+        response, result = await self.execute(query, token='invalid')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(result['errors'][0]['message'], 'Invalid token')
+
+        response, result = await self.execute(query, token=self.token)
+        self.assertEqual(response.status_code, 200, result)
+
+    async def test_context_copied(self):
+        variable = contextvars.ContextVar('variable')
+        variable.set('request')
+
+        self.assertEqual(await executors.run_sync(variable.get), 'request')
+
+    @override_settings(GRAPHQL_EXECUTOR_MAX_WORKERS=2)
+    async def test_bounded_pool(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+        names = set()
+
+        def block():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                names.add(threading.current_thread().name)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        with mock.patch('utils.executors._executor', None):
+            executor = executors.get_executor()
+            try:
+                await asyncio.gather(*(executors.run_sync(block) for _ in range(6)))
+            finally:
+                executor.shutdown()
+
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.startswith('graphql') for name in names))
+
+    async def test_atomic_mutation(self):
+        class FlagErrors:
+            # Flags the errors on the request, as the form mutations do
+            def resolve(self, next, root, info, **args):
+                if root is None:
+                    setattr(info.context, MUTATION_ERRORS_FLAG, True)
+                return next(root, info, **args)
+
+        query = """
+            mutation {
+                createUser(email: "%s", password: "password123",
+                           dob: "1990-01-01", isPoliciesAccepted: true) {
+                    message
+                }
+            }
+        """
+
+        with mock.patch.object(
+            AsyncGraphQLRespondView, 'get_common_middleware', return_value=[FlagErrors()],
+        ):
+            await self.execute(query % 'kept@gmail.com')
+            with mock.patch.dict(connection.settings_dict, ATOMIC_MUTATIONS=True):
+                response, result = await self.execute(query % 'rolled@gmail.com')
+
+        self.assertEqual(response.status_code, 200, result)
+        self.assertEqual(result['data']['createUser']['message'], 'User created successfully')
+        # Without ATOMIC_MUTATIONS the flag does not roll the mutation back
+        self.assertTrue(await User.objects.filter(email='kept@gmail.com').aexists())
+        self.assertFalse(await User.objects.filter(email='rolled@gmail.com').aexists())
+
+    def test_coroutine_resolver_sync_view(self):
+        # The sync views run the coroutine resolvers to completion
+        response = self.client.post(
+            '/accounts/', json.dumps({'query': 'query { serverTime }'}),
+            content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(json.loads(response.content)['data']['serverTime'])
+
+
+@override_settings(GRAPHQL_TRACING=True, GRAPHQL_TRACING_FLUSH_INTERVAL=3600)
+class TracingTests(GraphQLTestCase):
+    """
+    The operations are traced per resolver, the debug requests get their
+    trace in the response and the others are aggregated in the metrics.
+    """
+
+    query = 'mutation { updateUserDob(dob: "1990-01-01") { message } }'
+
+    def setUp(self):
+        self.user = User.objects.create_email_user(
+            email='traced@gmail.com', password='password123', dob='1990-01-01')
+        self.user.is_email_verified = True
+        self.user.save()
+        Username.objects.create(user=self.user, username='traced')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        token_cache.clear()
+
+        tracing.metrics.snapshot(reset=True)
+        self.addCleanup(tracing.metrics.snapshot, reset=True)
+
+    def post(self, token=None, debug=True):
+        headers = {}
+        if token is not None:
+            headers['HTTP_AUTHORIZATION'] = f'JWT {token}'
+        if debug:
+            headers['HTTP_X_GRAPHQL_TRACE'] = '1'
+
+        with capture_operations() as operations:
+            response = self.client.post(
+                self.endpoint,
+                json.dumps({'query': self.query}),
+                content_type='application/json',
+                **headers
+            )
+
+        return json.loads(response.content), operations[0]
+
+    def test_sql_per_operation(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        result, operation = self.post(self.token)
+
+        trace = result['extensions']['tracing']
+        resolver, *fields = trace['execution']['resolvers']
+        self.assertEqual(resolver['path'], ['updateUserDob'])
+        self.assertEqual(resolver['parentType'], 'Mutation')
+        self.assertGreater(resolver['sql']['count'], 0)
+        # Every statement of the operation is attributed to a resolver
+        self.assertEqual(
+            sum(field['sql']['count'] for field in [resolver] + fields), operation.count)
+        self.assertGreaterEqual(trace['duration'], resolver['duration'])
+
+    def test_trace_for_debug_requests(self):
+        # Neither staff nor DEBUG
+        result, _ = self.post(self.token)
+        self.assertNotIn('extensions', result)
+
+        self.user.is_staff = True
+        self.user.save()
+
+        result, _ = self.post(self.token, debug=False)
+        self.assertNotIn('extensions', result)
+
+        result, _ = self.post(self.token)
+        self.assertEqual(result['extensions']['tracing']['version'], 1)
+
+        with override_settings(DEBUG=True):
+            result, _ = self.post()
+        self.assertIn('tracing', result['extensions'])
+
+    def test_metrics(self):
+        self.post(self.token, debug=False)
+        self.post(self.token, debug=False)
+
+        operation = tracing.metrics.snapshot()['updateUserDob']
+        self.assertEqual(operation['count'], 2)
+        self.assertGreater(operation['sql_count'], 0)
+        self.assertEqual(operation['fields']['Mutation.updateUserDob']['count'], 2)
+        self.assertEqual(
+            operation['fields']['Mutation.updateUserDob']['sql_count'], operation['sql_count'])
+
+    @override_settings(GRAPHQL_TRACING_FLUSH_INTERVAL=0)
+    def test_flush(self):
+        with self.assertLogs('utils.tracing', 'INFO') as logs:
+            self.post(self.token, debug=False)
+
+        record, = logs.records
+        self.assertEqual(record.operation, 'updateUserDob')
+        self.assertEqual(record.metrics['count'], 1)
+        self.assertEqual(tracing.metrics.snapshot(), {})
@@ -0,0 +1,148 @@
+"""
+Tokens issued by the accounts app.
+
+The tokens carry the state of the account as claims, so the private
+mutations can authorize a request from the token alone:
+
+- `email` - The email of the user
+- `email_verified` - The email of the user is verified
+- `dob_verified` - The date of birth of the user is verified
+- `has_username` - The user created a username
+- `is_staff` - The user is a staff member
+
+The claims are a snapshot taken when the token is issued, the mutations
+which change them (validateEmail, updateUserDob, createUsername) return new
+tokens. With JWT_STATELESS_AUTH on, the requests are authenticated with an
+AccountTokenUser built from the claims and the user is only loaded from the
+database when a mutation needs it.
+
+The tokens are signed and verified with the key ring of accounts.keys, the
+refresh tokens are checked against accounts.revocation when decoded.
+"""
+
+# Django imports
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+# Local imports
+from accounts import revocation
+from accounts.keys import get_token_backend
+from accounts.models import User
+
+
+def get_account_claims(user):
+    """
+    Returns the account state claims of the user.
+    """
+    return {
+        'email': user.email,
+        'email_verified': user.is_email_verified,
+        'dob_verified': user.is_dob_verified,
+        'has_username': hasattr(user, 'username'),
+        'is_staff': user.is_staff,
+    }
+
+
+class KeyRingTokenMixin:
+    """
+    Signs and verifies the token with the key ring instead of the static
+    simplejwt backend.
+    """
+
+    @property
+    def token_backend(self):
+        return get_token_backend()
+
+
+class AccountAccessToken(KeyRingTokenMixin, AccessToken):
+    pass
+
+
+class AccountRefreshToken(KeyRingTokenMixin, RefreshToken):
+    """
+    Refresh token with the account state claims, they are copied to the
+    access tokens it issues.
+    """
+
+    access_token_class = AccountAccessToken
+
+    # Claims set for every new token
+    no_copy_claims = (
+        api_settings.TOKEN_TYPE_CLAIM,
+        'exp',
+        'iat',
+        api_settings.JTI_CLAIM,
+    )
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+
+        for claim, value in get_account_claims(user).items():
+            token[claim] = value
+
+        return token
+
+    def verify(self, *args, **kwargs):
+        revocation.check_revoked(self)
+
+        super().verify(*args, **kwargs)
+
+    def rotate(self):
+        """
+        Revokes the token and returns a new one with the same claims, the
+        user is not reloaded.
+        """
+        if not revocation.revoke(self):
+            raise TokenError(_('Token is blacklisted'))
+
+        token = type(self)()
+        for claim, value in self.payload.items():
+            if claim not in self.no_copy_claims:
+                token[claim] = value
+
+        return token
+
+
+def get_tokens_for_user(user):
+    """
+    Returns the access and refresh tokens of the user.
+    """
+    refresh = AccountRefreshToken.for_user(user)
+    return str(refresh.access_token), str(refresh)
+
+
+class AccountTokenUser(TokenUser):
+    """
+    Stateless user backed by the claims of a validated access token.
+    """
+
+    @property
+    def email(self):
+        return self.token.get('email')
+
+    @property
+    def is_email_verified(self):
+        return self.token.get('email_verified', False)
+
+    @property
+    def is_dob_verified(self):
+        return self.token.get('dob_verified', False)
+
+    def is_valid_user(self):
+        return (
+            self.is_email_verified
+            and self.is_dob_verified
+            and self.token.get('has_username', False)
+        )
+
+    def get_user(self):
+        """
+        Returns the user of the token, loaded on first use.
+        """
+        return SimpleLazyObject(
+            lambda: User.objects.select_related('username').get(pk=self.id))
@@ -6,13 +6,19 @@ This file contains the views for the accounts app.
 import json
 
 # Django imports
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET
 
 # Graphene imports
 from accounts.schema.schema import schema
+from accounts.schema.internal import schema as internal_schema
 
 # Local imports
+from accounts.keys import get_key_ring
 from utils.views import GraphQLRespondView
 
 
@@ -20,3 +26,22 @@ from utils.views import GraphQLRespondView
 def accounts_graphql_view(request):
     # Use extended view
     return GraphQLRespondView.as_view(graphiql=True, schema=schema)(request)
+
+
+@csrf_exempt
+def internal_graphql_view(request):
+    # Only called by the other services, there is no GraphiQL
+    return GraphQLRespondView.as_view(graphiql=False, schema=internal_schema)(request)
+
+
+@require_GET
+@condition(etag_func=lambda request: get_key_ring().get_etag())
+def jwks_view(request):
+    """
+    Publishes the public signing keys, the other services cache the
+    document and verify the tokens locally.
+    """
+    response = HttpResponse(get_key_ring().get_jwks(), content_type='application/json')
+    patch_cache_control(
+        response, public=True, max_age=getattr(settings, 'JWT_JWKS_MAX_AGE', 900))
+    return response
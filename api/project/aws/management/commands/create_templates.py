@@ -1,39 +1,71 @@
-
-
-from django.core.management.base import BaseCommand
-import random
-import string
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 import os
 
 
 # Local imports
 from aws.models import SESEmailTemplate
+from aws.registry import publish_invalidation
+from aws.sync import read_folder, sync_templates
+
+TEMPLATE_KEYS = {"otp": "otp", "email": "email"}
 
 
 class Command(BaseCommand):
-    help = 'Create Email templates'
+    help = 'Create or update the email templates, only the changed ones are pushed to SES'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=os.path.join('aws', 'templates'),
+                            help='Folder with a folder per template')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Templates pushed to SES concurrently')
+        parser.add_argument('--force', action='store_true',
+                            help='Push the unchanged templates as well')
+
+    def handle(self, path, workers, force, **options):
+        # Traverses through the templates folder, each template folder is an
+        # SESEmailTemplate object
+        names = sorted(
+            name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+        existing = SESEmailTemplate.objects.in_bulk(names, field_name='template_identifier')
 
+        pairs, created, updated = [], [], []
+        for name in names:
+            template_path = os.path.join(path, name)
+            content = read_folder(template_path)
 
-    def handle(self, *args, **options):
-        templates_folder = os.path.join('aws', 'templates')
+            template = existing.get(name)
+            if template is None:
+                template = SESEmailTemplate(template_identifier=name)
+                created.append(template)
+            else:
+                updated.append(template)
 
-        # Traverses through the templates folder and creates an SESEmailTemplate object for each template folder
-        for template_name in os.listdir(templates_folder):
-            template_path = os.path.join(templates_folder, template_name)
-            if os.path.isdir(template_path):
-                template_html = os.path.join(template_path, 'template.html')
-                template_text = os.path.join(template_path, 'template.txt')
-                template_subject = os.path.join(template_path, 'template_subject.txt')
+            template.template_subject = content.subject
+            template.template_text_part = os.path.join(template_path, 'template.txt')
+            template.template_html_part = os.path.join(template_path, 'template.html')
+            template.template_keys = TEMPLATE_KEYS
+            pairs.append((template, content))
 
-                with open(template_subject, 'r') as file:
-                    subject = file.read().strip()
+        # Written in bulk, the post_save signal would push the parts of the
+        # bucket instead of the local ones
+        with transaction.atomic():
+            SESEmailTemplate.objects.bulk_create(created)
+            SESEmailTemplate.objects.bulk_update(
+                updated,
+                ['template_subject', 'template_text_part', 'template_html_part', 'template_keys'],
+            )
+            transaction.on_commit(publish_invalidation)
 
-                SESEmailTemplate.objects.create(
-                    template_identifier=template_name,
-                    template_subject=subject,
-                    template_text_part=template_text,
-                    template_html_part=template_html,
-                    template_keys={"otp": "otp", "email": "email"}
-                )
+        failed = 0
+        results = sync_templates(pairs, max_workers=workers, force=force)
+        for (template, _), result in zip(pairs, results):
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write(f'{template.template_identifier}: {result}')
+            else:
+                self.stdout.write(
+                    f'{template.template_identifier}: {"pushed" if result else "unchanged"}')
 
-                print(f'SESEmailTemplate object created for {template_name}.')
+        if failed:
+            raise CommandError(f'{failed} templates could not be pushed to SES.')
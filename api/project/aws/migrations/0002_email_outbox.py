@@ -0,0 +1,46 @@
+# Generated by Django 4.1.4 on 2026-10-19 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aws', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='templatedemail',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='templatedemail',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='templatedemail',
+            name='message_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='templatedemail',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='templatedemail',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'PENDING'), ('SENDING', 'SENDING'), ('SENT', 'SENT'), ('FAILED', 'FAILED')], default='PENDING', max_length=250),
+        ),
+        migrations.AddIndex(
+            model_name='templatedemail',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='email_status_next_attempt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='templatedemail',
+            index=models.Index(fields=['status', 'claimed_at'], name='email_status_claimed_at_idx'),
+        ),
+    ]
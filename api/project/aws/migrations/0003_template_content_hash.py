@@ -0,0 +1,18 @@
+# Generated by Django 4.1.4 on 2026-10-19 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aws', '0002_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sesemailtemplate',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
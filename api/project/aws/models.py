@@ -1,8 +1,5 @@
 from django.db import models
-import boto3
 import os
-from django.conf import settings
-import json
 
 
 # Create your models here.
@@ -32,18 +29,26 @@ class SESEmailTemplate(models.Model):
     template_html_part = models.FileField(upload_to='aws/ses/templates/html/')
     template_keys = models.JSONField(default=dict)
 
+    # Hash of the content last pushed to SES, see aws/sync.py
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+
     def __str__(self):
         return self.template_identifier
 
 
 EMAIL_STATUS = (
     ('PENDING', 'PENDING'),
+    ('SENDING', 'SENDING'),
     ('SENT', 'SENT'),
     ('FAILED', 'FAILED'),
 )
 
 
 class TemplatedEmail(models.Model):
+    """
+    An email of the outbox, written PENDING in the transaction of the change
+    and sent by the dispatch_emails task, see aws/tasks.py.
+    """
     email = models.EmailField()
     template = models.ForeignKey(SESEmailTemplate, on_delete=models.CASCADE)
     template_data = models.JSONField(default=dict)
@@ -54,6 +59,20 @@ class TemplatedEmail(models.Model):
         default='PENDING'
     )
 
+    # Delivery state of the dispatcher, a claimed email is SENDING until its
+    # claim times out
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    message_id = models.CharField(max_length=100, blank=True, default='')
+
+    class Meta:
+        # Scanned by the dispatcher for the due and the stale emails
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_status_next_attempt_idx'),
+            models.Index(fields=['status', 'claimed_at'], name='email_status_claimed_at_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -63,8 +82,13 @@ class TemplatedEmail(models.Model):
 
     def save(self, *args, **kwargs):
 
-        # Check if the template data is correlated with the template keys
-        template_keys = self.template.template_keys
+        # Check if the template data is correlated with the template keys,
+        # read from the registry unless the template is loaded
+        if TemplatedEmail.template.is_cached(self):
+            template_keys = self.template.template_keys
+        else:
+            from aws.registry import get_template_by_id
+            template_keys = get_template_by_id(self.template_id).template_keys
         template_data = self.template_data
 
         for key in template_keys:
@@ -73,32 +97,3 @@ class TemplatedEmail(models.Model):
                     "The template data is not correlated with the template keys")
 
         super(TemplatedEmail, self).save(*args, **kwargs)
-
-    def send(self):
-        try:
-            ses = boto3.client('ses', region_name='ap-south-1')
-
-            # Define the email parameters
-            source = settings.DEFAULT_NOTIFICATION_EMAIL
-            to_addresses = [self.email]
-
-            response = ses.send_templated_email(
-                Source=source,
-                Destination={
-                    'ToAddresses': to_addresses
-                },
-                # Template names are appended with the mode of deployment
-                # to avoid conflicts in production and development
-                # because all deployments use the same AWS account
-                Template=self.get_template_identifier(),
-                TemplateData=json.dumps(self.template_data)
-            )
-            print(response)
-
-            # Get otp object with id and update the status to delivered
-            self.status = 'SENT'
-            self.save()
-        except Exception as e:
-            self.status = 'FAILED'
-            self.save()
-            raise e
@@ -0,0 +1,147 @@
+"""
+The send rate of the SES account, shared by every process.
+
+SES rejects the emails sent above the MaxSendRate of the account with a
+Throttling error. The senders take a token per email from a token bucket
+kept in Redis, at SES_RATE_REDIS_URL, so the web workers and the Celery
+workers stay under the rate together:
+
+```
+ses:send-rate   - Hash of the tokens left and the time of the last refill
+```
+
+The bucket is refilled at MaxSendRate tokens per second and holds at most
+one second of sends. The tokens are reserved, the balance may go below 0
+and the sender waits until its tokens are refilled, a bulk send of 50
+emails is never starved by the single sends.
+
+The rate is read with GetSendQuota at most once per SES_QUOTA_TTL seconds
+per process, SES_MAX_SEND_RATE overrides it.
+"""
+
+# Native imports
+import logging
+import threading
+import time
+
+# Django imports
+from django.conf import settings
+
+# Module imports
+import redis
+
+# Local imports
+from utils.clients import get_client, get_redis, get_ses
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY = 'ses:send-rate'
+
+# Used when GetSendQuota fails, the rate of the SES sandbox
+DEFAULT_SEND_RATE = 1
+
+# KEYS: the bucket. ARGV: the rate, the capacity, the tokens to reserve.
+# Returns the seconds to wait, as a string.
+RESERVE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate) - requested
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+
+class SendRateLimiter:
+    """
+    Reserves tokens of the SES send rate, see the module docstring.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.rate = None
+        self.rate_expires_at = 0
+        self.lock = threading.Lock()
+
+    def get_rate(self):
+        """
+        Returns the sends per second allowed by SES.
+        """
+        override = getattr(settings, 'SES_MAX_SEND_RATE', None)
+        if override:
+            return float(override)
+
+        now = time.monotonic()
+        if now >= self.rate_expires_at:
+            with self.lock:
+                if now >= self.rate_expires_at:
+                    try:
+                        quota = get_ses().get_send_quota()
+                        self.rate = float(quota['MaxSendRate'])
+                    except Exception as e:
+                        logger.warning('The SES send quota could not be read: %s', e)
+                        self.rate = self.rate or DEFAULT_SEND_RATE
+                    self.rate_expires_at = now + getattr(settings, 'SES_QUOTA_TTL', 300)
+
+        return self.rate
+
+    def reserve(self, count=1):
+        """
+        Reserves tokens for emails.
+
+        Returns:
+            float: The seconds to wait before sending them.
+        """
+        rate = self.get_rate()
+        client = get_redis(self.url)
+        script = get_client(
+            ('ses-reserve', self.url),
+            lambda: client.register_script(RESERVE_SCRIPT),
+            close=lambda script: None,
+        )
+
+        try:
+            return float(script(keys=[BUCKET_KEY], args=[rate, rate, count]))
+        except redis.RedisError as e:
+            # SES still throttles the excess, the sends are not blocked
+            logger.warning('The SES send rate could not be reserved: %s', e)
+            return 0
+
+    def acquire(self, count=1):
+        """
+        Blocks until the emails may be sent.
+        """
+        wait = self.reserve(count)
+        if wait > 0:
+            time.sleep(wait)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_send_limiter():
+    """
+    Returns the limiter of the SES_RATE_REDIS_URL of the settings.
+    """
+    url = settings.SES_RATE_REDIS_URL
+
+    limiter = _limiters.get(url)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(url, SendRateLimiter(url))
+
+    return limiter
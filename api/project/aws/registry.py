@@ -0,0 +1,232 @@
+"""
+In-process registry of the SES email templates.
+
+The templates change about once a month and every OTP flow reads one. The
+registry loads all of them with a single query, on startup or first use,
+and the lookups after that run no query:
+
+```
+template = get_template('EmailVerificationTemplate')
+template = get_template_by_id(email.template_id)
+```
+
+The templates returned are shared by the threads of the process, they are
+not modified.
+
+A template saved or deleted invalidates the registry once committed (see
+aws/signals.py), in this process and, through the TEMPLATE_REGISTRY_CHANNEL
+channel of TEMPLATE_REGISTRY_REDIS_URL, in every other one. The web and
+worker processes start a listener of the channel on startup, a daemon
+thread stopped on shutdown. The registry is invalidated as well when the
+listener subscribes again after a disconnection since messages may have
+been missed.
+
+The registry is reloaded after TEMPLATE_REGISTRY_TTL seconds regardless, the
+bulk writes do not send the signals.
+"""
+
+# Native imports
+import logging
+import os
+import threading
+import time
+
+# Django imports
+from django.conf import settings
+
+# Module imports
+import redis
+
+# Local imports
+from aws.models import SESEmailTemplate
+from utils.clients import get_redis
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_REGISTRY_CHANNEL = 'aws:templates'
+
+# Seconds the listener waits for a message, and before it reconnects
+LISTEN_TIMEOUT = 1
+RECONNECT_DELAY = 5
+
+
+class TemplateRegistry:
+    """
+    The templates by identifier and by id, see the module docstring.
+    """
+
+    def __init__(self, client=None):
+        # (by identifier, by id, expires at), replaced as a whole
+        self.snapshot = None
+        self.lock = threading.Lock()
+        self.client = client
+        # (pid, thread, stop event) of the listener
+        self.listener = None
+
+    def get_client(self):
+        """
+        Returns the Redis client of the channel, resolved once from
+        TEMPLATE_REGISTRY_REDIS_URL unless it was given. None without a URL.
+        """
+        if self.client is None:
+            url = getattr(settings, 'TEMPLATE_REGISTRY_REDIS_URL', None)
+            if url:
+                self.client = get_redis(url)
+
+        return self.client
+
+    def load(self):
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot is None or time.monotonic() >= snapshot[2]:
+                templates = list(SESEmailTemplate.objects.all())
+                snapshot = self.snapshot = (
+                    {template.template_identifier: template for template in templates},
+                    {template.pk: template for template in templates},
+                    time.monotonic() + getattr(settings, 'TEMPLATE_REGISTRY_TTL', 300),
+                )
+
+        return snapshot
+
+    def get_snapshot(self):
+        snapshot = self.snapshot
+        if snapshot is None or time.monotonic() >= snapshot[2]:
+            snapshot = self.load()
+
+        return snapshot
+
+    def lookup(self, index, key):
+        template = self.get_snapshot()[index].get(key)
+        if template is None:
+            # Created since the load, its invalidation may not be received yet
+            self.invalidate()
+            template = self.get_snapshot()[index].get(key)
+            if template is None:
+                raise SESEmailTemplate.DoesNotExist(f'No template {key}.')
+
+        return template
+
+    def get(self, identifier):
+        """
+        Raises:
+            SESEmailTemplate.DoesNotExist: If there is no such template.
+        """
+        return self.lookup(0, identifier)
+
+    def get_by_id(self, pk):
+        return self.lookup(1, pk)
+
+    def invalidate(self):
+        # Waits for a load in progress, it may have read the old templates
+        with self.lock:
+            self.snapshot = None
+
+    def start_listener(self):
+        """
+        Starts the listener of the channel once per process, the thread of
+        the parent does not survive a fork.
+        """
+        pid = os.getpid()
+        with self.lock:
+            if self.listener is not None and self.listener[0] == pid:
+                return
+
+            client = self.get_client()
+            if client is None:
+                return
+
+            stop = threading.Event()
+            thread = threading.Thread(
+                target=self.listen, args=(client, stop), name='template-registry', daemon=True)
+            self.listener = (pid, thread, stop)
+            thread.start()
+
+    def stop_listener(self, timeout=None):
+        """
+        Stops the listener of this process and waits for its thread.
+        """
+        with self.lock:
+            listener, self.listener = self.listener, None
+
+        if listener is not None and listener[0] == os.getpid():
+            _, thread, stop = listener
+            stop.set()
+            thread.join(timeout)
+
+    def publish(self):
+        """
+        Invalidates the registry of this process and of the others.
+        """
+        self.invalidate()
+
+        client = self.get_client()
+        if client is None:
+            return
+
+        try:
+            client.publish(TEMPLATE_REGISTRY_CHANNEL, 'invalidate')
+        except redis.RedisError as e:
+            # The other processes reload after TEMPLATE_REGISTRY_TTL
+            logger.warning('Template invalidation not published: %s', e)
+
+    def listen(self, client, stop):
+        failing = False
+        while not stop.is_set():
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(TEMPLATE_REGISTRY_CHANNEL)
+                if failing:
+                    self.invalidate()
+                    failing = False
+
+                while not stop.is_set():
+                    # Polled, a blocking read would hit the socket timeout
+                    message = pubsub.get_message(timeout=LISTEN_TIMEOUT)
+                    if message is not None and message['type'] == 'message':
+                        self.invalidate()
+            except redis.RedisError as e:
+                if not failing:
+                    logger.warning('Template registry listener disconnected: %s', e)
+                    failing = True
+                stop.wait(RECONNECT_DELAY)
+            finally:
+                pubsub.reset()
+
+
+template_registry = TemplateRegistry()
+
+
+def get_template(identifier):
+    return template_registry.get(identifier)
+
+
+def get_template_by_id(pk):
+    return template_registry.get_by_id(pk)
+
+
+def warm_templates():
+    """
+    Loads the registry ahead of the first request, called on startup.
+    """
+    try:
+        template_registry.get_snapshot()
+    except Exception as e:
+        # Loaded on first use instead, the database may not be migrated
+        logger.warning('Template registry not loaded: %s', e)
+
+
+def start_templates():
+    """
+    Loads the registry and starts its listener, called on the startup of the
+    web and worker processes.
+    """
+    warm_templates()
+    template_registry.start_listener()
+
+
+def stop_templates():
+    template_registry.stop_listener(timeout=LISTEN_TIMEOUT + 1)
+
+
+def publish_invalidation():
+    template_registry.publish()
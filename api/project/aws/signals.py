@@ -1,79 +1,45 @@
 
 # Import python libraries
-import os
-import boto3
+from functools import partial
 
 # Django import
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from django.conf import settings
+from django.dispatch import Signal, receiver
 
 # Local imports
 from aws.models import SESEmailTemplate
+from aws.registry import publish_invalidation
+
+# Sent by the dispatcher once the results of a batch are written, with the
+# ids of the sent emails and of the ones which failed for good:
+# templated_emails_dispatched.send(sender=TemplatedEmail, sent=[...], failed=[...])
+templated_emails_dispatched = Signal()
 
 
 @receiver(post_save, sender=SESEmailTemplate)
 def create_ses_template(sender, instance, created, **kwargs):
-    ses = boto3.client('ses', region_name='ap-south-1')
-
-    if created:
-        s3 = boto3.resource('s3')
-        bucket_name = os.environ.get('AWS_S3_BUCKET', None)
-        if bucket_name is not None:
-            text_part_key = instance.template_text_part.name
-            html_part_key = instance.template_html_part.name
-            text_part_object = s3.Object(bucket_name, "media/"+text_part_key)
-            html_part_object = s3.Object(bucket_name, "media/"+html_part_key)
-            text_part = text_part_object.get()['Body'].read().decode('utf-8')
-            html_part = html_part_object.get()['Body'].read().decode('utf-8')
-
-            # Get the mode of deployment from environment variables
-            mode = os.environ.get('GENIE_CONFIGURATION_KEY', None)
-
-            ses.create_template(
-                Template={
-                    'TemplateName': str(mode).upper()+"-"+instance.template_identifier,
-                    'SubjectPart': instance.template_subject,
-                    'TextPart': text_part,
-                    'HtmlPart': html_part
-                }
-            )
-        else:
-            raise Exception(
-                "AWS S3 bucket name not found in environment variables")
-    else:
-        """Update the template in SES"""
-
-        s3 = boto3.resource('s3')
-        bucket_name = os.environ.get('AWS_S3_BUCKET', None)
-        if bucket_name is not None:
-            text_part_key = instance.template_text_part.name
-            html_part_key = instance.template_html_part.name
-            text_part_object = s3.Object(bucket_name, "media/"+text_part_key)
-            html_part_object = s3.Object(bucket_name, "media/"+html_part_key)
-            text_part = text_part_object.get()['Body'].read().decode('utf-8')
-            html_part = html_part_object.get()['Body'].read().decode('utf-8')
+    """
+    The template is pushed to SES by the sync_template task once committed,
+    the save does not wait on S3 and SES. An unchanged template is not
+    pushed, see aws/sync.py.
+    """
+    # Imported here, the tasks use the signals of this module
+    from aws.tasks import sync_template
+    transaction.on_commit(partial(sync_template.delay, instance.pk))
 
-            # Get the mode of deployment from environment variables
-            mode = os.environ.get('GENIE_CONFIGURATION_KEY', None)
 
-            ses.update_template(
-                Template={
-                    'TemplateName': str(mode).upper()+"-"+instance.template_identifier,
-                    'SubjectPart': instance.template_subject,
-                    'TextPart': text_part,
-                    'HtmlPart': html_part
-                }
-            )
-        else:
-            raise Exception(
-                "AWS S3 bucket name not found in environment variables")
+@receiver(post_delete, sender=SESEmailTemplate)
+def delete_ses_template(sender, instance, **kwargs):
+    from aws.tasks import delete_template
+    transaction.on_commit(partial(delete_template.delay, instance.template_identifier))
 
 
+@receiver(post_save, sender=SESEmailTemplate)
 @receiver(post_delete, sender=SESEmailTemplate)
-def delete_ses_template(sender, instance, **kwargs):
-    ses = boto3.client('ses', region_name='ap-south-1')
-    mode = os.environ.get('GENIE_CONFIGURATION_KEY', None)
-    ses.delete_template(
-        TemplateName=str(mode).upper()+"-"+instance.template_identifier
-    )
+def invalidate_template_registry(sender, instance, **kwargs):
+    """
+    The registry of every process is invalidated once the change is
+    committed, see aws/registry.py.
+    """
+    transaction.on_commit(publish_invalidation)
@@ -0,0 +1,153 @@
+"""
+Incremental sync of the email templates to SES.
+
+A template is pushed to SES only when its content changed. The content, the
+subject and the text and HTML parts, is hashed and compared with the
+`content_hash` of the SESEmailTemplate, the hash of the content last pushed:
+
+- `create_templates` syncs the templates of the aws/templates folder, in
+  parallel, its re-runs only push the folders which changed.
+- A template saved in the admin is synced by the sync_ses_template task
+  once committed, its parts are read from the AWS_S3_BUCKET bucket.
+
+The SES templates are upserted, a template missing in SES is created.
+"""
+
+# Native imports
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+
+# Module imports
+from botocore.exceptions import ClientError
+
+# Local imports
+from aws.models import SESEmailTemplate
+from utils.clients import get_s3, get_ses
+from utils.tracing import trace_external
+
+TemplateContent = namedtuple('TemplateContent', ('subject', 'text', 'html'))
+
+
+def get_template_name(identifier):
+    # Template names are appended with the mode of deployment, all the
+    # deployments use the same AWS account
+    mode = os.environ.get('GENIE_CONFIGURATION_KEY', None)
+    return str(mode).upper() + "-" + identifier
+
+
+def get_content_hash(content):
+    """
+    Returns the SHA-256 of the content, the parts are length prefixed so
+    moving text from one part to another changes the hash.
+    """
+    digest = hashlib.sha256()
+    for part in content:
+        data = part.encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+
+    return digest.hexdigest()
+
+
+def read_folder(path):
+    """
+    Reads the content of a template folder of aws/templates.
+    """
+    def read(name):
+        with open(os.path.join(path, name), 'r') as file:
+            return file.read()
+
+    return TemplateContent(
+        read('template_subject.txt').strip(), read('template.txt'), read('template.html'))
+
+
+def read_stored(template):
+    """
+    Reads the content of a template from the AWS_S3_BUCKET bucket.
+    """
+    bucket_name = os.environ.get('AWS_S3_BUCKET', None)
+    if bucket_name is None:
+        raise Exception(
+            "AWS S3 bucket name not found in environment variables")
+
+    s3 = get_s3()
+
+    def read(field):
+        response = s3.get_object(Bucket=bucket_name, Key="media/" + field.name)
+        return response['Body'].read().decode('utf-8')
+
+    return TemplateContent(
+        template.template_subject,
+        read(template.template_text_part),
+        read(template.template_html_part),
+    )
+
+
+def push(identifier, content):
+    """
+    Creates or updates the SES template.
+    """
+    ses = get_ses()
+    template = {
+        'TemplateName': get_template_name(identifier),
+        'SubjectPart': content.subject,
+        'TextPart': content.text,
+        'HtmlPart': content.html,
+    }
+
+    with trace_external('ses'):
+        try:
+            ses.update_template(Template=template)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TemplateDoesNotExist':
+                raise
+            ses.create_template(Template=template)
+
+
+def sync_templates(pairs, max_workers=8, force=False):
+    """
+    Pushes the templates whose content changed, in parallel, and stores
+    their new hash.
+
+    Args:
+        pairs (list): The templates and their content.
+        max_workers (int): The concurrent pushes.
+        force (bool): Push the unchanged templates as well.
+
+    Returns:
+        list: The result of each template, in order. True if it was pushed,
+            False if it was unchanged or the exception of its push.
+    """
+    results = [False] * len(pairs)
+    changed = []
+    for index, (template, content) in enumerate(pairs):
+        content_hash = get_content_hash(content)
+        if force or content_hash != template.content_hash:
+            changed.append((index, template, content, content_hash))
+
+    if not changed:
+        return results
+
+    def run(item):
+        _, template, content, _ = item
+        try:
+            push(template.template_identifier, content)
+        except Exception as e:
+            return e
+
+    # Only the SES calls run on the threads, the database is written here
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(changed))) as executor:
+        errors = list(executor.map(run, changed))
+
+    pushed = []
+    for (index, template, _, content_hash), error in zip(changed, errors):
+        if error is None:
+            template.content_hash = content_hash
+            pushed.append(template)
+        results[index] = error or True
+
+    # Not saved, the post_save signal would sync the templates again
+    SESEmailTemplate.objects.bulk_update(pushed, ['content_hash'])
+    return results
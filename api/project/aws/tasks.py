@@ -0,0 +1,261 @@
+"""
+Background tasks of the aws app.
+
+The TemplatedEmail rows are an outbox. They are written PENDING in the
+transaction of the change which emails the user, and sent once committed
+by the dispatch_emails task:
+
+- The due emails are claimed, SENDING, with `SKIP LOCKED`, concurrent
+  dispatchers never claim the same email.
+- The claimed emails are grouped by template and sent with
+  SendBulkTemplatedEmail, up to MAX_DESTINATIONS emails per call. Every
+  call first takes a token of the send rate per email, see aws/quota.py.
+- The status of every destination is written back with a single bulk
+  update. The emails which failed transiently are PENDING again after a
+  backoff, the others are FAILED, the dead-letter state, once
+  EMAIL_DISPATCH_MAX_ATTEMPTS attempts are exhausted. A call rejected by
+  SES fails its emails at once, only its throttling and server errors are
+  retried.
+- A dispatcher which dies leaves its emails SENDING, they are claimed again
+  after EMAIL_DISPATCH_CLAIM_TIMEOUT. A live dispatcher waiting on the send
+  rate renews its claim before it gets stale.
+
+The task is enqueued on commit by the writers of the outbox, and scheduled
+by Celery beat for the retries and the stale claims.
+"""
+
+# Native imports
+from itertools import groupby
+from operator import attrgetter
+import json
+import logging
+import random
+import time
+
+# Django imports
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+# Module imports
+from botocore.exceptions import ClientError
+from celery import shared_task
+
+# Local imports
+from utils.clients import get_ses
+from utils.tracing import trace_external
+from .models import SESEmailTemplate, TemplatedEmail
+from .quota import get_send_limiter
+from .signals import templated_emails_dispatched
+from .sync import get_template_name, read_stored, sync_templates
+
+logger = logging.getLogger(__name__)
+
+# Destinations of a SendBulkTemplatedEmail call, the limit of SES
+MAX_DESTINATIONS = 50
+
+# Statuses of a destination which may succeed on a later attempt, the
+# others are final
+TRANSIENT_STATUSES = (
+    'TransientFailure',
+    'AccountThrottled',
+    'AccountDailyQuotaExceeded',
+    'AccountSendingPaused',
+)
+
+# Error codes of a failed call which may succeed on a later attempt, with
+# the server errors
+TRANSIENT_ERROR_CODES = (
+    'Throttling',
+    'ThrottlingException',
+)
+
+
+def get_retry_delay(attempts):
+    """
+    Exponential backoff with full jitter, the emails which failed during an
+    SES outage are not all retried at once.
+    """
+    base = getattr(settings, 'EMAIL_DISPATCH_BACKOFF', 2)
+    maximum = getattr(settings, 'EMAIL_DISPATCH_BACKOFF_MAX', 300)
+    return timezone.timedelta(seconds=random.uniform(0, min(maximum, base * 2 ** attempts)))
+
+
+def get_error_status(error):
+    """
+    Returns the status of the emails of a failed SendBulkTemplatedEmail call.
+
+    The connection errors, the throttling and the server errors are
+    retried. The other errors of SES reject the request itself (an unknown
+    template, a rejected message, an invalid parameter), they would fail
+    again and their code is the final status.
+    """
+    if not isinstance(error, ClientError):
+        return 'TransientFailure'
+
+    code = error.response.get('Error', {}).get('Code', '')
+    http_status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    if code in TRANSIENT_ERROR_CODES or http_status >= 500:
+        return 'TransientFailure'
+
+    return code or 'ClientError'
+
+
+def get_claim_timeout():
+    return getattr(settings, 'EMAIL_DISPATCH_CLAIM_TIMEOUT', timezone.timedelta(minutes=5))
+
+
+def claim_emails(batch_size):
+    """
+    Claims the due emails and the ones of a dead dispatcher.
+
+    Returns:
+        list: The claimed emails, SENDING, with their template.
+    """
+    now = timezone.now()
+    claim_timeout = get_claim_timeout()
+
+    due = Q(status='PENDING') & (
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+    stale = Q(status='SENDING', claimed_at__lt=now - claim_timeout)
+
+    with transaction.atomic():
+        emails = list(
+            TemplatedEmail.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('template')
+            .filter(due | stale)
+            .order_by('pk')[:batch_size]
+        )
+        TemplatedEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status='SENDING', claimed_at=now)
+
+    return emails
+
+
+def send_bulk(ses, emails):
+    """
+    Sends emails of the same template in a single SendBulkTemplatedEmail
+    call.
+
+    Returns:
+        list: The status of each email, in order.
+    """
+    with trace_external('ses'):
+        response = ses.send_bulk_templated_email(
+            Source=settings.DEFAULT_NOTIFICATION_EMAIL,
+            Template=emails[0].get_template_identifier(),
+            # Every email carries all of its template data
+            DefaultTemplateData='{}',
+            Destinations=[
+                {
+                    'Destination': {'ToAddresses': [email.email]},
+                    'ReplacementTemplateData': json.dumps(email.template_data),
+                }
+                for email in emails
+            ],
+        )
+
+    return response['Status']
+
+
+@shared_task
+def dispatch_emails():
+    """
+    Sends a batch of the outbox, see the module docstring.
+    """
+    batch_size = getattr(settings, 'EMAIL_DISPATCH_BATCH_SIZE', 500)
+    max_attempts = getattr(settings, 'EMAIL_DISPATCH_MAX_ATTEMPTS', 6)
+
+    emails = claim_emails(batch_size)
+    if not emails:
+        return {'sent': 0, 'retried': 0, 'failed': 0}
+
+    ses = get_ses()
+    limiter = get_send_limiter()
+    now = timezone.now()
+    sent, retried, failed = [], [], []
+
+    # At the sandbox rate of 1 email per second the last chunks of a batch
+    # wait longer than the claim timeout. The emails stay SENDING until the
+    # write back, their claim is renewed at half of the timeout so another
+    # dispatcher does not send them again
+    renew_after = get_claim_timeout().total_seconds() / 2
+    claimed_at = time.monotonic()
+
+    def renew_claim():
+        nonlocal claimed_at
+        if time.monotonic() - claimed_at >= renew_after:
+            TemplatedEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                claimed_at=timezone.now())
+            claimed_at = time.monotonic()
+
+    def fail(email, error):
+        email.attempts += 1
+        email.claimed_at = None
+        if error in TRANSIENT_STATUSES and email.attempts < max_attempts:
+            email.status = 'PENDING'
+            email.next_attempt_at = now + get_retry_delay(email.attempts)
+            retried.append(email.pk)
+        else:
+            logger.error('Email %s dead-lettered: %s', email.pk, error)
+            email.status = 'FAILED'
+            failed.append(email.pk)
+
+    emails.sort(key=attrgetter('template_id', 'pk'))
+    for _, group in groupby(emails, key=attrgetter('template_id')):
+        group = list(group)
+        for start in range(0, len(group), MAX_DESTINATIONS):
+            chunk = group[start:start + MAX_DESTINATIONS]
+            try:
+                limiter.acquire(len(chunk))
+                renew_claim()
+                statuses = send_bulk(ses, chunk)
+            except Exception as e:
+                # The whole call failed, every email shares its status
+                logger.warning('Bulk send of %s emails failed: %s', len(chunk), e)
+                statuses = [{'Status': get_error_status(e)}] * len(chunk)
+
+            for email, status in zip(chunk, statuses):
+                if status['Status'] != 'Success':
+                    fail(email, status['Status'])
+                    continue
+
+                email.attempts += 1
+                email.status = 'SENT'
+                email.message_id = status.get('MessageId', '')
+                email.claimed_at = None
+                email.next_attempt_at = None
+                sent.append(email.pk)
+
+    TemplatedEmail.objects.bulk_update(
+        emails,
+        ['status', 'attempts', 'next_attempt_at', 'claimed_at', 'message_id'],
+    )
+    templated_emails_dispatched.send(sender=TemplatedEmail, sent=sent, failed=failed)
+
+    return {'sent': len(sent), 'retried': len(retried), 'failed': len(failed)}
+
+
+@shared_task
+def sync_template(template_id):
+    """
+    Pushes a saved template to SES if its content changed, see aws/sync.py.
+    """
+    template = SESEmailTemplate.objects.filter(pk=template_id).first()
+    if template is None:
+        # Deleted in the meantime
+        return False
+
+    result, = sync_templates([(template, read_stored(template))])
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+
+@shared_task
+def delete_template(identifier):
+    with trace_external('ses'):
+        get_ses().delete_template(TemplateName=get_template_name(identifier))
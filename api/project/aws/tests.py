@@ -1,3 +1,503 @@
-from django.test import TestCase
+""" Tests for the aws app """
 
-# Create your tests here.
+# Native imports
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import queue
+import tempfile
+import time
+from unittest import mock, skipUnless
+
+# Django imports
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection, send_mass_mail
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+# Module imports
+from botocore.exceptions import ClientError
+import redis
+
+# Application imports
+from aws.models import SESEmailTemplate, TemplatedEmail
+from aws.quota import BUCKET_KEY, SendRateLimiter
+from aws.registry import TEMPLATE_REGISTRY_CHANNEL, TemplateRegistry, get_template, template_registry
+from aws.sync import TemplateContent
+from aws.tasks import claim_emails, dispatch_emails, send_bulk, sync_template
+from utils import clients, tracing
+
+
+@override_settings(EMAIL_DISPATCH_MAX_ATTEMPTS=2, EMAIL_DISPATCH_BACKOFF=0)
+class EmailDispatchTests(TestCase):
+    """
+    The outbox is sent with one SendBulkTemplatedEmail call per template and
+    chunk of 50 emails, the result of each email is written back.
+    """
+
+    def setUp(self):
+        # Bulk created, the templates are not synced to SES
+        self.welcome, self.verification = SESEmailTemplate.objects.bulk_create([
+            SESEmailTemplate(template_identifier='WelcomeTemplate'),
+            SESEmailTemplate(template_identifier='EmailVerificationTemplate'),
+        ])
+
+        patcher = mock.patch('aws.tasks.get_ses')
+        self.ses = patcher.start().return_value
+        self.ses.send_bulk_templated_email.side_effect = self.send_bulk
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('aws.tasks.get_send_limiter')
+        self.limiter = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+        # Results of SES per address, the others succeed
+        self.statuses = {}
+
+    def send_bulk(self, **kwargs):
+        return {'Status': [
+            {
+                'Status': self.statuses.get(destination['Destination']['ToAddresses'][0], 'Success'),
+                'MessageId': destination['Destination']['ToAddresses'][0],
+            }
+            for destination in kwargs['Destinations']
+        ]}
+
+    def create_emails(self, template, count):
+        return TemplatedEmail.objects.bulk_create([
+            TemplatedEmail(
+                template=template,
+                email=f'{template.template_identifier}-{index}@gmail.com',
+                template_data={'index': index},
+            )
+            for index in range(count)
+        ])
+
+    def test_grouped_by_template(self):
+        self.create_emails(self.welcome, 101)
+        self.create_emails(self.verification, 3)
+
+        self.assertEqual(dispatch_emails(), {'sent': 104, 'retried': 0, 'failed': 0})
+
+        welcome = TemplatedEmail(template=self.welcome).get_template_identifier()
+        verification = TemplatedEmail(template=self.verification).get_template_identifier()
+        calls = self.ses.send_bulk_templated_email.call_args_list
+        self.assertEqual(
+            [(call.kwargs['Template'], len(call.kwargs['Destinations'])) for call in calls],
+            [(welcome, 50), (welcome, 50), (welcome, 1), (verification, 3)],
+        )
+        # A token of the send rate per email
+        self.assertEqual(
+            [call.args for call in self.limiter.acquire.call_args_list],
+            [(50,), (50,), (1,), (3,)],
+        )
+
+        destination = calls[0].kwargs['Destinations'][1]
+        self.assertEqual(json.loads(destination['ReplacementTemplateData']), {'index': 1})
+
+        self.assertFalse(TemplatedEmail.objects.exclude(status='SENT').exists())
+        email = TemplatedEmail.objects.get(email='WelcomeTemplate-7@gmail.com')
+        self.assertEqual(email.message_id, email.email)
+        self.assertEqual(email.attempts, 1)
+
+    def test_statuses_written_back(self):
+        self.create_emails(self.welcome, 3)
+        self.statuses = {
+            'WelcomeTemplate-1@gmail.com': 'TransientFailure',
+            'WelcomeTemplate-2@gmail.com': 'MessageRejected',
+        }
+
+        with mock.patch('aws.tasks.templated_emails_dispatched.send') as dispatched:
+            dispatch_emails()
+        dispatched.assert_called_once_with(sender=TemplatedEmail, sent=[mock.ANY], failed=[mock.ANY])
+
+        statuses = dict(TemplatedEmail.objects.values_list('email', 'status'))
+        self.assertEqual(statuses, {
+            'WelcomeTemplate-0@gmail.com': 'SENT',
+            'WelcomeTemplate-1@gmail.com': 'PENDING',
+            'WelcomeTemplate-2@gmail.com': 'FAILED',
+        })
+
+        # Retried once, then dead-lettered
+        self.assertEqual(dispatch_emails(), {'sent': 0, 'retried': 0, 'failed': 1})
+        self.assertEqual(
+            TemplatedEmail.objects.get(email='WelcomeTemplate-1@gmail.com').status, 'FAILED')
+
+    def test_call_errors(self):
+        self.create_emails(self.welcome, 2)
+
+        def client_error(code, http_status=400):
+            return ClientError(
+                {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': http_status}},
+                'SendBulkTemplatedEmail')
+
+        cases = [
+            # Rejected again on every attempt, failed at once
+            (client_error('MessageRejected'), 'FAILED'),
+            (client_error('TemplateDoesNotExist'), 'FAILED'),
+            (client_error('Throttling'), 'PENDING'),
+            (client_error('InternalFailure', 500), 'PENDING'),
+            (ConnectionError('SES is unreachable'), 'PENDING'),
+        ]
+        for error, status in cases:
+            TemplatedEmail.objects.update(status='PENDING', next_attempt_at=None, attempts=0)
+            self.ses.send_bulk_templated_email.side_effect = error
+
+            dispatch_emails()
+
+            self.assertEqual(
+                list(TemplatedEmail.objects.values_list('status', flat=True)),
+                [status] * 2, error)
+
+    def test_claims(self):
+        emails = self.create_emails(self.welcome, 3)
+        stale = timezone.now() - timezone.timedelta(minutes=10)
+        TemplatedEmail.objects.filter(pk=emails[0].pk).update(status='SENDING', claimed_at=stale)
+        TemplatedEmail.objects.filter(pk=emails[1].pk).update(status='SENDING', claimed_at=timezone.now())
+        TemplatedEmail.objects.filter(pk=emails[2].pk).update(
+            next_attempt_at=timezone.now() + timezone.timedelta(minutes=1))
+
+        # Only the email of a dead dispatcher is due
+        self.assertEqual(dispatch_emails(), {'sent': 1, 'retried': 0, 'failed': 0})
+        self.assertEqual(TemplatedEmail.objects.get(pk=emails[0].pk).status, 'SENT')
+
+    @override_settings(GRAPHQL_TRACING=True)
+    def test_ses_call_traced(self):
+        emails = self.create_emails(self.welcome, 2)
+
+        def send(**kwargs):
+            time.sleep(0.01)
+            return self.send_bulk(**kwargs)
+
+        self.ses.send_bulk_templated_email.side_effect = send
+
+        trace, token = tracing.start_trace('dispatchEmails')
+        try:
+            send_bulk(self.ses, emails)
+        finally:
+            tracing.current_trace.reset(token)
+
+        self.assertEqual(trace.external['ses']['count'], 1)
+        self.assertGreaterEqual(trace.external['ses']['duration'], 10 ** 7)
+
+    def test_claim_renewed_while_throttled(self):
+        self.create_emails(self.welcome, 120)
+        clock = [0]
+
+        def acquire(tokens):
+            # Waits 10 minutes for the tokens, twice the claim timeout
+            clock[0] += 600
+            TemplatedEmail.objects.filter(status='SENDING').update(
+                claimed_at=timezone.now() - timezone.timedelta(minutes=10))
+
+        def send_bulk(**kwargs):
+            # Another dispatcher finds no stale email to send again
+            self.assertEqual(claim_emails(500), [])
+            return self.send_bulk(**kwargs)
+
+        self.limiter.acquire.side_effect = acquire
+        self.ses.send_bulk_templated_email.side_effect = send_bulk
+
+        with mock.patch('aws.tasks.time.monotonic', side_effect=lambda: clock[0]):
+            self.assertEqual(dispatch_emails(), {'sent': 120, 'retried': 0, 'failed': 0})
+        self.assertEqual(self.ses.send_bulk_templated_email.call_count, 3)
+
+
+class SharedClientTests(SimpleTestCase):
+    """
+    The clients are created once per process and settings, and closed when
+    the process exits.
+    """
+
+    def setUp(self):
+        clients.close_clients()
+        self.addCleanup(clients.close_clients)
+
+    def test_shared(self):
+        with ThreadPoolExecutor(8) as executor:
+            created = set(map(id, executor.map(lambda _: clients.get_ses(), range(32))))
+        self.assertEqual(len(created), 1)
+        self.assertEqual(clients.get_ses().meta.config.max_pool_connections, 10)
+
+        with override_settings(AWS_SES_REGION='eu-west-1'):
+            self.assertEqual(clients.get_ses().meta.region_name, 'eu-west-1')
+
+    @mock.patch('requests.Session.close')
+    def test_startup(self, close):
+        with mock.patch('utils.clients.atexit.register') as register, \
+                mock.patch('utils.clients.start_templates') as start_templates:
+            clients.startup()
+
+        self.assertIn(('google',), clients._clients)
+        start_templates.assert_called_once()
+        # Daphne sends no lifespan events, the clients are closed on exit
+        register.assert_called_once_with(clients.shutdown)
+
+        with mock.patch('utils.clients.stop_templates') as stop_templates:
+            clients.shutdown()
+
+        stop_templates.assert_called_once()
+        close.assert_called_once()
+        self.assertEqual(clients._clients, {})
+
+
+@override_settings(EMAIL_BACKEND='project.local.ses_backend.SESBackend', SES_SEND_MAX_WORKERS=4)
+class SESBackendTests(SimpleTestCase):
+    """
+    The messages are sent concurrently, each after a token of the send rate,
+    and the result of every message is reported.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('project.local.ses_backend.get_ses')
+        self.ses = patcher.start().return_value
+        self.ses.send_email.side_effect = self.send_email
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('project.local.ses_backend.get_send_limiter')
+        self.limiter = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def send_email(self, **kwargs):
+        address = kwargs['Destination']['ToAddresses'][0]
+        if address == 'rejected@gmail.com':
+            raise Exception('Email address is not verified.')
+        return {'MessageId': address}
+
+    def test_send_mass_mail(self):
+        messages = [
+            ('Subject', 'Body', 'from@gmail.com', [f'user-{index}@gmail.com'])
+            for index in range(100)
+        ]
+        messages.append(('Subject', 'Body', 'from@gmail.com', ['rejected@gmail.com']))
+
+        connection = get_connection(fail_silently=True)
+        self.assertEqual(send_mass_mail(messages, connection=connection), 100)
+        self.assertEqual(self.limiter.acquire.call_count, 101)
+
+        results = connection.results
+        self.assertEqual(results[7].message_id, 'user-7@gmail.com')
+        self.assertEqual([result.message.to for result in results if result.error], [['rejected@gmail.com']])
+
+    def test_raises_after_every_message(self):
+        messages = [
+            EmailMessage('Subject', 'Body', 'from@gmail.com', [address])
+            for address in ('rejected@gmail.com', 'user@gmail.com')
+        ]
+
+        with self.assertRaisesMessage(Exception, 'Email address is not verified.'):
+            get_connection().send_messages(messages)
+        self.assertEqual(self.ses.send_email.call_count, 2)
+
+
+def redis_available():
+    try:
+        return clients.get_redis(settings.SES_RATE_REDIS_URL).ping()
+    except redis.RedisError:
+        return False
+
+
+class SendRateLimiterTests(SimpleTestCase):
+    """
+    The send rate is read from GetSendQuota and its tokens are reserved in
+    Redis.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('aws.quota.get_ses')
+        self.ses = patcher.start().return_value
+        self.ses.get_send_quota.return_value = {'MaxSendRate': 10.0}
+        self.addCleanup(patcher.stop)
+
+        self.limiter = SendRateLimiter(settings.SES_RATE_REDIS_URL)
+
+    def test_rate_from_quota(self):
+        self.assertEqual(self.limiter.get_rate(), 10)
+        self.assertEqual(self.limiter.get_rate(), 10)
+        self.ses.get_send_quota.assert_called_once()
+
+        with override_settings(SES_MAX_SEND_RATE=50):
+            self.assertEqual(self.limiter.get_rate(), 50)
+
+    @skipUnless(redis_available(), 'Redis is not reachable')
+    def test_reserve(self):
+        client = clients.get_redis(settings.SES_RATE_REDIS_URL)
+        client.delete(BUCKET_KEY)
+        self.addCleanup(client.delete, BUCKET_KEY)
+
+        # A second of sends, then the reservations wait for the refill
+        self.assertEqual(self.limiter.reserve(10), 0)
+        self.assertAlmostEqual(self.limiter.reserve(5), 0.5, delta=0.05)
+        self.assertAlmostEqual(self.limiter.reserve(5), 1, delta=0.05)
+
+
+class TemplateRegistryTests(TestCase):
+    """
+    The templates are read from the registry, which is invalidated when a
+    template changes in any process.
+    """
+
+    def setUp(self):
+        self.template, = SESEmailTemplate.objects.bulk_create([
+            SESEmailTemplate(template_identifier='WelcomeTemplate', template_subject='Welcome')])
+        template_registry.invalidate()
+
+    def test_lookups(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_template('WelcomeTemplate').pk, self.template.pk)
+
+        with self.assertNumQueries(0):
+            get_template('WelcomeTemplate')
+            template_registry.get_by_id(self.template.pk)
+
+        # Only the insert, the template keys are read from the registry
+        with self.assertNumQueries(1):
+            TemplatedEmail(template_id=self.template.pk, email='user@gmail.com').save()
+
+        # A miss reloads once before failing
+        with self.assertNumQueries(1), self.assertRaises(SESEmailTemplate.DoesNotExist):
+            get_template('ResetPasswordTemplate')
+
+    @mock.patch('aws.tasks.sync_template.delay', mock.Mock())
+    def test_invalidated_on_commit(self):
+        get_template('WelcomeTemplate')
+
+        with mock.patch.object(template_registry, 'client') as client:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.template.template_subject = 'Hello'
+                self.template.save()
+
+                # Not before the commit
+                self.assertEqual(get_template('WelcomeTemplate').template_subject, 'Welcome')
+
+        client.publish.assert_called_once_with(TEMPLATE_REGISTRY_CHANNEL, 'invalidate')
+        self.assertEqual(get_template('WelcomeTemplate').template_subject, 'Hello')
+
+    def test_listener(self):
+        messages = queue.Queue()
+
+        def get_message(timeout):
+            try:
+                return messages.get(timeout=0.01)
+            except queue.Empty:
+                return None
+
+        client = mock.Mock()
+        client.pubsub.return_value.get_message.side_effect = get_message
+        registry = TemplateRegistry(client=client)
+        registry.get('WelcomeTemplate')
+        registry.start_listener()
+        _, thread, _ = registry.listener
+
+        def wait(condition):
+            deadline = time.monotonic() + 5
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        # Only the published messages invalidate
+        messages.put({'type': 'pong', 'data': ''})
+        wait(messages.empty)
+        time.sleep(0.05)
+        self.assertIsNotNone(registry.snapshot)
+
+        messages.put({'type': 'message', 'data': 'invalidate'})
+        wait(lambda: registry.snapshot is None)
+        self.assertIsNone(registry.snapshot)
+
+        registry.stop_listener()
+        self.assertFalse(thread.is_alive())
+        client.pubsub.return_value.subscribe.assert_called_once_with(TEMPLATE_REGISTRY_CHANNEL)
+
+    @skipUnless(redis_available(), 'Redis is not reachable')
+    @mock.patch('aws.registry.TEMPLATE_REGISTRY_CHANNEL', 'aws:templates:test')
+    def test_invalidated_by_other_processes(self):
+        client = clients.get_redis(settings.TEMPLATE_REGISTRY_REDIS_URL)
+        registry = TemplateRegistry(client=client)
+        registry.get('WelcomeTemplate')
+        registry.start_listener()
+        self.addCleanup(registry.stop_listener)
+
+        # Published until the listener is subscribed and receives one
+        deadline = time.monotonic() + 5
+        while registry.snapshot is not None and time.monotonic() < deadline:
+            client.publish('aws:templates:test', 'invalidate')
+            time.sleep(0.05)
+        self.assertIsNone(registry.snapshot)
+
+
+class TemplateSyncTests(TestCase):
+    """
+    Only the templates whose content changed are pushed to SES, the saves
+    push them in the background.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('aws.sync.get_ses')
+        self.ses = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+        # None of the templates exists in SES yet
+        self.ses.update_template.side_effect = ClientError(
+            {'Error': {'Code': 'TemplateDoesNotExist'}}, 'UpdateTemplate')
+
+        patcher = mock.patch.object(template_registry, 'client')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        for name in ('WelcomeTemplate', 'EmailVerificationTemplate'):
+            self.write(name, 'template_subject.txt', f'{name} subject\n')
+            self.write(name, 'template.txt', 'Your code is {{otp}}')
+            self.write(name, 'template.html', '<p>Your code is {{otp}}</p>')
+
+    def write(self, name, part, content):
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        with open(os.path.join(self.path, name, part), 'w') as file:
+            file.write(content)
+
+    def create_templates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('create_templates', path=self.path, stdout=mock.Mock())
+
+    def test_command_incremental(self):
+        self.create_templates()
+        self.assertEqual(self.ses.create_template.call_count, 2)
+        template = SESEmailTemplate.objects.get(template_identifier='WelcomeTemplate')
+        self.assertEqual(template.template_subject, 'WelcomeTemplate subject')
+        self.assertEqual(len(template.content_hash), 64)
+
+        # Re-runs are idempotent and push nothing
+        self.ses.reset_mock()
+        self.ses.update_template.side_effect = None
+        self.create_templates()
+        self.ses.update_template.assert_not_called()
+        self.assertEqual(SESEmailTemplate.objects.count(), 2)
+
+        self.write('WelcomeTemplate', 'template.html', '<p>Your new code is {{otp}}</p>')
+        self.create_templates()
+        self.assertEqual(
+            [call.kwargs['Template']['HtmlPart'] for call in self.ses.update_template.call_args_list],
+            ['<p>Your new code is {{otp}}</p>'],
+        )
+
+    def test_save_syncs_in_background(self):
+        content = TemplateContent('Welcome', 'Hello', '<p>Hello</p>')
+
+        # Run in place of the worker, whatever the broker of the environment
+        with mock.patch('aws.tasks.read_stored', return_value=content), \
+                mock.patch.object(sync_template, 'delay', side_effect=sync_template):
+            with self.captureOnCommitCallbacks(execute=True):
+                template = SESEmailTemplate.objects.create(
+                    template_identifier='WelcomeTemplate', template_subject='Welcome')
+
+                # Not before the commit
+                self.ses.create_template.assert_not_called()
+
+            self.ses.create_template.assert_called_once()
+
+            # The content did not change
+            self.assertFalse(sync_template(template.pk))
+            self.ses.update_template.assert_called_once()
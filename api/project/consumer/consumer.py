@@ -15,7 +15,6 @@ Define your app consumers and inherit that class here.
 import json
 
 # Django imports
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.http import HttpRequest
@@ -23,6 +22,7 @@ from asgiref.sync import sync_to_async
 
 # Local imports
 from .models import Connection
+from utils.auth import get_jwt_authentication, get_model_user
 from utils.errors import BaseWSException
 
 # Consumers
@@ -111,10 +111,22 @@ class BaseConsumer(AsyncWebsocketConsumer, AccountsConsumer):
             request = HttpRequest()
             request.META['HTTP_AUTHORIZATION'] = f'{token}'
 
-            authenticateJWT = sync_to_async(
-                JWTAuthentication().authenticate)
+            authentication = get_jwt_authentication()
 
-            self.user, _ = await authenticateJWT(request)
+            # Tokens seen before (every token with stateless authentication)
+            # are served without leaving the event loop, the others are
+            # validated in a thread
+            raw_token = authentication.get_raw_token(
+                authentication.get_header(request))
+            cached = authentication.get_cached(raw_token) if raw_token else None
+
+            if cached is not None:
+                user, _ = cached
+            else:
+                authenticateJWT = sync_to_async(authentication.authenticate)
+                user, _ = await authenticateJWT(request)
+
+            self.user = get_model_user(user)
 
             self.connection, _ = await database_sync_to_async(Connection.objects.get_or_create)(
                 client=client,
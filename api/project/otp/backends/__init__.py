@@ -0,0 +1,30 @@
+"""
+Storage backends of the one time passwords.
+
+The protected mutations go through the store named by OTP_STORE:
+
+- `otp.backends.database.DatabaseOTPStore` keeps the OTPs in Postgres, the
+  default.
+- `otp.backends.redis.RedisOTPStore` keeps them as Redis keys which expire
+  on their own, the OTPs never touch Postgres.
+"""
+
+# Django imports
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_OTP_STORE = 'otp.backends.database.DatabaseOTPStore'
+
+# One store per class path, the setting is read on every call so it can be
+# overridden in the tests
+_stores = {}
+
+
+def get_otp_store():
+    path = getattr(settings, 'OTP_STORE', DEFAULT_OTP_STORE)
+
+    store = _stores.get(path)
+    if store is None:
+        store = _stores.setdefault(path, import_string(path)())
+
+    return store
@@ -0,0 +1,50 @@
+""" Interface of the OTP stores. """
+
+
+class BaseOTPStore:
+    """
+    Stores the one time passwords of the protected mutations.
+
+    An OTP goes through three steps, each is a method of the store:
+
+    - `create` emails a new code to the user.
+    - `validate` consumes the code, in exchange for the id of the OTP and a
+      ghost code.
+    - `complete` checks the ghost code, the protected action is performed
+      if it matches. The other consumed OTPs of the user are invalidated.
+
+    The OTPs are scoped by user and template identifier, a code sent for
+    the email verification can not reset the password.
+    """
+
+    def create(self, user, template):
+        """
+        Creates an OTP and emails its code to the user.
+
+        Args:
+            user (User): The user.
+            template (str): The identifier of the email template.
+
+        Returns:
+            str: The id of the OTP.
+        """
+        raise NotImplementedError('OTP stores must implement create()')
+
+    def validate(self, code, user, template):
+        """
+        Consumes the OTP of the code.
+
+        Returns:
+            tuple: Whether the code was valid, the ghost code and the id of
+                the OTP.
+        """
+        raise NotImplementedError('OTP stores must implement validate()')
+
+    def complete(self, otp_id, ghost_code, user, template):
+        """
+        Completes the consumed OTP if the ghost code matches.
+
+        Returns:
+            bool: Whether the ghost code was valid.
+        """
+        raise NotImplementedError('OTP stores must implement complete()')
@@ -0,0 +1,38 @@
+""" OTP store backed by the OneTimePassword model. """
+
+# Local imports
+from aws.registry import get_template
+from otp.backends.base import BaseOTPStore
+from otp.models import OneTimePassword, validateActionWithGhostCode, validateUserWithOTP
+
+
+class DatabaseOTPStore(BaseOTPStore):
+    """
+    Keeps the OTPs as OneTimePassword rows, they are emailed by the post_save
+    signal and expired by the sweeper (see otp/tasks.py).
+    """
+
+    def create(self, user, template):
+        otp = OneTimePassword.objects.create(
+            user=user,
+            email_template=get_template(template),
+        )
+        return str(otp.id)
+
+    def validate(self, code, user, template):
+        success, ghost_code, otp = validateUserWithOTP(
+            code=code,
+            user_id=user.id,
+            template=get_template(template),
+        )
+        return success, ghost_code, str(otp.id) if otp else None
+
+    def complete(self, otp_id, ghost_code, user, template):
+        # Scoped as the codes are, the OTP of another user or flow is unknown
+        try:
+            otp = OneTimePassword.objects.get(
+                id=otp_id, user=user, email_template=get_template(template))
+        except (OneTimePassword.DoesNotExist, ValueError):
+            return False
+
+        return validateActionWithGhostCode(ghost_code=ghost_code, otp=otp)
@@ -0,0 +1,165 @@
+"""
+OTP store backed by Redis.
+
+The OTPs are short lived, they are kept as Redis keys which expire on their
+own instead of rows updated on every step:
+
+```
+otp:{<user_id>:<template>}:code:<code>   - "<otp_id>:<ghost_code>", until the code expires
+otp:{<user_id>:<template>}:consumed      - Hash of the consumed OTPs, otp_id -> ghost_code
+```
+
+The steps are Lua scripts, a code is consumed and a ghost code is checked
+atomically, concurrent submits of the same code can not both succeed. The
+keys of a user and template share a hash tag, the scripts also work on a
+Redis cluster.
+
+Only the emails are written to Postgres, as TemplatedEmail rows of the
+outbox sent by the dispatch_emails task.
+"""
+
+# Native imports
+from functools import partial
+import secrets
+
+# Django imports
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# Local imports
+from aws.models import TemplatedEmail
+from aws.registry import get_template
+from aws.tasks import dispatch_emails
+from otp.backends.base import BaseOTPStore
+from otp.models import generate_code, generate_ghost_code
+from utils.clients import get_client as get_shared_client, get_redis
+
+# Attempts to draw a code which is not outstanding for the user
+MAX_CODE_ATTEMPTS = 5
+
+# KEYS: the code key, the consumed hash. ARGV: the ghost code TTL.
+CONSUME_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if not value then
+    return false
+end
+
+redis.call('DEL', KEYS[1])
+local separator = string.find(value, ':', 1, true)
+redis.call('HSET', KEYS[2], string.sub(value, 1, separator - 1), string.sub(value, separator + 1))
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return value
+"""
+
+# KEYS: the consumed hash. ARGV: the OTP id, the ghost code.
+COMPLETE_SCRIPT = """
+local ghost_code = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[1])
+if ghost_code and ghost_code == ARGV[2] then
+    return 1
+end
+return 0
+"""
+
+
+def register_scripts(url):
+    connection = get_redis(url)
+    return (
+        connection,
+        connection.register_script(CONSUME_SCRIPT),
+        connection.register_script(COMPLETE_SCRIPT),
+    )
+
+
+def get_client(url):
+    """
+    Returns the shared client of the URL and its consume and complete
+    scripts.
+    """
+    # The client itself is closed with the shared clients
+    return get_shared_client(
+        ('otp-scripts', url), partial(register_scripts, url), close=lambda scripts: None)
+
+
+class RedisOTPStore(BaseOTPStore):
+    """
+    Keeps the OTPs as Redis keys with a TTL, see the module docstring.
+    """
+
+    def __init__(self, url=None):
+        self.url = url
+
+    def get_client(self):
+        return get_client(self.url or settings.OTP_REDIS_URL)
+
+    @staticmethod
+    def get_prefix(user, template):
+        return f'otp:{{{user.id}:{template}}}'
+
+    def get_code_key(self, user, template, code):
+        return f'{self.get_prefix(user, template)}:code:{code}'
+
+    def get_consumed_key(self, user, template):
+        return f'{self.get_prefix(user, template)}:consumed'
+
+    def create(self, user, template):
+        email_template = get_template(template)
+        expiry_time = getattr(settings, 'OTP_EXPIRY_TIME', timezone.timedelta(minutes=5))
+
+        client, _, _ = self.get_client()
+        otp_id = secrets.token_hex(8)
+        ghost_code = generate_ghost_code()
+
+        for _ in range(MAX_CODE_ATTEMPTS):
+            code = generate_code()
+            code_key = self.get_code_key(user, template, code)
+            if client.set(code_key, f'{otp_id}:{ghost_code}', nx=True, ex=expiry_time):
+                break
+        else:
+            raise Exception('Could not generate a unique OTP.')
+
+        try:
+            TemplatedEmail.objects.create(
+                template=email_template,
+                email=user.email,
+                template_data={
+                    'otp': code,
+                    'email': user.email,
+                }
+            )
+        except Exception:
+            # The code can not reach the user
+            client.delete(code_key)
+            raise
+
+        # Sent in the background once the email is committed
+        transaction.on_commit(dispatch_emails.delay)
+
+        return otp_id
+
+    def validate(self, code, user, template):
+        _, consume, _ = self.get_client()
+        ghost_code_ttl = getattr(
+            settings, 'OTP_GHOST_CODE_TTL', timezone.timedelta(minutes=10))
+
+        value = consume(
+            keys=[
+                self.get_code_key(user, template, code),
+                self.get_consumed_key(user, template),
+            ],
+            args=[int(ghost_code_ttl.total_seconds())],
+        )
+        if not value:
+            return False, None, None
+
+        otp_id, ghost_code = value.split(':', 1)
+        return True, ghost_code, otp_id
+
+    def complete(self, otp_id, ghost_code, user, template):
+        _, _, complete = self.get_client()
+
+        return bool(complete(
+            keys=[self.get_consumed_key(user, template)],
+            args=[otp_id, ghost_code],
+        ))
@@ -0,0 +1,109 @@
+"""
+Measures the allocation of the OTP codes with many outstanding OTPs, see
+otp/models.py.
+
+The outstanding OTPs are bulk inserted in a transaction which is rolled
+back at the end, run it against a disposable database:
+
+```
+python manage.py benchmark_otp_codes --rows 1000000 --users 200000
+```
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+# Local imports
+from accounts.models import User
+from aws.models import SESEmailTemplate
+from otp.models import CODE_SPACE, OneTimePassword, allocate_code, generate_ghost_code
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the collisions and inserts of the OTP codes at scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Outstanding OTPs inserted before measuring')
+        parser.add_argument('--users', type=int, default=200000)
+        parser.add_argument('--samples', type=int, default=10000,
+                            help='OTPs created through the model and measured')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.benchmark(**options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write('The benchmark rows were rolled back')
+
+    def benchmark(self, rows, users, samples, batch_size, **options):
+        template = SESEmailTemplate.objects.filter(
+            template_identifier='EmailVerificationTemplate').first()
+        if template is None:
+            # Bulk created, the template is not synced to SES
+            template, = SESEmailTemplate.objects.bulk_create([
+                SESEmailTemplate(template_identifier='EmailVerificationTemplate')])
+
+        User.objects.bulk_create(
+            [User(email=f'otp-benchmark-{index}@example.com', password='!')
+             for index in range(users)],
+            batch_size=batch_size,
+        )
+        user_ids = list(User.objects.filter(
+            email__startswith='otp-benchmark-').values_list('id', flat=True))
+
+        # The outstanding codes, per user and across every user as the
+        # global unique index saw them
+        taken = {user_id: set() for user_id in user_ids}
+        every_code = set()
+
+        start = time.perf_counter()
+        for offset in range(0, rows, batch_size):
+            batch = []
+            for index in range(offset, min(offset + batch_size, rows)):
+                user_id = user_ids[index % len(user_ids)]
+                code, _ = allocate_code(taken[user_id])
+                taken[user_id].add(code)
+                every_code.add(code)
+                batch.append(OneTimePassword(
+                    user_id=user_id,
+                    email_template=template,
+                    status='DELIVERED',
+                    code=code,
+                    ghost_code=generate_ghost_code(),
+                ))
+            OneTimePassword.objects.bulk_create(batch)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f'Inserted {rows} outstanding OTPs for {len(user_ids)} users in '
+            f'{elapsed:.1f} s, {rows / elapsed:.0f} rows per second')
+
+        # Created one by one like the mutations do, the status skips the email
+        draws = 0
+        start = time.perf_counter()
+        for index in range(samples):
+            otp = OneTimePassword(
+                user_id=user_ids[index % len(user_ids)],
+                email_template=template,
+                status='DELIVERED',
+            )
+            otp.save()
+            draws += otp.code_draws
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f'Created {samples} OTPs in {elapsed:.1f} s, '
+            f'{samples / elapsed:.0f} per second, '
+            f'{(draws - samples) / samples:.6f} redraws per OTP, no IntegrityError')
+        self.stdout.write(
+            f'With a global unique index a new code would collide with '
+            f'{len(every_code) / CODE_SPACE:.1%} of the draws')
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('otp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='onetimepassword',
+            index=models.Index(fields=['status', 'expires_at'], name='otp_status_expires_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='onetimepassword',
+            index=models.Index(fields=['status', 'created_at'], name='otp_status_created_at_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('otp', '0002_otp_sweeper_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='onetimepassword',
+            name='code',
+            field=models.CharField(default='', max_length=6),
+        ),
+        migrations.AlterField(
+            model_name='onetimepassword',
+            name='ghost_code',
+            field=models.CharField(default='', max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name='onetimepassword',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('status__in', ('IDLE', 'SENT', 'DELIVERED'))),
+                fields=('user', 'email_template', 'code'),
+                name='otp_outstanding_code_uniq',
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.1.4 on 2026-10-19 04:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aws', '0002_email_outbox'),
+        ('otp', '0003_otp_scoped_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='onetimepassword',
+            name='email',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='aws.templatedemail'),
+        ),
+    ]
@@ -1,12 +1,12 @@
 """ App for managing one time passwords. """
 
 # Django import
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Q, Value, When
 from django.utils import timezone
 
 # Native imports
-import random
-import string
+import secrets
 
 
 # Local imports
@@ -23,69 +23,111 @@ OTP_STATUS_CHOICES = (
     ('INVALIDATED', 'Invalidated'),
 )
 
+# Statuses of the OTPs whose code may still be sent or validated, the codes
+# are unique among them for each user and template
+OUTSTANDING_OTP_STATUSES = ('IDLE', 'SENT', 'DELIVERED')
+
+CODE_LENGTH = 6
+CODE_SPACE = 10 ** CODE_LENGTH
+
+
+def generate_code():
+    """
+    Returns a random code of CODE_LENGTH digits.
+    """
+    return f'{secrets.randbelow(CODE_SPACE):0{CODE_LENGTH}d}'
+
+
+def generate_ghost_code():
+    """
+    Returns a random ghost code, long enough to never be guessed nor to
+    collide, it needs no unique index.
+    """
+    return secrets.token_urlsafe(24)
+
+
+def allocate_code(taken):
+    """
+    Draws a code which is not in taken.
+
+    Returns:
+        tuple: The code and the number of draws it took.
+    """
+    if len(taken) >= CODE_SPACE:
+        raise ValueError('Every code is taken.')
+
+    draws = 1
+    code = generate_code()
+    while code in taken:
+        draws += 1
+        code = generate_code()
+
+    return code, draws
+
 
 def validateUserWithOTP(code, user_id, template):
     """
     Validates the OTP by checking if the code matches the latest OTP of the user and is not expired.
-    """
 
-    success = False
-    ghost_code = None
-    otp_obj = None
+    The matched OTP is consumed and the expired ones are marked in a single
+    statement, the cost does not depend on the number of OTPs of the user.
+    The matched row is locked, of two concurrent submits of the same code
+    only one consumes it.
+    """
 
-    try:
+    now = timezone.now()
 
-        # Get all the otp objects which are DELIVERED of the user
-        otps = OneTimePassword.objects.filter(
+    with transaction.atomic():
+        delivered = OneTimePassword.objects.filter(
             user=user_id, status='DELIVERED', email_template=template)
 
-        # Loop through each otp object if they have expired change status to EXPIRED,
-        # if code match with any of the otp object invalidate the rest and update the
-        # status to CONSUMED of the matched otp object.
-        for otp in otps:
-            if otp.expires_at < timezone.now():
-                otp.status = 'EXPIRED'
-            elif otp.code == code:
-                otp.status = 'CONSUMED'
-                ghost_code = otp.ghost_code
-                otp_obj = otp
-                success = True
+        otp_obj = delivered.select_for_update().filter(
+            code=code, expires_at__gte=now).first()
 
-            otp.save()
+        if otp_obj is None:
+            delivered.filter(expires_at__lt=now).update(status='EXPIRED')
+            return False, None, None
 
-    except Exception as e:
-        raise e
+        delivered.filter(Q(pk=otp_obj.pk) | Q(expires_at__lt=now)).update(
+            status=Case(
+                When(pk=otp_obj.pk, then=Value('CONSUMED')),
+                default=Value('EXPIRED'),
+            )
+        )
 
-    return success, ghost_code, otp_obj
+    otp_obj.status = 'CONSUMED'
+    return True, otp_obj.ghost_code, otp_obj
 
 
 def validateActionWithGhostCode(ghost_code, otp):
     """
     Validates the action with the ghost code. And invalidates any otp if 
     the status is consumed.
-    """
 
-    success = False
+    The matched OTP is completed and the other consumed OTPs are invalidated
+    in a single statement, the matched row is locked so it is only
+    completed once.
+    """
 
-    # Get all the otp objects which are CONSUMED of the user
-    otps = OneTimePassword.objects.filter(
-        user=otp.user, status='CONSUMED', email_template=otp.email_template)
+    with transaction.atomic():
+        consumed = OneTimePassword.objects.filter(
+            user=otp.user_id, status='CONSUMED', email_template=otp.email_template_id)
 
-    # Loop through all of the otps and check if the ghost code matches with any of the otps,
-    # if it matches invalidate the rest of the otps.
-    for otp in otps:
-        if otp.ghost_code == ghost_code and success == False:
-            otp.status = 'COMPLETED'
-            success = True
+        completed = consumed.select_for_update().filter(
+            ghost_code=ghost_code).values_list('pk', flat=True).first()
 
-        otp.save()
+        if completed is None:
+            consumed.update(status='INVALIDATED')
+            return False
 
-    for otp in otps:
-        if otp.status != 'COMPLETED':
-            otp.status = 'INVALIDATED'
-            otp.save()
+        consumed.update(
+            status=Case(
+                When(pk=completed, then=Value('COMPLETED')),
+                default=Value('INVALIDATED'),
+            )
+        )
 
-    return success
+    return True
 
 
 class OneTimePassword(models.Model):
@@ -107,6 +149,15 @@ class OneTimePassword(models.Model):
         blank=True
     )
 
+    # The email of the code, written in the outbox when the otp is created
+    email = models.ForeignKey(
+        'aws.TemplatedEmail',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+
     # Status of the otp is updated by subscription and the effective functionality is decided by this field.
     status = models.CharField(
         max_length=25,
@@ -114,19 +165,18 @@ class OneTimePassword(models.Model):
         default='IDLE'
     )
 
-    # This is the code that is sent to the user, it is a 6 digit alphanumeric code.
+    # This is the code that is sent to the user, it is a 6 digit code. It is
+    # unique among the outstanding otps of the user and template only
     code = models.CharField(
         max_length=6,
         default='',
-        unique=True
     )
 
     # This is the ghost coded that is only given to the user, if they successfully consume the otp.
     # It is used to perform an action associated with this otp
     ghost_code = models.CharField(
-        max_length=6,
+        max_length=32,
         default='',
-        unique=True
     )
 
     # Timing flags
@@ -143,18 +193,24 @@ class OneTimePassword(models.Model):
 
     def __generate_otp(self) -> str:
         """
-        Generates a 6 digit random string as the OTP and sets the expiration time
+        Draws a 6 digit code which is not outstanding for the user and
+        template, and sets the expiration time
         """
-        self.code = ''.join([random.choice(string.digits) for n in range(6)])
+        taken = set(OneTimePassword.objects.filter(
+            user=self.user_id,
+            email_template=self.email_template_id,
+            status__in=OUTSTANDING_OTP_STATUSES,
+        ).values_list('code', flat=True))
+
+        self.code, self.code_draws = allocate_code(taken)
         self.expires_at = timezone.now() + self.expiry_time
         return self.code
 
     def __generate_ghost_code(self) -> str:
         """
-        Generates a 6 digit random string as the ghost code
+        Generates a random ghost code
         """
-        self.ghost_code = ''.join(
-            [random.choice(string.digits) for n in range(6)])
+        self.ghost_code = generate_ghost_code()
         return self.ghost_code
 
     def is_valid(self) -> bool:
@@ -192,3 +248,20 @@ class OneTimePassword(models.Model):
         """ Meta class for OTP. """
         verbose_name = 'OTP'
         verbose_name_plural = 'OTPs'
+
+        # A code is only looked up among the outstanding otps of a user and
+        # template, the constraint is enforced on them alone. Two concurrent
+        # allocations of the same code for a user are the only collision
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'email_template', 'code'],
+                condition=models.Q(status__in=OUTSTANDING_OTP_STATUSES),
+                name='otp_outstanding_code_uniq',
+            ),
+        ]
+
+        # Scanned by the sweeper, see otp/tasks.py
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='otp_status_expires_at_idx'),
+            models.Index(fields=['status', 'created_at'], name='otp_status_created_at_idx'),
+        ]
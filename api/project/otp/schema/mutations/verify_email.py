@@ -14,6 +14,7 @@ from graphql import GraphQLError
 
 # Local imports
 from accounts.models import User
+from accounts.tokens import get_tokens_for_user
 from accounts.schema.types import UserType
 from utils.mutations.protected import ProtectedMutation
 from aws.models import SESEmailTemplate
@@ -60,11 +61,14 @@ class ValidateEmail(ProtectedMutation):
             complete: true
         ) {
             message
+            accessToken
+            refreshToken
         }
     }
     ```
 
-    Once the mutation is completed, the user's email will be verified.
+    Once the mutation is completed, the user's email will be verified. The
+    returned tokens replace the previous ones, they carry the verified email.
 
     ## Resend OTP
 
@@ -91,6 +95,9 @@ class ValidateEmail(ProtectedMutation):
 
     EXEMPT_CHECKS = True
 
+    access_token = graphene.String()
+    refresh_token = graphene.String()
+
     class Arguments:
         otp = graphene.String()
         ghost_code = graphene.String()
@@ -104,4 +111,12 @@ class ValidateEmail(ProtectedMutation):
     def complete_mutation(cls, root, info, user, **inputs):
         user.is_email_verified = True
         user.save()
-        return cls(message="email verified sucessfully")
+
+        # The email verification is one of the claims of the tokens
+        access_token, refresh_token = get_tokens_for_user(user)
+
+        return cls(
+            message="email verified sucessfully",
+            access_token=access_token,
+            refresh_token=refresh_token
+        )
@@ -1,15 +1,17 @@
 """ Signals fire when otp model is created. """
 
 # Django import
-from django.utils import timezone
+from django.db import transaction
+from django.db.models import ExpressionWrapper, DateTimeField, F, Value
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.conf import settings
-import boto3
-
+from django.utils import timezone
 
+# Local imports
+from aws.models import TemplatedEmail
+from aws.signals import templated_emails_dispatched
+from aws.tasks import dispatch_emails
 from .models import OneTimePassword
-from aws.models import SESEmailTemplate, TemplatedEmail
 
 
 @receiver(post_save, sender=OneTimePassword)
@@ -17,35 +19,37 @@ def sendOneTimePasswordThroughSES(sender, instance, created, **kwargs):
     """
     OTP delivery is handled by AWS SES. This function tells AWS to send an otp email to the user,
     via registered email address.
+
+    The email is written to the outbox in the transaction of the OTP, which
+    is SENT, and sent by the dispatcher once committed so the request does
+    not wait on SES.
+    """
+    if created and instance.status == 'IDLE':
+        email = TemplatedEmail.objects.create(
+            template=instance.email_template,
+            email=instance.user.email,
+            template_data={
+                'otp': instance.code,
+                'email': instance.user.email,
+            }
+        )
+        OneTimePassword.objects.filter(pk=instance.pk).update(email=email, status='SENT')
+        instance.email, instance.status = email, 'SENT'
+
+        transaction.on_commit(dispatch_emails.delay)
+
+
+@receiver(templated_emails_dispatched)
+def updateOneTimePasswordDelivery(sender, sent, failed, **kwargs):
+    """
+    The OTPs are DELIVERED once SES accepted their email, their expiry starts
+    then. They are FAILED if their email is dead-lettered.
     """
-    if created:
-        # Create the TemplatedEmail object and run the send function
-        if instance.status == 'IDLE':
-            try:
-
-                email = TemplatedEmail.objects.create(
-                    template=instance.email_template,
-                    email=instance.user.email,
-                    template_data={
-                        'otp': instance.code,
-                        'email': instance.user.email,
-                    }
-                )
-
-                instance.status = 'SENT'
-                instance.save()
-            except Exception as e:
-                instance.status = 'FAILED'
-                instance.save()
-                raise Exception(
-                    "Error while creating TemplatedEmail object.")
-            else:
-                try:
-                    email.send()
-                except Exception as e:
-                    instance.status = 'FAILED'
-                    instance.save()
-                else:
-                    instance.status = 'DELIVERED'
-                    instance.expires_at = timezone.now() + instance.expiry_time
-                    instance.save()
+    if sent:
+        OneTimePassword.objects.filter(email__in=sent, status='SENT').update(
+            status='DELIVERED',
+            expires_at=ExpressionWrapper(
+                Value(timezone.now()) + F('expiry_time'), output_field=DateTimeField()),
+        )
+    if failed:
+        OneTimePassword.objects.filter(email__in=failed, status='SENT').update(status='FAILED')
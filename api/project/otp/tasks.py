@@ -0,0 +1,90 @@
+""" Background tasks of the otp app. """
+
+# Django import
+from django.conf import settings
+from django.utils import timezone
+
+# Module imports
+from celery import shared_task
+
+# Local imports
+from .models import OneTimePassword
+
+# Statuses an OTP never leaves, pruned after OTP_RETENTION
+TERMINAL_STATUSES = ('COMPLETED', 'INVALIDATED', 'EXPIRED')
+
+
+def update_in_chunks(queryset, chunk_size, **values):
+    """
+    Updates the rows of the queryset in chunks of primary keys, so every
+    statement only locks a bounded number of rows.
+
+    Returns:
+        int: The number of updated rows.
+    """
+    updated = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return updated
+
+        # The conditions are applied again, a row may have changed since
+        updated += queryset.filter(pk__in=pks).update(**values)
+        if len(pks) < chunk_size:
+            return updated
+
+
+def delete_in_chunks(queryset, chunk_size):
+    """
+    Deletes the rows of the queryset in chunks of primary keys.
+
+    Returns:
+        int: The number of deleted rows.
+    """
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return deleted
+
+        # Nothing cascades from the OTPs, the chunk is a single DELETE
+        deleted += queryset.filter(pk__in=pks).delete()[0]
+        if len(pks) < chunk_size:
+            return deleted
+
+
+@shared_task
+def sweep_otps():
+    """
+    Expires the dead OTPs and prunes the old ones, scheduled by Celery beat.
+
+    - DELIVERED OTPs past their expiry are EXPIRED.
+    - CONSUMED OTPs whose ghost code was not used within OTP_GHOST_CODE_TTL
+      are INVALIDATED.
+    - COMPLETED, INVALIDATED and EXPIRED OTPs older than OTP_RETENTION are
+      deleted.
+    """
+    now = timezone.now()
+    chunk_size = getattr(settings, 'OTP_SWEEP_CHUNK_SIZE', 1000)
+    ghost_code_ttl = getattr(settings, 'OTP_GHOST_CODE_TTL', timezone.timedelta(minutes=10))
+    retention = getattr(settings, 'OTP_RETENTION', timezone.timedelta(days=7))
+
+    expired = update_in_chunks(
+        OneTimePassword.objects.filter(status='DELIVERED', expires_at__lt=now),
+        chunk_size,
+        status='EXPIRED',
+    )
+    invalidated = update_in_chunks(
+        OneTimePassword.objects.filter(
+            status='CONSUMED', expires_at__lt=now - ghost_code_ttl),
+        chunk_size,
+        status='INVALIDATED',
+    )
+    deleted = delete_in_chunks(
+        OneTimePassword.objects.filter(
+            status__in=TERMINAL_STATUSES, created_at__lt=now - retention),
+        chunk_size,
+    )
+
+    return {'expired': expired, 'invalidated': invalidated, 'deleted': deleted}
+
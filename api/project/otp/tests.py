@@ -1,3 +1,367 @@
-from django.test import TestCase
+""" Tests for otp API's """
 
-# Create your tests here.
+# Native imports
+from unittest import mock, skipUnless
+
+# Django imports
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+# Module imports
+import redis
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+# Application imports
+from accounts.models import User, Username
+from aws.models import SESEmailTemplate, TemplatedEmail
+from aws.registry import template_registry, warm_templates
+from aws.tasks import dispatch_emails
+from otp.models import OneTimePassword, validateActionWithGhostCode, validateUserWithOTP
+from otp.backends.redis import RedisOTPStore, get_client
+from otp.tasks import sweep_otps
+from utils.testing import GraphQLTestCase
+
+
+class OtpGraphQLTestCase(GraphQLTestCase):
+    """
+    A user with a username and a token, the email templates and a mocked
+    SES.
+    """
+
+    endpoint = '/otp/'
+
+    def setUp(self):
+        # Bulk created, the templates are not synced to SES nor to the
+        # template registry
+        SESEmailTemplate.objects.bulk_create([
+            SESEmailTemplate(
+                template_identifier=template,
+                template_subject=template,
+                template_text_part=f'{template}.txt',
+                template_html_part=f'{template}.html',
+            )
+            for template in ('EmailVerificationTemplate', 'ForgotPasswordTemplate')
+        ])
+        # Loaded as on startup, the flows run no template query
+        template_registry.invalidate()
+        warm_templates()
+
+        self.user = User.objects.create_email_user(
+            email='budget@gmail.com', password='password123', dob='1990-01-01')
+        Username.objects.create(user=self.user, username='budget')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+        patcher = mock.patch('aws.tasks.get_ses')
+        self.ses = patcher.start().return_value
+        self.ses.send_bulk_templated_email.side_effect = lambda **kwargs: {
+            'Status': [
+                {'Status': 'Success', 'MessageId': f'message-{index}'}
+                for index, _ in enumerate(kwargs['Destinations'])
+            ],
+        }
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('aws.tasks.get_send_limiter')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_otp(self, template, status='DELIVERED'):
+        otp = OneTimePassword.objects.create(
+            user=self.user,
+            email_template=SESEmailTemplate.objects.get(
+                template_identifier=template),
+        )
+        # Delivered as the dispatcher does
+        OneTimePassword.objects.filter(id=otp.id).update(
+            status=status, expires_at=timezone.now() + otp.expiry_time)
+        otp.refresh_from_db()
+        return otp
+
+
+class OtpQueryBudgetTests(OtpGraphQLTestCase):
+    """
+    Query budgets of the otp mutations, one test per step of each flow.
+
+    The OTPs are delivered by the email dispatcher after the commit, the
+    budgets do not count it.
+    """
+
+    def test_validate_email_initiate(self):
+        # Includes the outstanding codes of the user, the new code is drawn
+        # among the others, and the email written to the outbox
+        self.assertQueryBudget(5, """
+            mutation { validateEmail(initiate: true) { message } }
+        """, token=self.token)
+
+    def test_validate_email_validate(self):
+        otp = self.create_otp('EmailVerificationTemplate')
+
+        # The OTP is consumed in a transaction, counted as a savepoint and
+        # its release in the tests
+        self.assertQueryBudget(5, """
+            mutation { validateEmail(validate: true, otp: "%s") { message otp ghostCode } }
+        """ % otp.code, token=self.token)
+
+    def test_validate_email_complete(self):
+        otp = self.create_otp('EmailVerificationTemplate', status='CONSUMED')
+
+        data = self.assertQueryBudget(7, """
+            mutation {
+                validateEmail(complete: true, otp: "%s", ghostCode: "%s") {
+                    message accessToken
+                }
+            }
+        """ % (otp.id, otp.ghost_code), token=self.token)
+
+        # The new token carries the verified email
+        token = AccessToken(data['validateEmail']['accessToken'])
+        self.assertTrue(token['email_verified'])
+
+    def test_forgot_password_initiate(self):
+        self.assertQueryBudget(5, """
+            mutation { forgotPassword(email: "budget@gmail.com", initiate: true) { message } }
+        """)
+
+    def test_forgot_password_validate(self):
+        otp = self.create_otp('ForgotPasswordTemplate')
+
+        self.assertQueryBudget(5, """
+            mutation {
+                forgotPassword(email: "budget@gmail.com", validate: true, otp: "%s") {
+                    message otp ghostCode
+                }
+            }
+        """ % otp.code)
+
+    def test_forgot_password_complete(self):
+        otp = self.create_otp('ForgotPasswordTemplate', status='CONSUMED')
+
+        self.assertQueryBudget(7, """
+            mutation {
+                forgotPassword(email: "budget@gmail.com", complete: true, otp: "%s",
+                               ghostCode: "%s", newPassword: "password456") {
+                    message
+                }
+            }
+        """ % (otp.id, otp.ghost_code))
+
+
+class OtpScopeTests(OtpGraphQLTestCase):
+    """
+    An OTP completes the flow of its own user and template only.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.victim = User.objects.create_email_user(
+            email='victim@gmail.com', password='password123', dob='1990-01-01')
+
+    def test_forgot_password_other_user(self):
+        otp = self.create_otp('ForgotPasswordTemplate', status='CONSUMED')
+
+        result, _ = self.execute("""
+            mutation {
+                forgotPassword(email: "victim@gmail.com", complete: true, otp: "%s",
+                               ghostCode: "%s", newPassword: "password456") {
+                    message
+                }
+            }
+        """ % (otp.id, otp.ghost_code))
+
+        self.assertIn('errors', result)
+        self.victim.refresh_from_db()
+        self.assertTrue(self.victim.check_password('password123'))
+        self.assertEqual(OneTimePassword.objects.get(id=otp.id).status, 'CONSUMED')
+
+    def test_other_template(self):
+        otp = self.create_otp('EmailVerificationTemplate', status='CONSUMED')
+
+        result, _ = self.execute("""
+            mutation {
+                forgotPassword(email: "budget@gmail.com", complete: true, otp: "%s",
+                               ghostCode: "%s", newPassword: "password456") {
+                    message
+                }
+            }
+        """ % (otp.id, otp.ghost_code))
+
+        self.assertIn('errors', result)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('password123'))
+
+
+class OtpTestCase(TestCase):
+    """
+    Creates OTPs of a user in a given state, without sending them.
+    """
+
+    def setUp(self):
+        SESEmailTemplate.objects.bulk_create([
+            SESEmailTemplate(template_identifier='EmailVerificationTemplate')])
+        template_registry.invalidate()
+        self.template = SESEmailTemplate.objects.get()
+        self.user = User.objects.create_email_user(
+            email='validation@gmail.com', password='password123')
+
+    def create_otps(self, count, status='DELIVERED', expired=False):
+        otps = [
+            OneTimePassword.objects.create(user=self.user, email_template=self.template)
+            for _ in range(count)
+        ]
+        expires_at = timezone.now() - timezone.timedelta(minutes=1) if expired \
+            else timezone.now() + timezone.timedelta(minutes=5)
+        OneTimePassword.objects.filter(id__in=[otp.id for otp in otps]).update(
+            status=status, expires_at=expires_at)
+        return otps
+
+
+class OtpValidationTests(OtpTestCase):
+    """
+    The OTPs are validated with a constant number of statements.
+    """
+
+    def test_codes_unique_among_outstanding(self):
+        with mock.patch('otp.models.generate_code', side_effect=['123456', '123456', '654321']):
+            first, = self.create_otps(1)
+            second, = self.create_otps(1)
+
+        self.assertEqual((first.code, second.code), ('123456', '654321'))
+        self.assertEqual(second.code_draws, 2)
+        self.assertNotEqual(first.ghost_code, second.ghost_code)
+
+    def test_validate_marks_expired(self):
+        stale = self.create_otps(5, expired=True)
+        otp, = self.create_otps(1)
+
+        with self.assertNumQueries(4):
+            success, ghost_code, otp_obj = validateUserWithOTP(otp.code, self.user.id, self.template)
+
+        self.assertTrue(success)
+        self.assertEqual(ghost_code, otp.ghost_code)
+        self.assertEqual(OneTimePassword.objects.get(id=otp.id).status, 'CONSUMED')
+        self.assertEqual(
+            OneTimePassword.objects.filter(id__in=[otp.id for otp in stale], status='EXPIRED').count(), 5)
+
+        # The code is consumed, submitting it again fails
+        self.assertFalse(validateUserWithOTP(otp.code, self.user.id, self.template)[0])
+
+    def test_complete_invalidates_others(self):
+        otp, *others = self.create_otps(3, status='CONSUMED')
+
+        with self.assertNumQueries(4):
+            self.assertTrue(validateActionWithGhostCode(otp.ghost_code, otp))
+
+        self.assertEqual(OneTimePassword.objects.get(id=otp.id).status, 'COMPLETED')
+        self.assertEqual(
+            OneTimePassword.objects.filter(status='INVALIDATED').count(), len(others))
+        self.assertFalse(validateActionWithGhostCode(otp.ghost_code, otp))
+
+
+@override_settings(OTP_SWEEP_CHUNK_SIZE=2)
+class OtpSweepTests(OtpTestCase):
+    """
+    The sweeper expires and prunes the OTPs in chunks.
+    """
+
+    def test_sweep(self):
+        expired = self.create_otps(3, expired=True)
+        live = self.create_otps(1)
+        consumed = self.create_otps(2, status='CONSUMED', expired=True)
+        OneTimePassword.objects.filter(id__in=[otp.id for otp in consumed]).update(
+            expires_at=timezone.now() - timezone.timedelta(hours=1))
+        old = self.create_otps(3, status='COMPLETED')
+        OneTimePassword.objects.filter(id__in=[otp.id for otp in old]).update(
+            created_at=timezone.now() - timezone.timedelta(days=30))
+
+        self.assertEqual(sweep_otps(), {'expired': 3, 'invalidated': 2, 'deleted': 3})
+
+        statuses = dict(OneTimePassword.objects.values_list('id', 'status'))
+        self.assertEqual({statuses[otp.id] for otp in expired}, {'EXPIRED'})
+        self.assertEqual({statuses[otp.id] for otp in consumed}, {'INVALIDATED'})
+        self.assertEqual(statuses[live[0].id], 'DELIVERED')
+        self.assertFalse(any(otp.id in statuses for otp in old))
+
+
+def redis_available():
+    try:
+        return get_client(settings.OTP_REDIS_URL)[0].ping()
+    except redis.RedisError:
+        return False
+
+
+@skipUnless(redis_available(), 'Redis is not reachable')
+class RedisOTPStoreTests(OtpTestCase):
+    """
+    The OTPs of the Redis store are consumed and completed once.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.store = RedisOTPStore()
+
+    def test_flow(self):
+        otp_id = self.store.create(self.user, 'EmailVerificationTemplate')
+        code = TemplatedEmail.objects.get().template_data['otp']
+
+        # The template scopes the codes
+        self.assertFalse(self.store.validate(code, self.user, 'ForgotPasswordTemplate')[0])
+
+        success, ghost_code, validated_id = self.store.validate(
+            code, self.user, 'EmailVerificationTemplate')
+        self.assertTrue(success)
+        self.assertEqual(validated_id, otp_id)
+        self.assertFalse(self.store.validate(code, self.user, 'EmailVerificationTemplate')[0])
+
+        self.assertTrue(self.store.complete(otp_id, ghost_code, self.user, 'EmailVerificationTemplate'))
+        self.assertFalse(self.store.complete(otp_id, ghost_code, self.user, 'EmailVerificationTemplate'))
+        self.assertFalse(OneTimePassword.objects.exists())
+
+
+@override_settings(EMAIL_DISPATCH_MAX_ATTEMPTS=3, EMAIL_DISPATCH_BACKOFF=0)
+class OtpDeliveryTests(OtpGraphQLTestCase):
+    """
+    The OTP emails are written to the outbox and sent by the dispatcher on
+    commit, retried then dead-lettered when SES keeps failing.
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        # Run in place of the worker, whatever the broker of the environment
+        patcher = mock.patch.object(dispatch_emails, 'delay', side_effect=dispatch_emails)
+        self.delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def initiate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.execute('mutation { validateEmail(initiate: true) { message } }', token=self.token)
+
+            # Not before the commit
+            self.delay.assert_not_called()
+
+        self.delay.assert_called_once_with()
+        return OneTimePassword.objects.get()
+
+    def test_delivered_after_commit(self):
+        otp = self.initiate()
+
+        self.assertEqual(otp.status, 'DELIVERED')
+        self.assertGreater(otp.expires_at, otp.created_at)
+        self.assertEqual(otp.email.template_data['otp'], otp.code)
+        self.assertEqual(otp.email.status, 'SENT')
+
+    def test_dead_letter(self):
+        self.ses.send_bulk_templated_email.side_effect = Exception('SES is down')
+        otp = self.initiate()
+        self.assertEqual(otp.status, 'SENT')
+        self.assertEqual(otp.email.status, 'PENDING')
+
+        # The retries of the beat schedule
+        dispatch_emails()
+        dispatch_emails()
+
+        otp.refresh_from_db()
+        self.assertEqual(self.ses.send_bulk_templated_email.call_count, 3)
+        self.assertEqual(otp.status, 'FAILED')
+        self.assertEqual(otp.email.status, 'FAILED')
@@ -9,9 +9,13 @@ from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 from django.urls import path
 from consumer.consumer import BaseConsumer
+from utils.clients import startup
 
 django_asgi_app = get_asgi_application()
 
+# Creates the shared clients, closed on exit, see utils/clients.py
+startup()
+
 
 application = ProtocolTypeRouter(
     {
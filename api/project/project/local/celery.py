@@ -1,6 +1,7 @@
 
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
 
 
 configurationKey = os.environ.get('GENIE_CONFIGURATION_KEY')
@@ -15,6 +16,25 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@worker_process_init.connect
+def init_worker_clients(**kwargs):
+    # The clients of the parent process are not shared across the fork
+    from aws.registry import start_templates
+    from utils.clients import init_clients, reset_clients
+    reset_clients()
+    init_clients()
+    start_templates()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_worker_clients(**kwargs):
+    from aws.registry import stop_templates
+    from utils.clients import close_clients
+    stop_templates()
+    close_clients()
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f"Request:{self.request!r}")
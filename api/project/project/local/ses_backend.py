@@ -1,40 +1,95 @@
-import boto3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+
 from django.core.mail.backends.base import BaseEmailBackend
 from django.conf import settings
 
+from aws.quota import get_send_limiter
+from utils.clients import get_ses
+from utils.tracing import trace_external
+
+
+# The result of a message, message_id is None if it failed with error
+SendResult = namedtuple('SendResult', ('message', 'message_id', 'error'))
+
 
 class SESBackend(BaseEmailBackend):
     """
     Sends mail through Amazon SES.
+
+    The messages are sent concurrently by up to SES_SEND_MAX_WORKERS threads,
+    each message takes a token of the send rate of the account first, see
+    aws/quota.py. The result of every message of the last call is kept in
+    `results`:
+
+    ```
+    connection = get_connection()
+    sent = send_mass_mail(messages, connection=connection)
+    failed = [result for result in connection.results if result.error]
+    ```
     """
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.client = boto3.client(
-            'ses',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_SES_REGION
-        )
+        # Shared by the backends of the process, see utils/clients.py
+        self.client = get_ses()
+        self.results = []
 
     def send_messages(self, email_messages):
-        for message in email_messages:
-            self.client.send_email(
-                Destination={
-                    'ToAddresses': message.to,
-                },
-                Message={
-                    'Body': {
-                        'Text': {
-                            'Charset': 'UTF-8',
-                            'Data': message.body,
-                        },
-                    },
-                    'Subject': {
+        """
+        Sends the messages and returns the number of messages sent. The first
+        error is raised once every message was attempted, unless
+        fail_silently is set.
+        """
+        email_messages = list(email_messages)
+        if not email_messages:
+            self.results = []
+            return 0
+
+        limiter = get_send_limiter()
+        max_workers = min(getattr(settings, 'SES_SEND_MAX_WORKERS', 10), len(email_messages))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Each message runs in a copy of the context, for the tracing
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._send_limited, limiter, message)
+                for message in email_messages
+            ]
+            self.results = [future.result() for future in futures]
+
+        errors = [result.error for result in self.results if result.error]
+        if errors and not self.fail_silently:
+            raise errors[0]
+
+        return len(self.results) - len(errors)
+
+    def _send_limited(self, limiter, message):
+        try:
+            limiter.acquire()
+            with trace_external('ses'):
+                response = self._send(message)
+        except Exception as e:
+            return SendResult(message, None, e)
+
+        return SendResult(message, response['MessageId'], None)
+
+    def _send(self, message):
+        return self.client.send_email(
+            Destination={
+                'ToAddresses': message.to,
+            },
+            Message={
+                'Body': {
+                    'Text': {
                         'Charset': 'UTF-8',
-                        'Data': message.subject,
+                        'Data': message.body,
                     },
                 },
-                Source=message.from_email,
-            )
-            
\ No newline at end of file
+                'Subject': {
+                    'Charset': 'UTF-8',
+                    'Data': message.subject,
+                },
+            },
+            Source=message.from_email,
+        )
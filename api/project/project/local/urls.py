@@ -16,11 +16,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
-from accounts.views import accounts_graphql_view
+from accounts.views import accounts_graphql_view, internal_graphql_view, jwks_view
 from otp.views import otp_graphql_view
+from utils.views import graphql_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', accounts_graphql_view),
     path('otp/', otp_graphql_view),
+    path('graphql/', graphql_view),
+    path('internal/accounts/', internal_graphql_view),
+    path('.well-known/jwks.json', jwks_view),
 ]
@@ -0,0 +1,373 @@
+"""
+This module contains the authentication helpers for the project.
+
+Every private mutation needs the user behind the Authorization header. When
+several operations are executed in the same request (batched operations on
+the combined endpoint) the header is the same for all of them, so the token
+is validated once and the result is shared through the request object.
+
+Across requests, the validated tokens and their users are kept in a bounded
+cache keyed by the jti of the token. A cached token is not verified nor its
+user loaded again until it expires, or until the user is saved or deleted
+(see accounts.signals). Other processes only learn about a change when their
+entry expires, entries live at most JWT_CACHE_MAX_TTL seconds for that
+reason. Updates which bypass the signals (QuerySet.update) must call
+invalidate_user themselves.
+
+Internal services verify tokens in batches (see accounts.schema.internal),
+the cached tokens are answered from the same cache and the users of the
+others are loaded with a single query.
+
+With JWT_STATELESS_AUTH on, requests are authenticated from the claims of
+the token alone, the user is a TOKEN_USER_CLASS instance (see
+accounts.tokens) and the database is not queried.
+"""
+
+# Native imports
+import copy
+import hmac
+import threading
+import time
+
+# Django imports
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from cachetools import TLRUCache
+import jwt
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+# The authenticators are stateless, there is no need to build one per call.
+# They are built on first use, one per mode, since they need the app
+# registry to be ready.
+_jwt_authentication = {}
+
+# Attribute used to memoize the authentication result on the request
+REQUEST_AUTH_ATTRIBUTE = '_jwt_authentication_result'
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of the validated tokens and their users.
+
+    Entries expire with their token, or after JWT_CACHE_MAX_TTL seconds.
+    """
+
+    def __init__(self, maxsize, max_ttl):
+        self.max_ttl = max_ttl
+        self.lock = threading.Lock()
+        self.cache = TLRUCache(maxsize=maxsize, ttu=self.ttu, timer=time.time)
+
+        # The jti of the cached tokens of every user, used to invalidate
+        self.user_tokens = {}
+
+    def ttu(self, jti, entry, now):
+        return min(entry['expires_at'], now + self.max_ttl)
+
+    def get(self, jti, raw_token):
+        """
+        Returns a copy of the cached user and the validated token, or None.
+        """
+        with self.lock:
+            entry = self.cache.get(jti)
+
+        # The jti was read without verifying the signature, the cached
+        # entry is only used for the exact same token
+        if entry is None or not hmac.compare_digest(entry['raw_token'], raw_token):
+            return None
+
+        # Every request gets its own copy, mutations update the user
+        return copy.copy(entry['user']), entry['validated_token']
+
+    def set(self, jti, raw_token, user, validated_token):
+        entry = {
+            'raw_token': raw_token,
+            'user': copy.copy(user),
+            'validated_token': validated_token,
+            'expires_at': validated_token['exp'],
+        }
+
+        with self.lock:
+            self.cache[jti] = entry
+
+            # Forget the tokens evicted from the cache
+            tokens = {
+                token for token in self.user_tokens.get(user.pk, ())
+                if token in self.cache
+            }
+            tokens.add(jti)
+            self.user_tokens[user.pk] = tokens
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for jti in self.user_tokens.pop(user_id, ()):
+                self.cache.pop(jti, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.user_tokens.clear()
+
+
+token_cache = TokenCache(
+    maxsize=getattr(settings, 'JWT_CACHE_MAXSIZE', 10000),
+    max_ttl=getattr(settings, 'JWT_CACHE_MAX_TTL', 300),
+)
+
+
+def invalidate_user(user_id):
+    """
+    Drops the cached tokens of the user, they are validated again on their
+    next use.
+    """
+    token_cache.invalidate_user(user_id)
+
+
+def get_token_id(raw_token):
+    """
+    Returns the jti claim of a token, without verifying it.
+    """
+    try:
+        payload = jwt.decode(raw_token, options={'verify_signature': False})
+    except jwt.PyJWTError:
+        return None
+
+    return payload.get(api_settings.JTI_CLAIM)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication which caches the validated tokens and their users.
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        return self.authenticate_token(raw_token)
+
+    def authenticate_token(self, raw_token):
+        """
+        Returns the user and the validated token of a raw token.
+        """
+        jti = get_token_id(raw_token)
+
+        if jti is not None:
+            cached = token_cache.get(jti, raw_token)
+            if cached is not None:
+                return cached
+
+        validated_token = self.get_validated_token(raw_token)
+        user = self.get_user(validated_token)
+
+        if jti is not None:
+            token_cache.set(jti, raw_token, user, validated_token)
+
+        return user, validated_token
+
+    def get_cached(self, raw_token):
+        """
+        Returns the cached user and validated token of a raw token, or None.
+
+        Does not hit the database, it can be called from the event loop.
+        """
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode()
+
+        jti = get_token_id(raw_token)
+        if jti is None:
+            return None
+
+        return token_cache.get(jti, raw_token)
+
+    def authenticate_tokens(self, raw_tokens):
+        """
+        Validates a batch of raw tokens.
+
+        The cached tokens are not validated again, the users of the others
+        are loaded with a single query and cached with their token.
+
+        Returns:
+            list: The user and the validated token of every raw token, or
+                the error it failed with, in the order of the raw tokens.
+        """
+        results = [None] * len(raw_tokens)
+        pending = []
+
+        for index, raw_token in enumerate(raw_tokens):
+            if isinstance(raw_token, str):
+                raw_token = raw_token.encode()
+
+            jti = get_token_id(raw_token)
+            if jti is not None:
+                results[index] = token_cache.get(jti, raw_token)
+                if results[index] is not None:
+                    continue
+
+            try:
+                validated_token = self.get_validated_token(raw_token)
+                user_id = validated_token[api_settings.USER_ID_CLAIM]
+            except InvalidToken as e:
+                results[index] = e
+                continue
+            except KeyError:
+                results[index] = InvalidToken(
+                    _('Token contained no recognizable user identification'))
+                continue
+
+            pending.append((index, jti, raw_token, validated_token, user_id))
+
+        if pending:
+            users = self.user_model.objects.select_related('username').in_bulk(
+                {user_id for *_, user_id in pending},
+                field_name=api_settings.USER_ID_FIELD,
+            )
+
+        for index, jti, raw_token, validated_token, user_id in pending:
+            user = users.get(user_id)
+
+            if user is None:
+                results[index] = AuthenticationFailed(
+                    _('User not found'), code='user_not_found')
+            elif not user.is_active:
+                results[index] = AuthenticationFailed(
+                    _('User is inactive'), code='user_inactive')
+            else:
+                if jti is not None:
+                    token_cache.set(jti, raw_token, user, validated_token)
+                results[index] = (user, validated_token)
+
+        return results
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                _('Token contained no recognizable user identification'))
+
+        # The username is read by the checks of the private mutations, it
+        # is loaded and cached along with the user
+        try:
+            user = self.user_model.objects.select_related('username').get(
+                **{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        return user
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWT authentication which builds the user from the claims of the token.
+    """
+
+    def get_cached(self, raw_token):
+        """
+        Returns the token user and the validated token of a raw token.
+
+        Does not hit the database, it can be called from the event loop.
+        """
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token), validated_token
+
+
+def get_model_user(user):
+    """
+    Returns the user model instance of an authenticated user.
+
+    Token users are replaced by their user, loaded on first use.
+    """
+    if isinstance(user, TokenUser):
+        return user.get_user()
+
+    return user
+
+
+def is_stateless_auth():
+    return getattr(settings, 'JWT_STATELESS_AUTH', False)
+
+
+def get_cached_jwt_authentication():
+    """
+    Returns the process wide cached JWT authenticator, whatever the mode.
+    """
+    if False not in _jwt_authentication:
+        _jwt_authentication[False] = CachedJWTAuthentication()
+
+    return _jwt_authentication[False]
+
+
+def is_internal_service(request):
+    """
+    Checks the service token in the INTERNAL_SERVICE_HEADER header against
+    INTERNAL_SERVICE_TOKENS.
+    """
+    header = getattr(settings, 'INTERNAL_SERVICE_HEADER', 'X-Service-Token')
+    token = request.headers.get(header)
+    if not token:
+        return False
+
+    # Every token is compared, the time does not tell which one matched
+    matched = False
+    for service_token in getattr(settings, 'INTERNAL_SERVICE_TOKENS', ()):
+        matched |= hmac.compare_digest(token.encode(), service_token.encode())
+
+    return matched
+
+
+def get_jwt_authentication():
+    """
+    Returns the process wide JWT authenticator of the configured mode.
+    """
+    stateless = is_stateless_auth()
+
+    if not stateless:
+        return get_cached_jwt_authentication()
+
+    if stateless not in _jwt_authentication:
+        _jwt_authentication[stateless] = StatelessJWTAuthentication()
+
+    return _jwt_authentication[stateless]
+
+
+def authenticate_request(request):
+    """
+    Authenticates the request with the JWT in the Authorization header.
+
+    The result is stored on the request, so every operation executed in the
+    same request context shares the same authentication. Failures are stored
+    as well and raised again for every caller.
+
+    Args:
+        request (HttpRequest): The request to authenticate.
+
+    Returns:
+        tuple: The user and the validated token, or None if no token is set.
+    """
+    result = getattr(request, REQUEST_AUTH_ATTRIBUTE, None)
+
+    if result is None:
+        try:
+            result = (get_jwt_authentication().authenticate(request), None)
+        except Exception as e:
+            result = (None, e)
+
+        setattr(request, REQUEST_AUTH_ATTRIBUTE, result)
+
+    authentication, error = result
+    if error is not None:
+        raise error
+
+    return authentication
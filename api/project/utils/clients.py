@@ -0,0 +1,211 @@
+"""
+Shared clients of the external services, one per process.
+
+Creating a boto3 client takes milliseconds and opens a new connection pool.
+The clients are created lazily on first use and shared by the threads of
+the process:
+
+- `get_ses()` - The SES client
+- `get_s3()` - The S3 client
+- `get_google_session()` - The requests session of the Google endpoints
+- `get_redis(url)` - A Redis client per URL
+
+The boto3 and Redis clients and the requests sessions are thread safe once
+created. The clients are built under a lock from a dedicated boto3 session,
+the default one is not. Their pool sizes and timeouts come from the
+CLIENT_POOL_SIZE, CLIENT_CONNECT_TIMEOUT and CLIENT_READ_TIMEOUT settings.
+
+`init_clients()` creates the clients ahead of the first request and
+`close_clients()` closes their pools. They run on the start and the
+shutdown of the web process, see `startup()`, and of the Celery worker
+processes, see project/local/celery.py.
+"""
+
+# Native imports
+import atexit
+import threading
+
+# Django imports
+from django.conf import settings
+
+# Module imports
+import boto3
+from botocore.config import Config
+from cachecontrol import CacheControlAdapter
+import redis
+import requests
+
+_clients = {}
+_closers = {}
+_lock = threading.RLock()
+_session = None
+
+
+def get_client(key, factory, close=None):
+    """
+    Returns the client of the key, created by the factory on first use.
+
+    Args:
+        key (tuple): The name of the client and the settings it is built from.
+        factory (callable): Creates the client.
+        close (callable): Closes the client passed to it, the close method
+            of the client by default.
+    """
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+                _closers[key] = close or type(client).close
+
+    return client
+
+
+def get_pool_size():
+    return getattr(settings, 'CLIENT_POOL_SIZE', 10)
+
+
+def get_timeouts():
+    """
+    Returns the connect and read timeouts, in seconds.
+    """
+    return (
+        getattr(settings, 'CLIENT_CONNECT_TIMEOUT', 5),
+        getattr(settings, 'CLIENT_READ_TIMEOUT', 10),
+    )
+
+
+def create_boto3_client(service, region):
+    global _session
+
+    connect_timeout, read_timeout = get_timeouts()
+    config = Config(
+        region_name=region,
+        max_pool_connections=get_pool_size(),
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+    )
+
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        return _session.client(service, config=config)
+
+
+def get_ses():
+    region = getattr(settings, 'AWS_SES_REGION', 'ap-south-1')
+    return get_client(('ses', region), lambda: create_boto3_client('ses', region))
+
+
+def get_s3():
+    region = getattr(settings, 'AWS_REGION', 'ap-south-1')
+    return get_client(('s3', region), lambda: create_boto3_client('s3', region))
+
+
+def create_google_session():
+    # CacheControl honors the cache headers, on top of a pooled adapter
+    adapter = CacheControlAdapter(pool_connections=1, pool_maxsize=get_pool_size())
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_google_session():
+    """
+    Returns the session of the Google endpoints, the requests sent with it
+    pass `timeout=get_timeouts()`.
+    """
+    return get_client(('google',), create_google_session)
+
+
+def create_redis(url):
+    connect_timeout, read_timeout = get_timeouts()
+
+    # The callers wait for a free connection instead of failing once the
+    # pool is exhausted
+    pool = redis.BlockingConnectionPool.from_url(
+        url,
+        max_connections=get_pool_size(),
+        timeout=connect_timeout,
+        socket_connect_timeout=connect_timeout,
+        socket_timeout=read_timeout,
+        decode_responses=True,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def get_redis(url):
+    """
+    Returns the Redis client of the URL, its responses are decoded.
+    """
+    return get_client(
+        ('redis', url),
+        lambda: create_redis(url),
+        close=lambda client: client.connection_pool.disconnect(),
+    )
+
+
+def init_clients():
+    """
+    Creates the clients, none of them connects before its first call.
+    """
+    get_ses()
+    get_s3()
+    get_google_session()
+
+
+def close_clients():
+    """
+    Closes the pools of the clients, they are created again on next use.
+    """
+    with _lock:
+        for key, close in _closers.items():
+            close(_clients[key])
+
+        _clients.clear()
+        _closers.clear()
+
+
+def reset_clients():
+    """
+    Drops the clients without closing them, used in the child of a fork
+    where the connections belong to the parent.
+    """
+    global _session
+
+    with _lock:
+        _clients.clear()
+        _closers.clear()
+        _session = None
+
+
+def start_templates():
+    # Imported here, the models of the aws app use the clients
+    from aws.registry import start_templates
+    start_templates()
+
+
+def stop_templates():
+    from aws.registry import stop_templates
+    stop_templates()
+
+
+def startup():
+    """
+    Creates the clients and starts the template registry of the web process,
+    and stops them on exit.
+
+    Called by project/local/asgi.py once the application is loaded, Daphne
+    does not implement the ASGI lifespan protocol.
+    """
+    init_clients()
+    start_templates()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    stop_templates()
+    close_clients()
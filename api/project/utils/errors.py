@@ -146,3 +146,25 @@ class ValidationError(BasicError):
 
         # Initialize the class
         super().__init__(message, status)
+
+
+class ThrottledError(BasicError):
+    """
+    This class is used to raise rate limit errors.
+    """
+
+    def __init__(self, message="Too many requests, try again later.", status=429, retry_after=None):
+        """
+        This method initializes the class.
+
+        Args:
+            message (str): The error message.
+            status (int): The status code.
+            retry_after (int): Seconds until the request is allowed again.
+        """
+
+        # Initialize the class
+        super().__init__(message, status)
+
+        if retry_after is not None:
+            self.extensions['retry_after'] = retry_after
@@ -0,0 +1,159 @@
+"""
+This module contains the executors used by the async GraphQL view.
+
+Under ASGI the async view executes resolvers on the event loop. Resolvers
+written as coroutines run there directly, everything else (the ORM, boto3,
+the google transport) is blocking and is sent to a bounded thread pool so
+the loop is never blocked and independent resolvers can overlap.
+"""
+
+# Native imports
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import inspect
+import threading
+
+# Django imports
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Model
+from django.core.exceptions import FieldDoesNotExist
+
+# Graphene imports
+from graphene.types.resolver import attr_resolver, dict_resolver, dict_or_attr_resolver
+from promise import is_thenable, Promise
+
+
+# Resolvers that only read an attribute of the parent value
+DEFAULT_RESOLVERS = (attr_resolver, dict_resolver, dict_or_attr_resolver)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the process wide thread pool used for sync resolvers.
+
+    The pool is bounded by GRAPHQL_EXECUTOR_MAX_WORKERS, which also bounds
+    the number of database connections opened by the async view.
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(
+                        settings, 'GRAPHQL_EXECUTOR_MAX_WORKERS', 8),
+                    thread_name_prefix='graphql',
+                )
+
+    return _executor
+
+
+def _call_sync(fn, *args, **kwargs):
+    """
+    Runs a sync callable inside a worker thread.
+    """
+    # Worker threads keep their connection between calls, drop it if it
+    # is past CONN_MAX_AGE or unusable
+    close_old_connections()
+
+    result = fn(*args, **kwargs)
+
+    # Resolvers wrapped by the middleware manager return promises, they are
+    # already settled since the resolver itself is sync
+    if is_thenable(result):
+        result = Promise.resolve(result).get()
+
+    return result
+
+
+def run_sync(fn, *args, **kwargs):
+    """
+    Schedules a sync callable on the bounded executor.
+
+    Must be called from the event loop, the context variables of the
+    caller are copied to the worker thread.
+
+    Returns:
+        asyncio.Future: The future of the call.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    return loop.run_in_executor(
+        get_executor(),
+        partial(context.run, _call_sync, fn, *args, **kwargs)
+    )
+
+
+class ExecutorMiddleware:
+    """
+    Graphene middleware which sends blocking resolvers to the executor.
+
+    Coroutine resolvers are left on the event loop. Attribute reads of a
+    model instance stay on the loop as well, unless they would query the
+    database (an unloaded relation or a deferred field).
+    """
+
+    def resolve(self, next, root, info, **args):
+        if self.is_blocking(root, info):
+            return run_sync(next, root, info, **args)
+
+        return next(root, info, **args)
+
+    @staticmethod
+    def is_blocking(root, info):
+        """
+        Returns True if the resolver of the field may block the loop.
+        """
+        resolver = info.parent_type.fields[info.field_name].resolver
+
+        if inspect.iscoroutinefunction(resolver):
+            return False
+
+        # Root fields are queries and mutations, they always hit the ORM
+        if root is None:
+            return True
+
+        # Custom resolvers are assumed to be blocking
+        if getattr(resolver, 'func', None) not in DEFAULT_RESOLVERS:
+            return True
+
+        if not isinstance(root, Model):
+            return False
+
+        attname = resolver.args[0] if resolver.args else info.field_name
+
+        if attname in root.get_deferred_fields():
+            return True
+
+        try:
+            field = root._meta.get_field(attname)
+        except FieldDoesNotExist:
+            return False
+
+        return field.is_relation and not field.is_cached(root)
+
+
+class CoroutineMiddleware:
+    """
+    Graphene middleware which runs coroutine resolvers in the sync views.
+
+    The sync executor can not await a coroutine, the resolver is run to
+    completion with async_to_sync instead. It must be the first middleware
+    so it is the one calling the resolver.
+    """
+
+    def resolve(self, next, root, info, **args):
+        resolver = info.parent_type.fields[info.field_name].resolver
+
+        if inspect.iscoroutinefunction(resolver):
+            return async_to_sync(resolver)(root, info, **args)
+
+        return next(root, info, **args)
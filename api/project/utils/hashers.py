@@ -0,0 +1,28 @@
+"""
+This module contains the password hasher of the project.
+
+The hasher is Django's PBKDF2PasswordHasher with the iterations set by
+PASSWORD_HASHER_ITERATIONS, chosen with the calibrate_password_hasher
+command for the hardware the service runs on. The hashes are the same as
+Django's so the stored passwords keep working, the passwords hashed with
+other iterations are rehashed on the next login.
+
+The hash runs on the thread of the request. hashlib.pbkdf2_hmac releases
+the GIL, and under ASGI the resolvers run on the executor threads of the
+async view (see utils/executors.py), the event loop is not blocked.
+"""
+
+# Django imports
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class CalibratedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 + SHA256 hasher with the iterations of PASSWORD_HASHER_ITERATIONS.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASHER_ITERATIONS', None) \
+            or PBKDF2PasswordHasher.iterations
@@ -0,0 +1,234 @@
+"""
+This module contains the handling of the Idempotency-Key header.
+
+Mobile clients retry the requests which timed out, the mutations with side
+effects (createUser, the OTP initiate flows...) would run twice. A request
+sent with an Idempotency-Key header is executed once, its response is kept
+in the IDEMPOTENCY_CACHE cache, Redis in production, and returned as is to
+the retries:
+
+```
+idempotency:<digest>:lock       - Held while the first request executes
+idempotency:<digest>:response   - The response, kept IDEMPOTENCY_TTL seconds
+```
+
+The digest covers the key, the path and the Authorization header, a key
+only replays the responses of its own client. The body of the request is
+fingerprinted as well, reusing a key for another request is rejected.
+
+A retry which arrives while the first request still executes waits for its
+response, up to IDEMPOTENCY_WAIT seconds, and is answered with a 409 after
+that. Server errors and throttled responses are not stored, they may be
+retried.
+"""
+
+# Native imports
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+
+# Django imports
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# Set on the responses returned to the retries
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+MAX_KEY_LENGTH = 255
+
+POLL_INTERVAL = 0.1
+
+
+def error_response(message, status):
+    """
+    Returns an error response in the format of the GraphQL errors.
+    """
+    content = json.dumps({'errors': [{'message': message, 'extensions': {'status': status}}]})
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+class IdempotentRequest:
+    """
+    The state of a request sent with an Idempotency-Key header.
+    """
+
+    def __init__(self, request, key):
+        self.key = key
+        digest = hashlib.sha256('\n'.join((
+            key,
+            request.path,
+            request.headers.get('Authorization', ''),
+        )).encode()).hexdigest()[:32]
+
+        self.lock_key = f'idempotency:{digest}:lock'
+        self.response_key = f'idempotency:{digest}:response'
+        self.fingerprint = hashlib.sha256(request.body).hexdigest()
+        # Held in the lock, only its owner releases it
+        self.token = uuid.uuid4().hex
+
+        self.cache = caches[getattr(settings, 'IDEMPOTENCY_CACHE', 'default')]
+        self.ttl = getattr(settings, 'IDEMPOTENCY_TTL', 86400)
+        self.lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)
+        self.wait_timeout = getattr(settings, 'IDEMPOTENCY_WAIT', 10)
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Returns the idempotent request, None if the request has no key.
+        """
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if request.method != 'POST' or not key:
+            return None
+
+        return cls(request, key)
+
+    def replay(self, stored):
+        """
+        Returns the stored response, or an error if the key was used for
+        another request.
+        """
+        if stored['fingerprint'] != self.fingerprint:
+            return error_response(
+                'The idempotency key was used for another request.', 422)
+
+        response = HttpResponse(
+            stored['content'], status=stored['status'], content_type=stored['content_type'])
+        for header, value in stored['headers'].items():
+            response[header] = value
+        response[REPLAYED_HEADER] = 'true'
+        return response
+
+    def in_flight(self):
+        response = error_response(
+            'A request with this idempotency key is in progress.', 409)
+        response['Retry-After'] = '1'
+        return response
+
+    def attempt(self):
+        """
+        Looks the response up once, or takes the lock.
+
+        Returns:
+            tuple: Whether the request is settled and its response. The
+                response is None if the request took the lock and must be
+                executed.
+        """
+        if len(self.key) > MAX_KEY_LENGTH:
+            return True, error_response('The idempotency key is invalid.', 400)
+
+        stored = self.cache.get(self.response_key)
+        if stored is not None:
+            return True, self.replay(stored)
+
+        if not self.cache.add(self.lock_key, self.token, timeout=self.lock_timeout):
+            return False, None
+
+        # The first request may have stored its response and released the
+        # lock since the lookup
+        stored = self.cache.get(self.response_key)
+        if stored is not None:
+            self.release()
+            return True, self.replay(stored)
+
+        return True, None
+
+    def store(self, response):
+        """
+        Stores the response for the retries and releases the lock.
+        """
+        try:
+            if response.status_code < 500 and response.status_code != 429:
+                self.cache.set(self.response_key, {
+                    'fingerprint': self.fingerprint,
+                    'status': response.status_code,
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'headers': {
+                        header: response[header]
+                        for header in ('Retry-After',) if response.has_header(header)
+                    },
+                }, timeout=self.ttl)
+        finally:
+            self.release()
+
+    def release(self):
+        """
+        Releases the lock if this request still holds it, once expired it
+        may be held by a retry.
+        """
+        if self.cache.get(self.lock_key) == self.token:
+            self.cache.delete(self.lock_key)
+
+
+def handle(request, get_response):
+    """
+    Executes the request once per idempotency key.
+
+    Args:
+        request (HttpRequest): The request.
+        get_response (callable): Executes the request, returns its response.
+
+    Returns:
+        HttpResponse: The response, or the stored one.
+    """
+    idempotent = IdempotentRequest.from_request(request)
+    if idempotent is None:
+        return get_response()
+
+    deadline = time.monotonic() + idempotent.wait_timeout
+    settled, response = idempotent.attempt()
+    while not settled:
+        if time.monotonic() >= deadline:
+            return idempotent.in_flight()
+        time.sleep(POLL_INTERVAL)
+        settled, response = idempotent.attempt()
+
+    if response is not None:
+        return response
+
+    try:
+        response = get_response()
+    except BaseException:
+        idempotent.release()
+        raise
+
+    idempotent.store(response)
+    return response
+
+
+async def ahandle(request, get_response):
+    """
+    Async version of handle, get_response is a coroutine function.
+    """
+    idempotent = IdempotentRequest.from_request(request)
+    if idempotent is None:
+        return await get_response()
+
+    # The cache is blocking, its calls are sent to a thread
+    attempt = sync_to_async(idempotent.attempt, thread_sensitive=False)
+
+    deadline = time.monotonic() + idempotent.wait_timeout
+    settled, response = await attempt()
+    while not settled:
+        if time.monotonic() >= deadline:
+            return idempotent.in_flight()
+        await asyncio.sleep(POLL_INTERVAL)
+        settled, response = await attempt()
+
+    if response is not None:
+        return response
+
+    try:
+        response = await get_response()
+    except BaseException:
+        await sync_to_async(idempotent.release, thread_sensitive=False)()
+        raise
+
+    await sync_to_async(idempotent.store, thread_sensitive=False)(response)
+    return response
@@ -9,10 +9,10 @@ publicly available. For example, a mutation to delete a user account.
 """
 
 # Django imports
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from graphql import GraphQLError
 
 # Local imports
+from utils.auth import authenticate_request, get_model_user
 from utils.mutations.public import PublicMutation
 from utils.errors import AuthenticationError, ServerError, BadRequestError, AuthorizationError
 
@@ -41,9 +41,10 @@ class PrivateMutation(PublicMutation):
                 raise AuthenticationError(
                     message="Authorization header is required")
 
-            # Get the user from the token
+            # Get the user from the token, the authentication is shared by
+            # every operation executed in the same request
             try:
-                user = JWTAuthentication().authenticate(info.context)[0]
+                user = authenticate_request(info.context)[0]
             except Exception as e:
                 raise AuthenticationError(
                     message="Invalid token")
@@ -66,8 +67,9 @@ class PrivateMutation(PublicMutation):
                 # Raise the exception
                 raise e
 
-        # Perform the mutation
-        return cls.perform_mutation(root, info, user,  **inputs)
+        # Perform the mutation, with stateless authentication the user is
+        # only loaded if the mutation reads it
+        return cls.perform_mutation(root, info, get_model_user(user),  **inputs)
 
     @ classmethod
     def perform_mutation(cls, root, info, user, **inputs):
@@ -50,8 +50,8 @@ from graphene import String, Boolean as Bool
 
 # Local imports
 from utils.mutations.private import PrivateMutation
-from otp.models import OneTimePassword, validateActionWithGhostCode, validateUserWithOTP
-from aws.models import SESEmailTemplate
+from otp.backends import get_otp_store
+from utils.throttling import throttle, get_client_ip
 from utils.errors import BadRequestError, ServerError
 
 
@@ -87,6 +87,11 @@ class ProtectedMutation(PrivateMutation):
         else, error is raised.
         """
 
+        # Every initiation sends an email
+        if inputs.get('initiate'):
+            throttle('otp_user', user.id)
+            throttle('otp_ip', get_client_ip(info.context))
+
         try:
 
             initiate = inputs.get('initiate')
@@ -126,11 +131,7 @@ class ProtectedMutation(PrivateMutation):
             template = getattr(
                 cls, 'template', "EmailVerificationTemplate")
 
-            OneTimePassword.objects.create(
-                user=user,
-                email_template=SESEmailTemplate.objects.get(
-                    template_identifier=template),
-            )
+            get_otp_store().create(user, template)
 
             return cls(message="OTP sent to your email.")
         except Exception as e:
@@ -159,15 +160,13 @@ class ProtectedMutation(PrivateMutation):
             if not otp:
                 raise BadRequestError(message="OTP is required.")
 
-            # Run the validateUserWithOTP method to validate the otp
-            validation, ghost_code, otp_obj = validateUserWithOTP(
-                code=otp, user_id=user.id, template=SESEmailTemplate.objects.get(
-                    template_identifier=template)
-            )
+            # Consume the otp, in exchange for its ghost code
+            validation, ghost_code, otp_id = get_otp_store().validate(
+                code=otp, user=user, template=template)
 
             # If the validation was successful, return the ghost code
             if validation:
-                return cls(message="OTP validated.", ghost_code=ghost_code, otp=str(otp_obj.id))
+                return cls(message="OTP validated.", ghost_code=ghost_code, otp=otp_id)
             else:
                 raise BadRequestError(message="Invalid OTP.")
 
@@ -194,15 +193,11 @@ class ProtectedMutation(PrivateMutation):
                 raise BadRequestError(
                     message="Ghost code and OTP are required.")
 
-            # Get the otp object
-            try:
-                otp_obj = OneTimePassword.objects.get(id=otp)
-            except OneTimePassword.DoesNotExist:
-                raise BadRequestError(message="Invalid OTP.")
+            template = getattr(cls, 'template', "EmailVerificationTemplate")
 
-            # Run the validateActionWithGhostCode method to validate the ghost code
-            validation = validateActionWithGhostCode(
-                ghost_code=ghost_code, otp=otp_obj)
+            # Validate the ghost code of the otp
+            validation = get_otp_store().complete(
+                otp_id=otp, ghost_code=ghost_code, user=user, template=template)
 
             # If the validation was successful, return the response
             if validation:
@@ -54,10 +54,10 @@ from graphene import String, Boolean as Bool
 
 # Local imports
 from utils.mutations.public import PublicMutation
-from otp.models import OneTimePassword, validateActionWithGhostCode, validateUserWithOTP
+from otp.backends import get_otp_store
 from accounts.models import User
+from utils.throttling import throttle, get_client_ip
 from utils.errors import BadRequestError, ServerError
-from aws.models import SESEmailTemplate
 
 
 class PublicProtectedMutation(PublicMutation):
@@ -92,6 +92,12 @@ class PublicProtectedMutation(PublicMutation):
         if not email:
             raise BadRequestError("Invalid request, email is required")
 
+        # Every initiation sends an email, the unknown emails are counted
+        # as well
+        if inputs.get('initiate'):
+            throttle('otp_email', email.lower())
+            throttle('otp_ip', get_client_ip(info.context))
+
         # check if the user exists
         try:
             user = User.objects.get(email=email)
@@ -135,11 +141,7 @@ class PublicProtectedMutation(PublicMutation):
             # use VALIDATION as the default purpose
             template = getattr(cls, 'template', "ForgotPasswordTemplate")
 
-            OneTimePassword.objects.create(
-                user=user,
-                email_template=SESEmailTemplate.objects.get(
-                    template_identifier=template),
-            )
+            get_otp_store().create(user, template)
             return cls(message="OTP sent to your email.")
 
         except Exception as e:
@@ -167,15 +169,13 @@ class PublicProtectedMutation(PublicMutation):
             if not otp:
                 raise BadRequestError("OTP is required to validate.")
 
-            # Run the validateUserWithOTP method to validate the otp
-            validation, ghost_code, otp_obj = validateUserWithOTP(
-                code=otp, user_id=user.id, template=SESEmailTemplate.objects.get(
-                    template_identifier=template)
-            )
+            # Consume the otp, in exchange for its ghost code
+            validation, ghost_code, otp_id = get_otp_store().validate(
+                code=otp, user=user, template=template)
 
             # If the validation was successful, return the ghost code
             if validation:
-                return cls(message="OTP validated.", ghost_code=ghost_code, otp=str(otp_obj.id))
+                return cls(message="OTP validated.", ghost_code=ghost_code, otp=otp_id)
             else:
                 raise BadRequestError("Invalid OTP.")
 
@@ -203,15 +203,11 @@ class PublicProtectedMutation(PublicMutation):
             if not ghost_code and not otp:
                 raise BadRequestError("Ghost code is required to complete.")
 
-            # Get the otp object
-            try:
-                otp_obj = OneTimePassword.objects.get(id=otp)
-            except OneTimePassword.DoesNotExist:
-                raise BadRequestError("Invalid OTP.")
+            template = getattr(cls, 'template', "ForgotPasswordTemplate")
 
-            # Run the validateActionWithGhostCode method to validate the ghost code
-            validation = validateActionWithGhostCode(
-                ghost_code=ghost_code, otp=otp_obj)
+            # Validate the ghost code of the otp
+            validation = get_otp_store().complete(
+                otp_id=otp, ghost_code=ghost_code, user=user, template=template)
 
             # If the validation was successful, return the response
             if validation:
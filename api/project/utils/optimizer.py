@@ -0,0 +1,289 @@
+"""
+This module contains the queryset optimizer for the Django object types.
+
+The optimizer reads the selection set of the field being resolved and
+applies only(), select_related() and prefetch_related() to its queryset, so
+a query fetches the requested columns and relations in as few statements as
+possible instead of loading full rows and resolving relations lazily.
+
+```
+{
+    users {
+        email
+        username { username tag }
+        referral { code }
+    }
+}
+```
+
+is executed as
+
+```
+User.objects.select_related('username')
+    .prefetch_related(Prefetch('referral', Referral.objects.only(
+        'id', 'user', 'code')))
+    .only('id', 'email', 'username', 'username__user',
+          'username__username', 'username__tag')
+```
+
+Fields with a custom resolver can not be mapped to the model, the type
+declares what they read through `optimizer_hints`, otherwise every column
+of the model is loaded:
+
+```
+class UserType(OptimizedDjangoObjectType):
+    optimizer_hints = {
+        'is_applied_username': ('username',),
+    }
+```
+"""
+
+# Django imports
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+
+# Graphene imports
+from graphene.types.resolver import attr_resolver, dict_resolver, dict_or_attr_resolver
+from graphene.utils.str_converters import to_camel_case
+from graphene_django import DjangoObjectType, DjangoListField
+from graphql.language.ast import Field as FieldNode, FragmentSpread, InlineFragment
+
+
+# Resolvers that only read an attribute of the parent value
+DEFAULT_RESOLVERS = (attr_resolver, dict_resolver, dict_or_attr_resolver)
+
+
+def get_named_type(graphql_type):
+    while hasattr(graphql_type, 'of_type'):
+        graphql_type = graphql_type.of_type
+    return graphql_type
+
+
+def get_field_nodes(selection_sets, fragments):
+    """
+    Returns the fields of the selection sets, with the fragments expanded.
+    """
+    for selection_set in selection_sets:
+        if selection_set is None:
+            continue
+
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection
+            elif isinstance(selection, FragmentSpread):
+                fragment = fragments[selection.name.value]
+                yield from get_field_nodes([fragment.selection_set], fragments)
+            elif isinstance(selection, InlineFragment):
+                yield from get_field_nodes([selection.selection_set], fragments)
+
+
+def get_default_attname(resolver):
+    """
+    Returns the attribute read by a default resolver, None for a custom one.
+
+    The related lists are resolved by DjangoListField, which wraps the
+    default resolver of the field.
+    """
+    if getattr(resolver, 'func', None) == DjangoListField.list_resolver:
+        resolver = resolver.args[1]
+
+    if getattr(resolver, 'func', None) not in DEFAULT_RESOLVERS:
+        return None
+
+    return resolver.args[0] if resolver.args else None
+
+
+def get_field_names(graphene_type):
+    """
+    Returns the mapping of the GraphQL field names to the attribute names of
+    a graphene type.
+    """
+    return {
+        getattr(field, 'name', None) or to_camel_case(name): name
+        for name, field in graphene_type._meta.fields.items()
+    }
+
+
+def get_model_field(model, name):
+    """
+    Returns the model field with the name, reverse relations are looked up
+    by their accessor name as well.
+    """
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        pass
+
+    for related_object in model._meta.related_objects:
+        if related_object.get_accessor_name() == name:
+            return related_object
+
+    return None
+
+
+class QueryOptimizer:
+    """
+    Builds the optimized queryset of a single resolved field.
+    """
+
+    def __init__(self, info):
+        self.info = info
+
+    def optimize(self, queryset, graphql_type, selection_sets, required=()):
+        """
+        Applies the selection sets of a field to its queryset.
+
+        Args:
+            required (tuple): Columns loaded even if they are not selected.
+        """
+        only = {queryset.model._meta.pk.name, *required}
+        select_related, prefetch_related = set(), []
+
+        complete = self.collect(
+            graphql_type, selection_sets, '', only, select_related, prefetch_related)
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if complete:
+            queryset = queryset.only(*only)
+
+        return queryset
+
+    def collect(self, graphql_type, selection_sets, prefix, only, select_related, prefetch_related):
+        """
+        Collects the lookups needed by the selection of a model type.
+
+        Returns:
+            bool: False if a column read by the selection could not be
+                determined, only() must not be applied then.
+        """
+        graphql_type = get_named_type(graphql_type)
+        graphene_type = getattr(graphql_type, 'graphene_type', None)
+
+        if graphene_type is None or not issubclass(graphene_type, DjangoObjectType):
+            return False
+
+        model = graphene_type._meta.model
+        field_names = get_field_names(graphene_type)
+        hints = getattr(graphene_type, 'optimizer_hints', {})
+        complete = True
+
+        # The same field may be selected more than once, with aliases or
+        # through fragments, the selections are merged
+        selected = {}
+        for field_node in get_field_nodes(selection_sets, self.info.fragments):
+            selected.setdefault(field_node.name.value, []).append(
+                field_node.selection_set)
+
+        for graphql_name, field_selection_sets in selected.items():
+            name = field_names.get(graphql_name)
+            graphql_field = graphql_type.fields.get(graphql_name)
+            if name is None or graphql_field is None:
+                continue
+
+            # DjangoObjectType resolves the id from the primary key, which
+            # is always loaded
+            if name == 'id':
+                continue
+
+            if name in hints:
+                # The hinted model fields are loaded without a selection
+                for hint in hints[name]:
+                    complete &= self.collect_field(
+                        model, hint, None, [], prefix,
+                        only, select_related, prefetch_related)
+                continue
+
+            attname = get_default_attname(graphql_field.resolver)
+            if attname is None:
+                complete = False
+                continue
+
+            complete &= self.collect_field(
+                model, attname, graphql_field.type, field_selection_sets,
+                prefix, only, select_related, prefetch_related)
+
+        return complete
+
+    def collect_field(self, model, name, graphql_type, selection_sets, prefix,
+                      only, select_related, prefetch_related):
+        field = get_model_field(model, name)
+        if field is None:
+            # Properties and methods of the model
+            return False
+
+        path = prefix + name
+
+        if not field.is_relation:
+            only.add(path)
+            return True
+
+        # Foreign keys and one to one relations, in both directions
+        if field.many_to_one or field.one_to_one:
+            select_related.add(path)
+            only.add(path)
+
+            if graphql_type is None:
+                # Hinted relations are loaded with every column
+                return True
+
+            if not field.concrete:
+                # The reverse side needs the column pointing back
+                only.add(f'{path}__{field.field.name}')
+
+            return self.collect(
+                graphql_type, selection_sets, f'{path}__',
+                only, select_related, prefetch_related)
+
+        # Reverse foreign keys and many to many relations
+        queryset = field.related_model._default_manager.all()
+        if graphql_type is not None:
+            # The prefetch joins on the column pointing back
+            required = (field.field.name,) if field.one_to_many else ()
+            queryset = self.optimize(
+                queryset, graphql_type, selection_sets, required)
+
+        prefetch_related.append(Prefetch(path, queryset=queryset))
+        return True
+
+
+def optimize_queryset(queryset, info):
+    """
+    Optimizes the queryset resolved by a field for the selection of the
+    field.
+
+    Args:
+        queryset (QuerySet): The queryset of the model of the field type.
+        info (ResolveInfo): The resolve info of the field.
+
+    Returns:
+        QuerySet: The optimized queryset.
+    """
+    # Prefetched querysets are already loaded
+    if queryset._result_cache is not None:
+        return queryset
+
+    selection_sets = [field_node.selection_set for field_node in info.field_asts]
+
+    return QueryOptimizer(info).optimize(queryset, info.return_type, selection_sets)
+
+
+class OptimizedDjangoObjectType(DjangoObjectType):
+    """
+    Django object type which optimizes the querysets it is resolved from.
+
+    The querysets resolved by DjangoListField and the relations of the
+    type go through get_queryset, the root querysets resolved by a custom
+    resolver should be passed to it as well.
+    """
+    class Meta:
+        abstract = True
+
+    # Model fields read by the custom resolvers of the type
+    optimizer_hints = {}
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
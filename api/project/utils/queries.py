@@ -0,0 +1,154 @@
+"""
+This module attributes SQL statements to the GraphQL operation running them.
+
+Every statement executed while an operation is running is counted against
+that operation and, when GRAPHQL_SQL_COMMENTS is enabled, tagged with a
+trailing comment so it can be found in the database logs and in
+pg_stat_statements:
+
+```
+SELECT ... FROM "accounts_user" WHERE ... /* graphql='createUser' */
+```
+
+The operation is looked up through a context variable, so the statements
+run by resolvers in the executor threads of the async view are attributed
+as well. The counts are also what the query budget tests assert on, see
+utils.testing.
+"""
+
+# Native imports
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+
+# Django imports
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# The operation being executed in the current context
+current_operation = ContextVar('current_operation', default=None)
+
+# Callbacks notified with every finished operation
+_listeners = []
+
+
+class OperationQueries:
+    """
+    The SQL statements executed by a single GraphQL operation.
+    """
+
+    def __init__(self, operation_name=None):
+        self.operation_name = operation_name
+        self.root_fields = []
+        self.queries = []
+        self.lock = threading.Lock()
+
+    @property
+    def name(self):
+        """
+        The operation name, anonymous operations are named after their
+        root fields.
+        """
+        return self.operation_name or ','.join(self.root_fields) or 'anonymous'
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def add_root_field(self, field_name):
+        with self.lock:
+            if field_name not in self.root_fields:
+                self.root_fields.append(field_name)
+
+    def add_query(self, sql):
+        with self.lock:
+            self.queries.append(sql)
+
+
+def attribute_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper which counts and tags the statement.
+    """
+    operation = current_operation.get()
+    if operation is None:
+        return execute(sql, params, many, context)
+
+    if getattr(settings, 'GRAPHQL_SQL_COMMENTS', True):
+        sql = f"{sql} /* graphql='{operation.name}' */"
+
+    operation.add_query(sql)
+    return execute(sql, params, many, context)
+
+
+def install_query_attribution(connection):
+    if attribute_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(attribute_query)
+
+
+@receiver(connection_created)
+def on_connection_created(sender, connection, **kwargs):
+    # Every thread opens its own connection, the executor threads included
+    install_query_attribution(connection)
+
+
+@contextmanager
+def operation_queries(operation_name=None):
+    """
+    Attributes the statements executed inside the block to an operation.
+
+    ```
+    with operation_queries('createUser') as operation:
+        ...
+    operation.count
+    ```
+    """
+    # The connection of this thread may be open already
+    for connection in connections.all():
+        install_query_attribution(connection)
+
+    operation = OperationQueries(operation_name)
+    token = current_operation.set(operation)
+    try:
+        yield operation
+    finally:
+        current_operation.reset(token)
+        for listener in list(_listeners):
+            listener(operation)
+
+
+@contextmanager
+def capture_operations():
+    """
+    Collects every operation finished inside the block.
+
+    ```
+    with capture_operations() as operations:
+        client.post('/graphql/', ...)
+    operations[0].count
+    ```
+    """
+    operations = []
+    _listeners.append(operations.append)
+    try:
+        yield operations
+    finally:
+        _listeners.remove(operations.append)
+
+
+class QueryAttributionMiddleware:
+    """
+    Graphene middleware which names anonymous operations after their root
+    fields, before the root resolvers run any statement.
+    """
+
+    def resolve(self, next, root, info, **args):
+        operation = current_operation.get()
+
+        if operation is not None and len(info.path) == 1:
+            if operation.operation_name is None and info.operation.name:
+                operation.operation_name = info.operation.name.value
+            operation.add_root_field(info.field_name)
+
+        return next(root, info, **args)
@@ -0,0 +1,34 @@
+"""
+Schema for the combined endpoint
+
+The accounts and otp schemas are stitched together so a client can run a
+whole flow (for example createUser, validateEmail and verifyToken) against
+a single endpoint, and in a single request when the operations are batched.
+"""
+
+# Graphene imports
+import graphene
+
+# Schema imports
+from accounts.schema.schema import Query as AccountsQuery, Mutation as AccountsMutation
+from otp.schema.schema import Query as OtpQuery, Mutation as OtpMutation
+
+
+class Query(AccountsQuery, OtpQuery, graphene.ObjectType):
+    """
+    All the queries of the accounts and otp apps.
+    """
+    pass
+
+
+class Mutation(AccountsMutation, OtpMutation, graphene.ObjectType):
+    """
+    All the mutations of the accounts and otp apps.
+    """
+    pass
+
+
+schema = graphene.Schema(
+    query=Query,
+    mutation=Mutation,
+)
@@ -0,0 +1,85 @@
+"""
+This module contains the test helpers for the GraphQL endpoints.
+
+Query budgets pin the number of SQL statements an operation may execute, so
+a change which quietly adds queries to a mutation fails the tests:
+
+```
+class CreateUserBudgetTests(GraphQLTestCase):
+    endpoint = '/accounts/'
+
+    def test_create_user(self):
+        self.assertQueryBudget(4, '''
+            mutation { createUser(...) { message } }
+        ''')
+```
+
+The statements are counted per operation by utils.queries, the same
+attribution used to tag the statements in production.
+"""
+
+# Native imports
+import json
+
+# Django imports
+from django.test import TestCase
+
+# Local imports
+from utils.queries import capture_operations
+
+
+class GraphQLTestCase(TestCase):
+    """
+    Base test case for the GraphQL endpoints.
+
+    The sync endpoints are used, the async view runs the resolvers in its
+    executor threads which do not share the transaction of the test.
+    """
+
+    endpoint = '/accounts/'
+
+    def execute(self, query, variables=None, token=None):
+        """
+        Executes a single operation against the endpoint.
+
+        Returns:
+            tuple: The decoded response and the SQL statements of the operation.
+        """
+        headers = {}
+        if token is not None:
+            headers['HTTP_AUTHORIZATION'] = f'JWT {token}'
+
+        with capture_operations() as operations:
+            response = self.client.post(
+                self.endpoint,
+                json.dumps({'query': query, 'variables': variables or {}}),
+                content_type='application/json',
+                **headers
+            )
+
+        self.assertEqual(len(operations), 1)
+        return json.loads(response.content), operations[0]
+
+    def assertQueryBudget(self, budget, query, variables=None, token=None):
+        """
+        Executes the operation and fails if it executed more statements than
+        the budget, or if it returned errors.
+
+        Returns:
+            dict: The data of the response.
+        """
+        result, operation = self.execute(query, variables, token)
+
+        self.assertNotIn('errors', result, result.get('errors'))
+        self.assertLessEqual(
+            operation.count,
+            budget,
+            '{} executed {} queries, the budget is {}:\n{}'.format(
+                operation.name,
+                operation.count,
+                budget,
+                '\n'.join(operation.queries),
+            )
+        )
+
+        return result['data']
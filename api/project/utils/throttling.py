@@ -0,0 +1,212 @@
+"""
+This module contains the rate limiting of the expensive mutations.
+
+Each scope of THROTTLE_RATES limits the calls of one identity (an IP, an
+email or a user) with a sliding window kept in the cache, Redis in
+production, so the limit is shared by every worker:
+
+```
+THROTTLE_RATES = {
+    'login_ip': '20/m',
+    'login_identifier': '5/m',
+}
+
+throttle('login_ip', get_client_ip(info.context))
+```
+
+The window is estimated from the counters of the current and the previous
+fixed windows, weighted by the elapsed part of the current one. Rejected
+calls are counted as well, a client retrying in a loop stays throttled.
+
+Every process also keeps a token bucket per identity with the same rate.
+The calls of a process are a subset of all the calls, an empty local
+bucket means the shared limit is exceeded too and the call is rejected
+without a round trip to the cache. Bursts from a single client, such as
+credential stuffing, mostly end there.
+
+Throttled calls raise ThrottledError, returned as a 429 with the seconds
+to wait in the `retry_after` extension.
+"""
+
+# Native imports
+import hashlib
+import math
+import threading
+import time
+
+# Django imports
+from django.conf import settings
+from django.core.cache import caches
+
+# Module imports
+from cachetools import TTLCache
+
+# Local imports
+from utils.errors import ThrottledError
+
+PERIODS = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+}
+
+
+def parse_rate(rate):
+    """
+    Parses a rate such as '5/m' or '100/h'.
+
+    Returns:
+        tuple: The number of calls and the window in seconds.
+    """
+    calls, period = rate.split('/')
+    return int(calls), PERIODS[period[0].lower()]
+
+
+def get_client_ip(request):
+    """
+    Returns the IP of the client, the first X-Forwarded-For address is only
+    trusted behind a proxy which sets it.
+    """
+    if getattr(settings, 'THROTTLE_TRUST_FORWARDED_FOR', False):
+        forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if forwarded_for:
+            return forwarded_for.split(',')[0].strip()
+
+    return request.META.get('REMOTE_ADDR', '')
+
+
+class TokenBucket:
+    """
+    In-process token bucket, refilled at the rate of the scope.
+    """
+
+    def __init__(self, calls, window):
+        self.capacity = calls
+        self.rate = calls / window
+        self.tokens = calls
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        """
+        Returns:
+            float: 0 if a token was taken, else the seconds until the next
+                token.
+        """
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+class Throttle:
+    """
+    Sliding window limit of a scope, fronted by the token buckets.
+    """
+
+    def __init__(self, scope, rate, cache_alias='default', max_buckets=10000):
+        self.scope = scope
+        self.calls, self.window = parse_rate(rate)
+        self.cache_alias = cache_alias
+        self.buckets = TTLCache(maxsize=max_buckets, ttl=self.window)
+        self.lock = threading.Lock()
+
+    def get_key(self, ident, index):
+        # The identities may be emails, they are not stored in clear
+        digest = hashlib.sha256(str(ident).encode()).hexdigest()[:32]
+        return f'throttle:{self.scope}:{digest}:{index}'
+
+    def take_local(self, ident):
+        with self.lock:
+            bucket = self.buckets.get(ident)
+            if bucket is None:
+                bucket = self.buckets[ident] = TokenBucket(self.calls, self.window)
+            return bucket.take()
+
+    def hit(self, ident):
+        """
+        Counts a call of the identity.
+
+        Returns:
+            int: 0 if the call is allowed, else the seconds to wait.
+        """
+        wait = self.take_local(ident)
+        if wait:
+            return math.ceil(wait)
+
+        cache = caches[self.cache_alias]
+        now = time.time()
+        index, elapsed = divmod(now, self.window)
+        key = self.get_key(ident, int(index))
+
+        # The counter lives for two windows, it is the previous window of
+        # the next one
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            if cache.add(key, 1, timeout=2 * self.window):
+                count = 1
+            else:
+                count = cache.incr(key)
+
+        previous = cache.get(self.get_key(ident, int(index) - 1), 0)
+        weight = 1 - elapsed / self.window
+        excess = previous * weight + count - self.calls
+        if excess <= 0:
+            return 0
+
+        # The calls of the previous window slide out over the current one,
+        # at the latest the window ends
+        wait = self.window - elapsed
+        if previous:
+            wait = min(wait, excess / previous * self.window)
+
+        return max(math.ceil(wait), 1)
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def get_throttle(scope):
+    """
+    Returns the throttle of the scope, None if the scope has no rate.
+    """
+    rate = getattr(settings, 'THROTTLE_RATES', {}).get(scope)
+    if rate is None:
+        return None
+
+    cache_alias = getattr(settings, 'THROTTLE_CACHE', 'default')
+    key = (scope, rate, cache_alias)
+
+    limiter = _throttles.get(key)
+    if limiter is None:
+        with _throttles_lock:
+            limiter = _throttles.setdefault(key, Throttle(scope, rate, cache_alias))
+
+    return limiter
+
+
+def throttle(scope, ident):
+    """
+    Counts a call of the identity against the rate of the scope.
+
+    Raises:
+        ThrottledError: If the identity exceeded the rate.
+    """
+    if not getattr(settings, 'THROTTLE_ENABLED', True) or not ident:
+        return
+
+    limiter = get_throttle(scope)
+    if limiter is None:
+        return
+
+    wait = limiter.hit(ident)
+    if wait:
+        raise ThrottledError(retry_after=wait)
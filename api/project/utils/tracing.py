@@ -0,0 +1,378 @@
+"""
+This module contains the opt-in tracing of GraphQL operations.
+
+When GRAPHQL_TRACING is enabled every operation executed by the GraphQL views
+is traced. The trace records, for every resolved field, when it started and
+how long it took, the SQL statements it ran and the time spent calling
+external services (SES, Google).
+
+Debug requests, which send the `X-GraphQL-Trace: 1` header and are either
+made by a staff user or served with DEBUG on, get the trace in the response
+in the Apollo tracing format:
+
+```
+{
+    "data": {...},
+    "extensions": {
+        "tracing": {
+            "version": 1,
+            "startTime": "...",
+            "endTime": "...",
+            "duration": <ns>,
+            "execution": {
+                "resolvers": [
+                    {
+                        "path": ["createUser"],
+                        "parentType": "Mutation",
+                        "fieldName": "createUser",
+                        "returnType": "CreateUser",
+                        "startOffset": <ns>,
+                        "duration": <ns>,
+                        "sql": {"count": 4, "duration": <ns>},
+                        "external": {}
+                    }
+                ]
+            },
+            "external": {"ses": {"count": 1, "duration": <ns>}}
+        }
+    }
+}
+```
+
+Every other trace is aggregated per operation into the process metrics,
+which are flushed to the logs every GRAPHQL_TRACING_FLUSH_INTERVAL seconds.
+"""
+
+# Native imports
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import logging
+import threading
+import time
+
+# Django imports
+from django.conf import settings
+from django.db import connection
+
+# Graphene imports
+from promise import is_thenable, Promise
+
+# Local imports
+from utils.auth import authenticate_request
+
+logger = logging.getLogger(__name__)
+
+# The trace of the operation being executed and the resolver being traced
+current_trace = ContextVar('current_trace', default=None)
+current_resolver = ContextVar('current_resolver', default=None)
+
+# Header which asks for the trace in the response
+TRACE_HEADER = 'X-GraphQL-Trace'
+
+# Attribute used to hand the trace over to the response encoder
+REQUEST_TRACE_ATTRIBUTE = '_graphql_trace'
+
+
+def is_tracing_enabled():
+    return getattr(settings, 'GRAPHQL_TRACING', False)
+
+
+def is_debug_request(request):
+    """
+    Returns True if the trace should be returned with the response.
+
+    Hits the database to load the user, call it from a sync context.
+    """
+    if request.headers.get(TRACE_HEADER) != '1':
+        return False
+
+    if settings.DEBUG:
+        return True
+
+    try:
+        authentication = authenticate_request(request)
+    except Exception:
+        return False
+
+    return authentication is not None and authentication[0].is_staff
+
+
+class Trace:
+    """
+    The trace of a single GraphQL operation.
+    """
+
+    def __init__(self, operation_name=None, debug=False):
+        self.operation_name = operation_name
+        self.debug = debug
+        self.start_time = datetime.now(timezone.utc)
+        self.end_time = None
+        self.start = time.perf_counter_ns()
+        self.duration = None
+        self.resolvers = []
+        self.external = {}
+        self.lock = threading.Lock()
+
+    def offset(self):
+        return time.perf_counter_ns() - self.start
+
+    def add_resolver(self, resolver):
+        with self.lock:
+            self.resolvers.append(resolver)
+
+    def add_external(self, service, duration):
+        with self.lock:
+            record = self.external.setdefault(
+                service, {'count': 0, 'duration': 0})
+            record['count'] += 1
+            record['duration'] += duration
+
+    def finish(self):
+        self.end_time = datetime.now(timezone.utc)
+        self.duration = self.offset()
+
+        # Fall back to the root fields to name anonymous operations
+        if self.operation_name is None:
+            self.operation_name = ','.join(
+                resolver['fieldName'] for resolver in self.resolvers
+                if len(resolver['path']) == 1
+            ) or None
+
+    @property
+    def sql(self):
+        return {
+            'count': sum(r['sql']['count'] for r in self.resolvers),
+            'duration': sum(r['sql']['duration'] for r in self.resolvers),
+        }
+
+    def to_apollo(self):
+        """
+        Returns the trace in the Apollo tracing format.
+        """
+        return {
+            'version': 1,
+            'startTime': self.start_time.isoformat(),
+            'endTime': self.end_time.isoformat(),
+            'duration': self.duration,
+            'execution': {
+                'resolvers': self.resolvers,
+            },
+            'external': self.external,
+        }
+
+
+class OperationMetrics:
+    """
+    Aggregates the traces of the operations executed by this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.last_flush = time.monotonic()
+
+    def record(self, trace):
+        with self.lock:
+            operation = self.operations.setdefault(trace.operation_name or 'anonymous', {
+                'count': 0,
+                'duration': 0,
+                'max_duration': 0,
+                'sql_count': 0,
+                'sql_duration': 0,
+                'external': {},
+                'fields': {},
+            })
+
+            operation['count'] += 1
+            operation['duration'] += trace.duration
+            operation['max_duration'] = max(
+                operation['max_duration'], trace.duration)
+
+            sql = trace.sql
+            operation['sql_count'] += sql['count']
+            operation['sql_duration'] += sql['duration']
+
+            for service, record in trace.external.items():
+                external = operation['external'].setdefault(
+                    service, {'count': 0, 'duration': 0})
+                external['count'] += record['count']
+                external['duration'] += record['duration']
+
+            for resolver in trace.resolvers:
+                key = f"{resolver['parentType']}.{resolver['fieldName']}"
+                field = operation['fields'].setdefault(key, {
+                    'count': 0,
+                    'duration': 0,
+                    'sql_count': 0,
+                    'sql_duration': 0,
+                })
+                field['count'] += 1
+                field['duration'] += resolver['duration']
+                field['sql_count'] += resolver['sql']['count']
+                field['sql_duration'] += resolver['sql']['duration']
+
+        interval = getattr(settings, 'GRAPHQL_TRACING_FLUSH_INTERVAL', 60)
+        if time.monotonic() - self.last_flush >= interval:
+            self.flush()
+
+    def snapshot(self, reset=False):
+        """
+        Returns a copy of the aggregated metrics.
+        """
+        with self.lock:
+            operations = {
+                name: dict(operation, fields=dict(operation['fields']))
+                for name, operation in self.operations.items()
+            }
+            if reset:
+                self.operations = {}
+                self.last_flush = time.monotonic()
+
+        return operations
+
+    def flush(self):
+        """
+        Writes the aggregated metrics to the logs and resets them.
+        """
+        for name, operation in self.snapshot(reset=True).items():
+            logger.info(
+                'GraphQL operation metrics',
+                extra={
+                    'service': 'core',
+                    'operation': name,
+                    'metrics': operation,
+                },
+            )
+
+
+metrics = OperationMetrics()
+
+
+def start_trace(operation_name=None, debug=False):
+    """
+    Starts tracing the operation executed in the current context.
+
+    Returns:
+        tuple: The trace and the context token, (None, None) if disabled.
+    """
+    if not is_tracing_enabled():
+        return None, None
+
+    trace = Trace(operation_name=operation_name, debug=debug)
+    return trace, current_trace.set(trace)
+
+
+def finish_trace(request, trace, token):
+    """
+    Finishes the trace, debug traces are handed over to the response and
+    the rest are aggregated into the metrics.
+    """
+    if trace is None:
+        return
+
+    current_trace.reset(token)
+    trace.finish()
+
+    if trace.debug:
+        setattr(request, REQUEST_TRACE_ATTRIBUTE, trace)
+    else:
+        metrics.record(trace)
+
+
+def pop_trace(request):
+    """
+    Returns the debug trace of the last operation of the request, if any.
+    """
+    trace = getattr(request, REQUEST_TRACE_ATTRIBUTE, None)
+    if trace is not None:
+        delattr(request, REQUEST_TRACE_ATTRIBUTE)
+    return trace
+
+
+@contextmanager
+def trace_external(service):
+    """
+    Records the time spent calling an external service.
+
+    ```
+    with trace_external('ses'):
+        ses.send_templated_email(...)
+    ```
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter_ns() - start
+        trace.add_external(service, duration)
+
+        resolver = current_resolver.get()
+        if resolver is not None:
+            external = resolver['external'].setdefault(
+                service, {'count': 0, 'duration': 0})
+            external['count'] += 1
+            external['duration'] += duration
+
+
+class TracingMiddleware:
+    """
+    Graphene middleware which records every resolved field in the trace.
+
+    The SQL statements are counted on the connection of the thread running
+    the resolver, so the middleware must run next to the resolver.
+    """
+
+    def resolve(self, next, root, info, **args):
+        trace = current_trace.get()
+        if trace is None:
+            return next(root, info, **args)
+
+        resolver = {
+            'path': list(info.path),
+            'parentType': str(info.parent_type),
+            'fieldName': info.field_name,
+            'returnType': str(info.return_type),
+            'startOffset': trace.offset(),
+            'duration': None,
+            'sql': {'count': 0, 'duration': 0},
+            'external': {},
+        }
+        trace.add_resolver(resolver)
+
+        def count_sql(execute, sql, params, many, context):
+            start = time.perf_counter_ns()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                resolver['sql']['count'] += 1
+                resolver['sql']['duration'] += time.perf_counter_ns() - start
+
+        def finish(value):
+            resolver['duration'] = trace.offset() - resolver['startOffset']
+            return value
+
+        def fail(error):
+            finish(None)
+            raise error
+
+        token = current_resolver.set(resolver)
+        try:
+            with connection.execute_wrapper(count_sql):
+                result = next(root, info, **args)
+        except Exception:
+            finish(None)
+            raise
+        finally:
+            current_resolver.reset(token)
+
+        # Async resolvers finish when their promise settles
+        if is_thenable(result) and not (isinstance(result, Promise) and not result.is_pending):
+            return Promise.resolve(result).then(finish, fail)
+
+        return finish(result)
@@ -2,34 +2,316 @@
 Extending the graphene GraphQLView to add custom headers to the response
 """
 
-from graphene_django.views import GraphQLView
+import asyncio
 import json
 
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult
+from graphql.execution.executors.asyncio import AsyncioExecutor
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.http.response import HttpResponseBadRequest
+from django.views.generic import View
+
+from utils.executors import CoroutineMiddleware, ExecutorMiddleware, run_sync
+from utils.queries import QueryAttributionMiddleware, operation_queries
+from utils.schema import schema
+from utils import idempotency, tracing
+
 
 class GraphQLRespondView(GraphQLView):
     def dispatch(self, request, *args, **kwargs):
+        # Requests sent with an Idempotency-Key header are executed once
+        return idempotency.handle(
+            request, lambda: self.dispatch_once(request, *args, **kwargs))
+
+    def dispatch_once(self, request, *args, **kwargs):
         response = super().dispatch(request, *args, **kwargs)
+        return self.set_response_status(request, response)
+
+    def get_middleware(self, request):
+        # Coroutine resolvers need to be run to completion by the sync view
+        return [CoroutineMiddleware()] + self.get_common_middleware(request)
+
+    def get_common_middleware(self, request):
+        middleware = list(super().get_middleware(request) or [])
+        middleware.append(QueryAttributionMiddleware())
+
+        if tracing.is_tracing_enabled():
+            middleware.append(tracing.TracingMiddleware())
+
+        return middleware
 
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        trace, token = tracing.start_trace(
+            operation_name,
+            debug=tracing.is_tracing_enabled() and tracing.is_debug_request(request),
+        )
+        try:
+            with operation_queries(operation_name):
+                return super().execute_graphql_request(
+                    request, data, query, variables, operation_name, show_graphiql)
+        finally:
+            tracing.finish_trace(request, trace, token)
+
+    def json_encode(self, request, d, pretty=False):
+        # Debug requests get the trace of the operation in the extensions
+        trace = tracing.pop_trace(request)
+        if trace is not None:
+            d = dict(d, extensions={'tracing': trace.to_apollo()})
+
+        return super().json_encode(request, d, pretty)
+
+    def set_response_status(self, request, response):
+        """
+        Sets the status code of the response to the highest status code
+        found in the extensions of the errors.
+        """
         if request.method == 'POST':
             # Parse the http response and check for errors
             response_data = json.loads(response.content)
-            response_statuses = []
 
-            # If errors array exist get the length and loop through it
-            if 'errors' in response_data:
-                errors = response_data['errors']
-                errors_length = len(errors)
-                for i in range(errors_length):
-                    # Check if the extensions key exists
-                    if 'extensions' in errors[i]:
-                        # Check if the status key exists
-                        if 'status' in errors[i]['extensions']:
-                            # Append the status code to the array
-                            response_statuses.append(
-                                errors[i]['extensions']['status'])
+            # Batched requests respond with one result per operation
+            if not isinstance(response_data, list):
+                response_data = [response_data]
+
+            response_statuses = []
+            retry_after = []
+            for result in response_data:
+                response_statuses.extend(self.get_error_statuses(result))
+                retry_after.extend(
+                    error['extensions']['retry_after']
+                    for error in result.get('errors', [])
+                    if 'retry_after' in error.get('extensions', {})
+                )
 
             # Set the response.status_code to the highest status code in the array
             if response_statuses:
                 response.status_code = max(response_statuses)
 
+            # Throttled operations tell the client when to retry
+            if retry_after:
+                response['Retry-After'] = str(max(retry_after))
+
         return response
+
+    @staticmethod
+    def get_error_statuses(result):
+        """
+        Returns the status codes set in the extensions of the errors of a
+        single operation result.
+        """
+        response_statuses = []
+
+        # If errors array exist loop through it
+        for error in result.get('errors', []):
+            # Check if the extensions key exists
+            if 'extensions' in error:
+                # Check if the status key exists
+                if 'status' in error['extensions']:
+                    # Append the status code to the array
+                    response_statuses.append(error['extensions']['status'])
+
+        return response_statuses
+
+
+class AsyncGraphQLRespondView(GraphQLRespondView):
+    """
+    Async version of the GraphQLRespondView.
+
+    Under ASGI the request is handled on the event loop instead of hopping
+    to a thread. Coroutine resolvers run on the loop, blocking resolvers are
+    sent to the bounded executor by the ExecutorMiddleware. The operations
+    of a batch are executed in order, so a batch behaves exactly like the
+    same operations sent one after the other.
+
+    GraphiQL is not served by this view, use the sync views for it.
+    """
+
+    # Use the default dispatch, it routes to the async handlers below
+    dispatch = View.dispatch
+
+    async def get(self, request, *args, **kwargs):
+        return await self.dispatch_async(request)
+
+    async def post(self, request, *args, **kwargs):
+        return await idempotency.ahandle(
+            request, lambda: self.dispatch_async(request))
+
+    def get_middleware(self, request):
+        middleware = self.get_common_middleware(request)
+
+        # The last middleware wraps all the others, so every middleware
+        # runs next to the resolver, in the worker thread when it blocks
+        return middleware + [ExecutorMiddleware()]
+
+    async def dispatch_async(self, request):
+        try:
+            data = self.parse_body(request)
+
+            if self.batch:
+                responses = [
+                    await self.get_async_response(request, entry) for entry in data
+                ]
+                result = "[{}]".format(
+                    ",".join([response[0] for response in responses])
+                )
+                status_code = (
+                    responses
+                    and max(responses, key=lambda response: response[1])[1]
+                    or 200
+                )
+            else:
+                result, status_code = await self.get_async_response(request, data)
+
+            response = HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+
+        return self.set_response_status(request, response)
+
+    async def get_async_response(self, request, data):
+        query, variables, operation_name, id = self.get_graphql_params(
+            request, data)
+
+        execution_result = await self.execute_graphql_request_async(
+            request, query, variables, operation_name
+        )
+
+        status_code = 200
+        response = {}
+
+        if execution_result.errors:
+            response["errors"] = [
+                self.format_error(e) for e in execution_result.errors
+            ]
+
+        if execution_result.invalid:
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+
+        if self.batch:
+            response["id"] = id
+            response["status"] = status_code
+
+        return self.json_encode(request, response), status_code
+
+    async def execute_graphql_request_async(self, request, query, variables, operation_name):
+        debug = False
+        if tracing.is_tracing_enabled():
+            debug = await run_sync(tracing.is_debug_request, request)
+
+        trace, token = tracing.start_trace(operation_name, debug=debug)
+        try:
+            with operation_queries(operation_name):
+                return await self._execute_graphql_request_async(
+                    request, query, variables, operation_name)
+        finally:
+            tracing.finish_trace(request, trace, token)
+
+    async def _execute_graphql_request_async(self, request, query, variables, operation_name):
+        if not query:
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        try:
+            backend = self.get_backend(request)
+            document = backend.document_from_string(self.schema, query)
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+
+        if request.method.lower() == "get":
+            operation_type = document.get_operation_type(operation_name)
+            if operation_type and operation_type != "query":
+                raise HttpError(
+                    HttpResponseNotAllowed(
+                        ["POST"],
+                        "Can only perform a {} operation from a POST request.".format(
+                            operation_type
+                        ),
+                    )
+                )
+
+        try:
+            operation_type = document.get_operation_type(operation_name)
+            if operation_type == "mutation" and self.is_atomic_mutation():
+                # The transaction is bound to a thread, the whole mutation
+                # runs in one executor thread, as the sync view runs it
+                return await run_sync(
+                    self.execute_atomic_mutation,
+                    request, document, variables, operation_name,
+                )
+
+            return await document.execute(
+                root_value=self.get_root_value(request),
+                variable_values=variables,
+                operation_name=operation_name,
+                context_value=self.get_context(request),
+                middleware=self.get_middleware(request),
+                executor=AsyncioExecutor(loop=asyncio.get_running_loop()),
+                return_promise=True,
+            )
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+
+    @staticmethod
+    def is_atomic_mutation():
+        return (
+            graphene_settings.ATOMIC_MUTATIONS is True
+            or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+        )
+
+    def execute_atomic_mutation(self, request, document, variables, operation_name):
+        """
+        Executes a mutation in a transaction, rolled back when a mutation
+        flags its errors on the request (MUTATION_ERRORS_FLAG).
+
+        Runs in an executor thread, the resolvers are sync there and the
+        coroutine ones are run to completion by the sync middleware.
+        """
+        with transaction.atomic():
+            result = document.execute(
+                root_value=self.get_root_value(request),
+                variable_values=variables,
+                operation_name=operation_name,
+                context_value=self.get_context(request),
+                middleware=super().get_middleware(request),
+            )
+            if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                transaction.set_rollback(True)
+
+        return result
+
+
+async def graphql_view(request):
+    """
+    Combined endpoint for the accounts and otp schemas.
+
+    The endpoint accepts a JSON array of operations per POST and returns an
+    array of results, in the same order. All operations are executed in the
+    same request context, so the Authorization header is validated once and
+    shared by every private mutation in the batch.
+
+    ```
+    [
+        {"query": "mutation { verifyToken { message } }"},
+        {"query": "mutation { validateEmail(initiate: true) { message } }"}
+    ]
+    ```
+
+    The view is async, under ASGI it is executed on the event loop.
+    """
+    return await AsyncGraphQLRespondView.as_view(batch=True, schema=schema)(request)
+
+
+# Async views can not be wrapped by csrf_exempt, mark the view directly
+graphql_view.csrf_exempt = True